@@ -72,5 +72,6 @@ def setup(ctx: AppContext) -> None:
         print(f"Failed to load plugin config {CONFIG!r}: {exc}", file=sys.stderr)
         return
     ids = {sensor.setting.entrance_id, sensor.setting.patio_door_id}
-    ctx.api.add_listener(partial(plugins._on_sensor_event, ctx, sensor, ids))
+    # full: each battery report counts, even when it repeats the last level
+    ctx.api.add_listener(partial(plugins._on_sensor_event, ctx, sensor, ids), devices=ids, full=True)
     ctx.api.add_state_provider("Entrance Sensors", partial(plugins.battery_state, ctx, ids))
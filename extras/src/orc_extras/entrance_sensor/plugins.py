@@ -104,7 +104,6 @@ def _run_trigger_sensor_off(sensor: SimpleNamespace, log_entry: m.LogEntry, *, c
 
 
 def battery_state(ctx: m.AppContext, sensor_ids: set[int]) -> list[dict[str, Any]]:
-    devices = ctx.api.device_states()
     return [
         {
             "name": d.name,
@@ -112,7 +111,7 @@ def battery_state(ctx: m.AppContext, sensor_ids: set[int]) -> list[dict[str, Any
             "last_activity": d.last_activity,
         }
         for device_id in sorted(sensor_ids)
-        if (d := _sensor(devices, device_id)) is not None
+        if (d := ctx.api.device_state(device_id)) is not None
         for battery in (d.attributes.get("battery"),)
     ]
 
@@ -121,14 +120,10 @@ def _door_open(ctx: m.AppContext, sensor: SimpleNamespace) -> bool:
     # An open entrance door means someone is around even if presence hasn't seen them.
     # A door never seen over MQTT reads as closed, falling back to the presence-only
     # decision like the old unreachable-hub path.
-    device = _sensor(ctx.api.device_states(), sensor.setting.patio_door_id)
+    device = ctx.api.device_state(sensor.setting.patio_door_id)
     return device is not None and device.attributes.get("contact") == "open"
 
 
-def _sensor(devices: Sequence[m.DeviceState], device_id: int) -> m.DeviceState | None:
-    return next((d for d in devices if d.id == device_id), None)
-
-
 def _timed_rows(ctx: m.AppContext, sensor: SimpleNamespace) -> tuple[str, Sequence[Any]]:
     # First group whose window contains now wins; a group's window is its first row.
     t = ctx.api.local_now().time()
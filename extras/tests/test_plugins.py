@@ -92,6 +92,7 @@ def plugin_ctx():
     mock.api.last_seen.return_value = []
     mock.api.check_presence.return_value = set()
     mock.api.capture_sounds.return_value = MagicMock(items=[])
+    mock.api.device_state.return_value = None
     return mock
 
 
@@ -249,7 +250,7 @@ def test_empty_quiet_house_shuts_down_and_snapshots(sensor, plugin_ctx):
 
 
 def _seed_devices(plugin_ctx, *devices):
-    plugin_ctx.api.device_states.return_value = list(devices)
+    plugin_ctx.api.device_state.side_effect = {d.id: d for d in devices}.get
 
 
 def _door(state):
@@ -0,0 +1,54 @@
+"""Throughput of orc.dal.audio._scale_int16 against the per-sample loop it replaced.
+
+Scales the bundled alert.wav and two seconds of synthetic Piper-shaped speech (22.05
+kHz mono) at the announcement gain, best of --repeat runs each, and prints samples/s.
+
+Usage:
+    PYTHONPATH=src:data/src:extras/src python scripts/bench_audio_scale.py [--repeat 5]
+"""
+
+import argparse
+import array
+import time
+import wave
+from collections.abc import Callable
+from pathlib import Path
+
+from orc.dal import audio
+
+_GAIN = 0.6
+
+
+def _reference_scale(frames: bytes, gain: float) -> bytes:
+    samples = array.array("h", frames)
+    for i, s in enumerate(samples):
+        samples[i] = max(-32768, min(32767, int(s * gain)))
+    return samples.tobytes()
+
+
+def _rate(fn: Callable[[bytes, float], bytes], frames: bytes, repeat: int) -> float:
+    """Samples per second, best of ``repeat``."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(frames, _GAIN)
+        best = min(best, time.perf_counter() - start)
+    return len(frames) // 2 / best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with wave.open(str(Path(audio.__file__).parents[1] / "static" / "alert.wav"), "rb") as wf:
+        alert = wf.readframes(wf.getnframes())
+    tts = array.array("h", ((i * 7919) % 65536 - 32768 for i in range(2 * 22050))).tobytes()
+    print(f"{'source':8}{'vectorized':>16}{'per-sample':>16}{'speedup':>10}  (samples/s)")
+    for label, frames in (("alert", alert), ("tts", tts)):
+        vectorized, reference = _rate(audio._scale_int16, frames, args.repeat), _rate(_reference_scale, frames, args.repeat)
+        print(f"{label:8}{vectorized:16,.0f}{reference:16,.0f}{vectorized / reference:9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Per-call latency of orc.dal.sqlite, fresh connection per call vs. the pooled one.
+
+"fresh" replays the old connection(): sqlite3.connect() + close around every
+statement. "pooled" goes through orc.dal.sqlite.connection(), which keeps one WAL
+connection (and its statement cache) per thread. Both run the same duration upsert
+and presence select against a scratch database.
+
+Usage:
+    PYTHONPATH=src:data/src:extras/src python scripts/bench_sqlite.py [--calls 2000]
+"""
+
+import argparse
+import sqlite3
+import statistics
+import tempfile
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from typing import Any
+
+from sqlalchemy.engine.url import make_url
+
+from orc import config
+from orc.dal import sqlite
+
+_UPSERT = "INSERT INTO orc_durations (name, samples, avg) VALUES (?, 1, ?) ON CONFLICT(name) DO UPDATE SET samples = samples + 1"
+
+
+@contextmanager
+def _fresh() -> Iterator[sqlite3.Connection]:
+    conn = sqlite3.connect(make_url(config.settings.jobs_db).database or "")
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _upsert(connection: Callable[[], Any]) -> None:
+    with connection() as conn:
+        conn.execute(_UPSERT, ("bench", 1.0))
+
+
+def _select(connection: Callable[[], Any]) -> None:
+    with connection() as conn:
+        conn.execute("SELECT name, last_seen FROM orc_presence").fetchall()
+
+
+def _time(fn: Callable[[], object], calls: int) -> list[float]:
+    samples = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config.settings = config.settings._replace(jobs_db=f"sqlite:///{tmp}/bench.sqlite")
+        sqlite.init_db()
+        cases: list[tuple[str, Callable[[], object]]] = [
+            ("upsert  fresh ", lambda: _upsert(_fresh)),
+            ("upsert  pooled", lambda: _upsert(sqlite.connection)),
+            ("select  fresh ", lambda: _select(_fresh)),
+            ("select  pooled", lambda: _select(sqlite.connection)),
+        ]
+        print(f"{args.calls} calls each; per-call latency in microseconds")
+        print(f"{'case':16}{'median':>10}{'p95':>10}{'mean':>10}")
+        for label, fn in cases:
+            samples = sorted(_time(fn, args.calls))
+            p95 = samples[int(len(samples) * 0.95)]
+            print(f"{label:16}{statistics.median(samples) * 1e6:10.1f}{p95 * 1e6:10.1f}{statistics.fmean(samples) * 1e6:10.1f}")
+
+
+if __name__ == "__main__":
+    main()
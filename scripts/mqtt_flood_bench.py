@@ -0,0 +1,114 @@
+"""Throughput of the MQTT subscriber on a boot flood of retained device documents.
+
+Feeds ``hubitat/<hub>/devices/<id>`` documents to the subscriber's message handler the
+way paho would and reports messages/sec for the three floods a restart sees: first
+sightings (cold cache), a byte-identical replay (reconnect, hub reboot), and a pass
+where every document changes one attribute, with one listener subscribed to all.
+
+The flood is either synthesized or captured from the broker, one ``topic payload`` per
+line as ``mosquitto_sub -v`` prints it:
+    mosquitto_sub -h <hub broker> -t 'hubitat/+/devices/+' -v --retained-only -W 5 > flood.txt
+
+Usage:
+    PYTHONPATH=src:data/src:extras/src python scripts/mqtt_flood_bench.py [--capture flood.txt] [--devices 150] [--repeat 5]
+"""
+
+import argparse
+import json
+import time
+from collections.abc import Callable
+from types import SimpleNamespace
+
+from orc.dal.mqtt import hubitat
+from orc.dal.mqtt.store import DeviceStore
+
+_HUB = "00000000-0000-0000-0000-000000000000"
+_ATTRIBUTES = ("switch", "level", "colorTemperature", "colorMode", "hue", "saturation", "battery", "motion", "contact")
+
+
+type Flood = list[tuple[str, bytes]]
+
+
+def synthesize(devices: int) -> Flood:
+    flood = []
+    for id in range(1, devices + 1):
+        doc = {
+            "id": id,
+            "name": f"device {id}",
+            "lastActivity": "2026-07-29T00:00:00+0000",
+            "attributes": [{"name": a, "value": str(id % 7), "dataType": "STRING", "unit": None} for a in _ATTRIBUTES],
+        }
+        flood.append((f"hubitat/{_HUB}/devices/{id}", json.dumps(doc).encode()))
+    return flood
+
+
+def load(path: str) -> Flood:
+    with open(path, "rb") as f:
+        return [(topic.decode(), payload) for topic, _, payload in (line.rstrip(b"\n").partition(b" ") for line in f) if payload]
+
+
+def changed(flood: Flood) -> Flood:
+    """The flood with the first attribute of every document given a new value."""
+    out = []
+    for topic, payload in flood:
+        doc = json.loads(payload)
+        if doc.get("attributes"):
+            doc["attributes"][0]["value"] = f"{doc['attributes'][0]['value']}-changed"
+        out.append((topic, json.dumps(doc).encode()))
+    return out
+
+
+def replay(flood: Flood) -> float:
+    """Seconds to deliver the flood."""
+    messages = [SimpleNamespace(topic=topic, payload=payload, retain=True) for topic, payload in flood]
+    started = time.perf_counter()
+    for msg in messages:
+        hubitat._on_message(None, None, msg)
+    return time.perf_counter() - started
+
+
+def best(repeat: int, setup: Callable[[], None], flood: Flood) -> float:
+    times = []
+    for _ in range(repeat):
+        setup()
+        times.append(replay(flood))
+    return min(times)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--capture", help="mosquitto_sub -v output to replay (default: synthesized documents)")
+    parser.add_argument("--devices", type=int, default=150, help="synthesized devices (default: 150)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per flood; the best is reported (default: 5)")
+    args = parser.parse_args()
+
+    flood = load(args.capture) if args.capture else synthesize(args.devices)
+    updates = changed(flood)
+    events = 0
+
+    def on_event(*_: object) -> None:
+        nonlocal events
+        events += 1
+
+    hubitat.add_listener(on_event)
+
+    def cold() -> None:
+        hubitat._devices, hubitat._payloads = DeviceStore(), {}
+
+    def warm() -> None:
+        cold()
+        replay(flood)
+
+    results = {
+        "first sighting": best(args.repeat, cold, flood),
+        "replay": best(args.repeat, warm, flood),
+        "changed": best(args.repeat, warm, updates),
+    }
+    print(f"{len(flood)} documents, best of {args.repeat}:")
+    for name, seconds in results.items():
+        print(f"  {name:<15} {len(flood) / seconds:10.0f} msg/s  {seconds * 1000:8.1f} ms")
+    print(f"  listener events: {events // args.repeat} per changed flood")
+
+
+if __name__ == "__main__":
+    main()
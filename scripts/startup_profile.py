@@ -0,0 +1,54 @@
+"""Import-time breakdown of an orc process, grouped by top-level package.
+
+Runs ``python -X importtime -c "import <module>"`` in a fresh interpreter and sums
+each module's self time under its top-level package (skyfield, piper, pychromecast,
+scapy, ...), so a dependency that starts loading eagerly shows up as a jump in its
+row. With --budget-ms the script exits non-zero when the total exceeds the budget.
+
+Usage:
+    PYTHONPATH=src:data/src:extras/src python scripts/startup_profile.py [--module orc.runner] [--top 15] [--budget-ms 3000]
+"""
+
+import argparse
+import subprocess
+import sys
+from collections import defaultdict
+
+
+def profile(module: str) -> dict[str, float]:
+    """Top-level package -> summed self import time in milliseconds."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        sys.exit(f"import {module} failed:\n{result.stderr[-2000:]}")
+    totals: defaultdict[str, float] = defaultdict(float)
+    for line in result.stderr.splitlines():
+        # "import time:       self [us] |  cumulative | imported package"
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line.removeprefix("import time:").split("|")
+        totals[name.strip().split(".")[0]] += int(self_us) / 1000
+    return dict(totals)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="orc.api", help="module whose import is profiled (default: orc.api)")
+    parser.add_argument("--top", type=int, default=15, help="packages to list (default: 15)")
+    parser.add_argument("--budget-ms", type=float, help="fail when the total import time exceeds this")
+    args = parser.parse_args()
+
+    totals = profile(args.module)
+    total = sum(totals.values())
+    print(f"import {args.module}: {total:.0f} ms across {len(totals)} top-level packages")
+    for name, ms in sorted(totals.items(), key=lambda e: e[1], reverse=True)[: args.top]:
+        print(f"  {ms:8.1f} ms  {ms / total:6.1%}  {name}")
+    if args.budget_ms is not None and total > args.budget_ms:
+        sys.exit(f"import time {total:.0f} ms exceeds budget {args.budget_ms:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
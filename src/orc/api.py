@@ -2,42 +2,34 @@ import contextlib
 import math
 import threading
 import time
-from collections.abc import Callable, Iterator, Sequence
-from concurrent.futures import ThreadPoolExecutor as Pool
+from collections.abc import Callable, Iterable, Iterator, Mapping, Sequence
 from dataclasses import replace
 from datetime import date, datetime, timedelta
 from enum import Enum
-from importlib import resources  # nosemgrep: python37-compatibility-importlib2
-from typing import Any
-from urllib.parse import urlparse
+from functools import partial
+from types import MappingProxyType
+from typing import Any, NamedTuple
+from urllib.parse import parse_qs, urlparse
 
 from apscheduler.executors.pool import ThreadPoolExecutor
 from apscheduler.job import Job
 from apscheduler.schedulers.base import BaseScheduler
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.date import DateTrigger
-from skyfield import almanac
-from skyfield.api import load, load_file, wgs84
 
 import orc
-from orc import config
+from orc import config, ephemeris, metrics
 from orc import model as m
-from orc import plugins
-from orc.dal import net, sqlite
+from orc import plugins, streams, workers
+from orc.dal import durations, net, sqlite
 from orc.dal.audio import play_alert, play_text  # noqa: F401
 from orc.dal.sqlite import connection  # noqa: F401
 from orc.dal.sqlite import init_db  # noqa: F401
 from orc.dal.sqlite import delete_theme_override as clear_theme_override  # noqa: F401
-from orc.dal.sqlite import fetch_durations as _fetch_durations
 from orc.dal.sqlite import fetch_presence as last_seen  # noqa: F401
 from orc.dal.sqlite import insert_presence as mark_present
-from orc.dal.sqlite import update_avg
 from orc.declarations import Declarations
-from orc.decorators import (
-    requires_ctx,
-    synchronized,
-    unwrap_rule_container,
-)
+from orc.decorators import requires_ctx, synchronized
 from orc.locale import Log
 from orc.security import safe_domain
 
@@ -45,30 +37,63 @@ JOBSTORE_DEFAULT = "default"
 JOBSTORE_MEMORY = "memory"
 
 _PRESENCE_WINDOW = timedelta(hours=9)
+_PREFETCH_AHEAD = timedelta(minutes=10)  # resolve streams for routines firing this soon; scanned every 5 minutes
 _ACTIVITY_LOG = m.ActivityLog()
+_DISPATCH_PLAN = metrics.counter("dispatch_plan")  # steps sent / dropped as already in effect
+_BUTTON_QUEUE = 8  # presses run actions, which dispatch, so they wait off the mqtt thread
+_EXTERNAL_QUEUE = 64  # external-change logging takes the activity log lock
 _WEATHER_TRIGGERS: frozenset[str] = frozenset(wc.value for wc in m.WeatherCondition)
 
 _STREAM_DOMAINS: set[str] = {".googlevideo.com", urlparse(config.settings.base_url).hostname or "", "." + config.settings.lan_domain}
 
-_TIMESCALE = load.timescale()
-_EPHEMERIS = load_file(str(resources.files("orc_data") / "de421.bsp"))
-_TWILIGHT_FN = almanac.dark_twilight_day(_EPHEMERIS, wgs84.latlon(config.settings.lat, config.settings.long))
 
+class _DurationViews(NamedTuple):
+    version: int
+    stats: Mapping[str, tuple[int, float]]
+    rounded: tuple[tuple[str, int], ...]
 
-def duration_stats() -> dict[str, tuple[int, float]]:
+
+# Page renders read durations on every load; rebuild the derived views only when the
+# stats change (durations.version() moves on every update_avg), never per request.
+_duration_views: _DurationViews | None = None
+_DURATION_CACHE = metrics.counter("duration_cache")
+
+
+def _durations() -> _DurationViews:
+    global _duration_views
+    views = _duration_views
+    if views is not None and views.version == durations.version():
+        _DURATION_CACHE.inc("hits")
+        return views
+    version, stats = durations.versioned_stats()
+    views = _DurationViews(version, MappingProxyType(stats), tuple((name, math.ceil(avg)) for name, (_, avg) in stats.items()))
+    _duration_views = views
+    _DURATION_CACHE.inc("reloads")
+    return views
+
+
+def duration_stats() -> Mapping[str, tuple[int, float]]:
     """name -> (samples, average seconds); job names and command topics alike."""
-    return {name: (samples, avg) for name, samples, avg in _fetch_durations()}
+    return _durations().stats
 
 
-def fetch_durations() -> list[tuple[str, int]]:
-    return [(name, math.ceil(avg)) for name, (_, avg) in duration_stats().items()]
+def duration_cache_stats() -> dict[str, int]:
+    return {"hits": _DURATION_CACHE.get("hits"), "reloads": _DURATION_CACHE.get("reloads")}
+
+
+def metrics_snapshot() -> dict[str, dict[str, Any]]:
+    return metrics.snapshot()
+
+
+def fetch_durations() -> tuple[tuple[str, int], ...]:
+    return _durations().rounded
 
 
 @contextlib.contextmanager
 def record_duration(name: str) -> Iterator[None]:
     start = time.perf_counter()
     yield
-    update_avg(name, time.perf_counter() - start)
+    durations.update_avg(name, time.perf_counter() - start)
 
 
 class ContextThreadPoolExecutor(ThreadPoolExecutor):
@@ -114,14 +139,29 @@ def log_entries() -> list[m.LogEntry]:
 # --- Device control ---
 
 
-def add_listener(fn: m.Listener) -> None:
-    config.providers.mqtt.add_listener(fn)
+def add_listener(
+    fn: m.Listener,
+    devices: Iterable[int] | None = None,
+    attributes: Iterable[str] | None = None,
+    queue: int | None = None,
+    coalesce: bool = False,
+    full: bool = False,
+) -> None:
+    config.providers.mqtt.add_listener(fn, devices, attributes, queue, coalesce, full)
 
 
 def device_states() -> list[m.DeviceState]:
     return config.providers.mqtt.snapshot()
 
 
+def device_state(id: int) -> m.DeviceState | None:
+    return config.providers.mqtt.device_state(id)
+
+
+def device_changes(version: int) -> tuple[int, list[m.DeviceState]]:
+    return config.providers.mqtt.changed_since(version)
+
+
 def capture_lights() -> m.Configs:
     return config.providers.mqtt.fetch_light_states(tuple(orc.Light))
 
@@ -129,8 +169,11 @@ def capture_lights() -> m.Configs:
 def capture_sounds() -> m.Configs[m.SoundState]:
     if not len(orc.Chromecast):
         return m.Configs()
-    with Pool(max_workers=len(orc.Chromecast)) as ex:
-        return m.Configs(*ex.map(config.providers.chromecast.fetch_state, orc.Chromecast))
+    # Served from the provider's status cache; only devices without a fresh entry are polled.
+    states = {w: config.providers.chromecast.cached_state(w) for w in orc.Chromecast}
+    if stale := [w for w, state in states.items() if state is None]:
+        states.update(zip(stale, workers.run([(type(w).__name__, partial(config.providers.chromecast.fetch_state, w)) for w in stale])))
+    return m.Configs(*(state for state in states.values() if state is not None))
 
 
 # Dispatch handlers keyed by device-type name in orc.declarations. Each takes the
@@ -144,6 +187,43 @@ def _dispatch_light(ctx: m.AppContext, w: m.DeviceEnum, rule: m.Config, stream:
         config.providers.mqtt.publish_light(w, on=rule.state == m.ON)
 
 
+def _light_unchanged(w: m.DeviceEnum, rule: m.Config) -> bool:
+    current = config.providers.mqtt.light_state(w)
+    if current is None:
+        return False
+    elif rule.state in (m.OFF, 0):
+        return current == m.OFF
+    elif rule.state == m.ON:
+        return current != m.OFF
+    elif isinstance(rule.state, int) and m.Capability.change_level in w.capabilities:
+        return isinstance(current, int) and abs(current - rule.state) <= 1  # drivers round through the 0-254 scale
+    return rule.state == 100 and current != m.OFF
+
+
+def _chromecast_unchanged(w: m.DeviceEnum, rule: m.Config) -> bool:
+    # The status cache only: a device with no fresh status is sent the step rather than polled.
+    current = config.providers.chromecast.cached_state(w)
+    if current is None:
+        return False
+    elif isinstance(rule.state, int):
+        return current.volume == rule.state
+    elif rule.state == m.STOP:
+        return current.content is None
+    elif rule.state in (m.PAUSE, m.RESUME):
+        return False
+    elif "http" in rule.state:
+        return current.content == rule.state
+    # A YouTube id plays the URL streams last resolved it to. The status cache keeps
+    # googlevideo URLs stripped to their id= parameter, so compare on host, path and id.
+    url = streams.cached(rule.state)
+    return url is not None and current.content is not None and _stream_key(current.content) == _stream_key(url)
+
+
+def _stream_key(url: str) -> tuple[str, str, list[str] | None]:
+    parsed = urlparse(url)
+    return parsed.netloc, parsed.path, parse_qs(parsed.query).get("id")
+
+
 def _dispatch_chromecast(ctx: m.AppContext, w: m.DeviceEnum, rule: m.Config, stream: dict[Any, tuple[str, str]]) -> None:
     if isinstance(rule.state, int):
         config.providers.chromecast.set_volume(w, rule.state)
@@ -157,9 +237,7 @@ def _dispatch_chromecast(ctx: m.AppContext, w: m.DeviceEnum, rule: m.Config, str
         if rule.state not in stream:
             # rule.state is a stream URL or YouTube id (str) in this branch; Config.state is typed object
             stream[rule.state] = (
-                (safe_domain(rule.state, _STREAM_DOMAINS), rule.state)
-                if "http" in rule.state
-                else config.providers.chromecast.fetch_youtube_stream_metadata(rule.state)
+                (safe_domain(rule.state, _STREAM_DOMAINS), rule.state) if "http" in rule.state else streams.resolve(rule.state)
             )
         config.providers.chromecast.play(w, *stream[rule.state])
 
@@ -169,8 +247,8 @@ def add_state_provider(title: str, provider: Callable[[], Any]) -> None:
 
 
 def declare_core(declarations: Declarations) -> None:
-    declarations.declare_dispatch("Light", _dispatch_light)
-    declarations.declare_dispatch("Chromecast", _dispatch_chromecast)
+    declarations.declare_dispatch("Light", _dispatch_light, unchanged=_light_unchanged)
+    declarations.declare_dispatch("Chromecast", _dispatch_chromecast, unchanged=_chromecast_unchanged)
 
 
 def resolve_run_action(
@@ -224,7 +302,7 @@ def wire_buttons(ctx: m.AppContext) -> None:
         if action is not None and not run_action(ctx, action, hub_origin=True):
             log(m.LogSource.SYSTEM, Log.BUTTON_ACTION_UNKNOWN.format(id=action))
 
-    config.providers.mqtt.add_button_listener(on_button)
+    config.providers.mqtt.add_button_listener(on_button, queue=_BUTTON_QUEUE)
 
 
 def wire_external_log() -> None:
@@ -239,17 +317,23 @@ def wire_external_log() -> None:
             last = log(m.LogSource.EXTERNAL, Log.EXTERNAL_DETECTED)
         last.add(m.LogSource.EXTERNAL, action)
 
-    config.providers.mqtt.add_external_listener(on_external)
+    config.providers.mqtt.add_external_listener(on_external, queue=_EXTERNAL_QUEUE)
 
 
-@unwrap_rule_container
-def dispatch(rule: m.Config, force: bool = False, entry: m.LogEntry | None = None) -> None:
-    if not force and snapshot_manager.intercepts(rule):
-        return
-    what = [rule.what] if isinstance(rule.what, Enum) else rule.what
+def dispatch(rules: m.Config | m.Configs | m.Routine, force: bool = False, entry: m.LogEntry | None = None, diff: bool = False) -> None:
+    """Send the rules' steps; ``diff`` sends only those that would change something.
+    ``force`` bypasses the snapshot intercept."""
+    plan, unchanged = plan_dispatch(rules, force, diff)
+    if entry is not None:
+        if plan:
+            described = ", ".join(f"`{w.name}` {' → '.join(str(rule.state) for rule in chain)}" for w, chain in plan.items())
+            entry.add(m.LogSource.SYSTEM, Log.DISPATCH_PLAN.format(steps=described))
+        if unchanged:
+            described = ", ".join(f"`{w.name}` {rule.state}" for w, rule in unchanged)
+            entry.add(m.LogSource.SYSTEM, Log.DISPATCH_UNCHANGED.format(count=len(unchanged), steps=described))
     stream: dict[Any, tuple[str, str]] = {}
 
-    def one(w: m.DeviceEnum) -> None:
+    def steps(w: m.DeviceEnum) -> None:
         if w in config.virtual_devices:
             if entry is not None:
                 entry.add(m.LogSource.SYSTEM, Log.VIRTUAL_DEVICE_SKIPPED.format(device=w.name))
@@ -258,17 +342,48 @@ def dispatch(rule: m.Config, force: bool = False, entry: m.LogEntry | None = Non
         device_type = config.registry.devices.get(type(w).__name__)
         if device_type is None or device_type.dispatch is None:
             raise Exception("Unknown type")
-        try:
-            device_type.dispatch(config.registry.ctx, w, rule, stream)
-        except Exception as exc:
-            action = Log.DISPATCH_FAILED.format(device=w.name, exc=exc)
-            if entry is not None:
-                entry.add(m.LogSource.SYSTEM, action)
-            else:
-                log(m.LogSource.SYSTEM, action)
-
-    with Pool(max_workers=max(1, len(what))) as ex:
-        list(ex.map(one, what))
+        for rule in plan[w]:
+            try:
+                device_type.dispatch(config.registry.ctx, w, rule, stream)
+            except Exception as exc:
+                action = Log.DISPATCH_FAILED.format(device=w.name, exc=exc)
+                if entry is not None:
+                    entry.add(m.LogSource.SYSTEM, action)
+                else:
+                    log(m.LogSource.SYSTEM, action)
+
+    workers.run([(type(w).__name__, partial(steps, w)) for w in plan])
+
+
+def plan_dispatch(
+    rules: m.Config | m.Configs | m.Routine, force: bool = False, diff: bool = False
+) -> tuple[dict[m.DeviceEnum, list[m.Config]], list[tuple[m.DeviceEnum, m.Config]]]:
+    """Each device's steps, in the order they must run, and the steps dropped as no-ops.
+
+    Devices are independent of each other; a device's steps are a chain (the stop or
+    volume squish_configs puts ahead of its play/on). With ``diff``, leading steps the
+    device type's ``unchanged`` check says are already in effect are dropped; the first
+    step that changes something keeps the rest, since their effect then depends on it.
+    Without it every step is kept: the cached state can disagree with the device, and
+    a user pressing a button expects the command to go out.
+    """
+    plan: dict[m.DeviceEnum, list[m.Config]] = {}
+    for rule in rules.items if isinstance(rules, m.Configs | m.Routine) else (rules,):
+        if not force and snapshot_manager.intercepts(rule):
+            continue
+        for w in [rule.what] if isinstance(rule.what, Enum) else rule.what:
+            plan.setdefault(w, []).append(rule)
+    unchanged: list[tuple[m.DeviceEnum, m.Config]] = []
+    for w, chain in list(plan.items()):
+        device_type = config.registry.devices.get(type(w).__name__)
+        check = device_type.unchanged if device_type is not None and diff else None
+        while check is not None and chain and check(w, chain[0]):
+            unchanged.append((w, chain.pop(0)))
+        if not chain:
+            del plan[w]
+    _DISPATCH_PLAN.inc("sent", sum(map(len, plan.values())))
+    _DISPATCH_PLAN.inc("unchanged", len(unchanged))
+    return plan, unchanged
 
 
 def reboot_hubitat() -> None:
@@ -426,16 +541,16 @@ def apply_theme_change(ctx: m.AppContext, name: str, start: date | None, end: da
     today = now.date()
     before = calculate_theme(today)
     if not name:
-        log(m.LogSource.MANUAL, Log.THEME_OVERRIDE_CLEARED)
+        entry = log(m.LogSource.MANUAL, Log.THEME_OVERRIDE_CLEARED)
         clear_theme_override()
     else:
         assert start is not None and end is not None  # a named theme override always carries a start/end window
         set_theme_override(name, start, end)
-        log(m.LogSource.MANUAL, Log.THEME_OVERRIDE_SET.format(name=name, start=start, end=end))
+        entry = log(m.LogSource.MANUAL, Log.THEME_OVERRIDE_SET.format(name=name, start=start, end=end))
     after = calculate_theme(today)
     rebuild_jobs(ctx)
     if before != after:
-        replay_day(now)
+        replay_day(now, entry)
 
 
 def check_presence(silent: bool = False) -> set[str]:
@@ -463,21 +578,9 @@ def get_schedule() -> list[tuple[datetime, m.Routine]]:
         now = local_now() + timedelta(days=x)
         today = now.date()
 
-        local_midnight = datetime(today.year, today.month, today.day, tzinfo=config.settings.tz)
-        day_start = _TIMESCALE.from_datetime(local_midnight)
-        day_end = _TIMESCALE.from_datetime(local_midnight + timedelta(days=1))
-
-        prev = int(_TWILIGHT_FN(day_start).item())
-        times, twilight = almanac.find_discrete(day_start, day_end, _TWILIGHT_FN)
-        sunrise = sunset = None
-
-        for t, curr in zip(times, twilight):
-            curr = int(curr)
-            if (prev, curr) == (3, 4):
-                sunrise = t.utc_datetime()
-            elif (prev, curr) == (4, 3):
-                sunset = t.utc_datetime() - timedelta(hours=1)
-            prev = curr
+        sunrise, sunset = ephemeris.sun_times(today)
+        if sunset is not None:
+            sunset -= timedelta(hours=1)
 
         if override := active_theme_override(today):
             cfg = config.themes.get(override.name)
@@ -552,6 +655,7 @@ def setup_scheduler(ctx: m.AppContext) -> None:
     for job_id, func, crontab, name in (
         ("iot-cron", rebuild_iot_schedule, "10 0 * * *", "Iot Cron"),
         ("presence-cron", _check_presence_job, "5 * * * *", "Presence Cron"),
+        ("stream-prefetch", _prefetch_streams_job, "*/5 * * * *", "Stream Prefetch"),
     ):
         ctx.scheduler.add_job(
             func,
@@ -598,6 +702,8 @@ def matching_items(rule: m.Routine, now: datetime, pnames: set[str]) -> Sequence
 @requires_ctx
 def rebuild_iot_schedule(ctx: m.AppContext) -> None:
     now = local_now()
+    for year in {now.year, (now + timedelta(days=1)).year}:
+        ephemeris.ensure_table(year)
     for run_at, rule in get_schedule():
         if now <= run_at:
             ctx.scheduler.add_job(
@@ -610,14 +716,44 @@ def rebuild_iot_schedule(ctx: m.AppContext) -> None:
             )
 
 
-def replay_day(now: datetime) -> None:
+def replay_day(now: datetime, entry: m.LogEntry | None = None) -> None:
+    """Re-send the day's schedule so far; what was skipped goes under ``entry``, the caller's log entry."""
     jobs = sorted(get_schedule(), key=lambda x: x[0])
     present = present_names()
     # replace() keeps Routine type; squish_configs only reads .items, which Routine and Configs share
     configs = (replace(cfg, items=matching_items(cfg, now, present)) for (when, cfg) in jobs if when <= now and not cfg.skip_replay)
-    dispatch(m.squish_configs(*configs), force=True)
+    # The whole day so far is re-sent, so only steps not already in effect go out.
+    dispatch(m.squish_configs(*configs), force=True, entry=entry, diff=True)
 
 
 @requires_ctx
 def _check_presence_job(ctx: m.AppContext) -> set[str]:
     return check_presence()
+
+
+@requires_ctx
+def _prefetch_streams_job(ctx: m.AppContext) -> None:
+    horizon = local_now() + _PREFETCH_AHEAD
+    ids = sorted(
+        {
+            id
+            for job in jobs_by_type(ctx.scheduler, m.IotJob)
+            if job.trigger.run_date <= horizon
+            for rule in job.args[0].rule.items
+            if (id := _stream_id(rule)) is not None
+        }
+    )
+    if ids:
+        # Off the scheduler's single worker, so a slow yt-dlp never delays the routine itself.
+        lead = _PREFETCH_AHEAD.total_seconds()
+        threading.Thread(target=streams.prefetch, args=(ids, lead), name="orc-prefetch", daemon=True).start()
+
+
+def _stream_id(rule: m.Config) -> str | None:
+    """The YouTube id a Chromecast rule plays, if it plays one (URLs and transport commands aren't resolved)."""
+    what = [rule.what] if isinstance(rule.what, Enum) else rule.what
+    if not any(type(w).__name__ == "Chromecast" for w in what):
+        return None
+    if isinstance(rule.state, int) or rule.state in (m.STOP, m.PAUSE, m.RESUME) or "http" in rule.state:
+        return None
+    return rule.state
@@ -1,82 +1,389 @@
-import array
+import atexit
 import audioop
+import hashlib
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
 import wave
-from collections.abc import Iterable
-from functools import lru_cache
+from collections import OrderedDict
+from collections.abc import Callable, Iterable, Iterator
+from functools import partial
 from importlib import resources  # nosemgrep
 from importlib.resources.abc import Traversable  # nosemgrep
 from typing import Any
 
 import pyaudio
 
-from orc import config
+from orc import config, metrics
 from orc import model as m
+from orc.dal import sqlite
 from orc.decorators import audio_lock, silence_fd
 
+_log = logging.getLogger(__name__)
+
 _MODEL_PATH: Traversable = resources.files("orc_data") / "en_GB-alba-medium.onnx"
 _CONFIG_PATH: Traversable = resources.files("orc_data") / "en_GB-alba-medium.onnx.json"
-with silence_fd(2):
-    from piper import PiperVoice
 
-    # resources.files() yields a concrete Path here; piper's stub only accepts str | Path, not the broader Traversable
-    _VOICE: Any = PiperVoice.load(_MODEL_PATH, _CONFIG_PATH, use_cuda=False)  # type: ignore[arg-type]
+# The Piper voice is an ONNX model that takes seconds to initialize, so it's loaded on
+# first use (or by warm_up() right after boot) rather than at import. A play_text that
+# arrives mid-load waits on _voice_lock for the load to finish.
+_voice: Any = None
+_voice_lock = threading.Lock()
+
+# Synthesized phrases, keyed by sha256 of the voice model and the text. Alerts repeat a
+# small set of phrases, so a hit skips Piper entirely (and doesn't wait for the voice
+# to load). The most recent phrases stay in memory; a larger set is kept in the state
+# DB so they survive restarts. A phrase is ~44 KB per second of speech.
+_PHRASE_MEMORY_ENTRIES: int = 32
+_PHRASE_DB_ENTRIES: int = 256
+_phrases: OrderedDict[str, tuple[int, bytes]] = OrderedDict()  # key -> (sample rate, pcm), least recently used first
+_phrases_lock = threading.Lock()
+_digest: str | None = None
+_digest_lock = threading.Lock()
+_phrase_stats = metrics.counter("tts_cache")
+
+# Alert WAVs decoded, gain-scaled and resampled to the output rate, so a repeat alert is
+# a straight buffer write. Keyed by (path, gain, device rate) and checked against the
+# file's mtime on every play. Only touched while holding audio_lock.
+_alerts: dict[tuple[str, float, int], tuple[int, int, bytes]] = {}  # key -> (mtime_ns, channels, pcm)
+_alert_stats = metrics.counter("alert_cache")
+
+_CHUNK_FRAMES: int = 4096
 
 
 def play_alert(path: str, level: str | None = None) -> None:
-    with wave.open(path, "rb") as wf:
-        channels, rate = wf.getnchannels(), wf.getframerate()
-        chunks = iter(lambda: wf.readframes(4096), b"")
-        _play_stream(chunks, channels, rate, _gain_for(level))
+    _submit(_Playback((), 0, 0, level, render=partial(_alert_pcm, path)))
 
 
 def play_text(text: str, level: str | None = None) -> None:
-    chunks = (a.audio_int16_bytes for a in _VOICE.synthesize(text))
-    _play_stream(chunks, 1, _VOICE.config.sample_rate, _gain_for(level))
+    key = _phrase_key(text)
+    cached = _cached_phrase(key)
+    if cached is not None:
+        rate, pcm = cached
+        _play_stream(_chunked(pcm, 1), 1, rate, level)
+        return
+    voice = _load_voice()
+    recorded: list[bytes] = []
+    chunks = (a.audio_int16_bytes for a in voice.synthesize(text))
+    _play_stream(_recording(chunks, recorded), 1, voice.config.sample_rate, level)
+    _store_phrase(key, voice.config.sample_rate, b"".join(recorded))
+
+
+def warm_up(on_loaded: Callable[[float], object] | None = None) -> threading.Thread:
+    """Load the voice on a background thread; ``on_loaded`` gets the load time in seconds."""
+
+    def load() -> None:
+        start = time.perf_counter()
+        try:
+            _model_digest()  # first: phrase-cache hits need only this, not the voice
+            _load_voice()
+        except Exception:
+            _log.exception("audio: voice warm-up failed; play_text will retry the load")
+            return
+        if on_loaded is not None:
+            on_loaded(time.perf_counter() - start)
+
+    thread = threading.Thread(target=load, name="orc-voice", daemon=True)
+    thread.start()
+    return thread
+
+
+def _load_voice() -> Any:
+    global _voice
+    if _voice is None:
+        with _voice_lock:
+            if _voice is None:
+                # The load runs while the mqtt, scheduler and web threads are up, so fd 2 is
+                # only silenced for the native import; onnxruntime's own logger keeps the
+                # session setup quiet without swallowing their stderr.
+                with silence_fd(2):
+                    import onnxruntime
+                    from piper import PiperVoice
+
+                onnxruntime.set_default_logger_severity(3)  # errors and above
+                # resources.files() yields a concrete Path here; piper's stub only accepts str | Path, not the broader Traversable
+                _voice = PiperVoice.load(_MODEL_PATH, _CONFIG_PATH, use_cuda=False)  # type: ignore[arg-type]
+    return _voice
+
+
+def _model_digest() -> str:
+    # Hashed by warm_up() before the voice loads; a play_text that arrives first computes
+    # it, and one that arrives mid-hash waits for that result instead of hashing again.
+    # Streamed: the model is ~60 MB, too much to read into memory on a Pi just to hash it.
+    global _digest
+    if _digest is None:
+        with _digest_lock:
+            if _digest is None:
+                digest = hashlib.sha256()
+                for traversable in (_MODEL_PATH, _CONFIG_PATH):
+                    with resources.as_file(traversable) as path, path.open("rb") as f:
+                        digest.update(hashlib.file_digest(f, "sha256").digest())
+                _digest = digest.hexdigest()
+    return _digest
+
+
+def _phrase_key(text: str) -> str:
+    return hashlib.sha256(f"{_model_digest()}\0{text}".encode()).hexdigest()
+
+
+def _cached_phrase(key: str) -> tuple[int, bytes] | None:
+    with _phrases_lock:
+        cached = _phrases.get(key)
+        if cached is not None:
+            _phrases.move_to_end(key)
+    if cached is not None:
+        _phrase_stats.inc("hit")
+        return cached
+    cached = sqlite.fetch_tts_phrase(key)
+    if cached is None:
+        _phrase_stats.inc("miss")
+        return None
+    _phrase_stats.inc("db_hit")
+    _remember_phrase(key, cached)
+    return cached
+
+
+def _store_phrase(key: str, rate: int, pcm: bytes) -> None:
+    _remember_phrase(key, (rate, pcm))
+    try:
+        sqlite.insert_tts_phrase(key, rate, pcm, _PHRASE_DB_ENTRIES)
+    except Exception:
+        _log.exception("audio: storing synthesized phrase failed; it stays cached in memory only")
+
+
+def _remember_phrase(key: str, phrase: tuple[int, bytes]) -> None:
+    with _phrases_lock:
+        _phrases[key] = phrase
+        _phrases.move_to_end(key)
+        while len(_phrases) > _PHRASE_MEMORY_ENTRIES:
+            _phrases.popitem(last=False)
+
+
+def _recording(chunks: Iterable[bytes], into: list[bytes]) -> Iterator[bytes]:
+    for chunk in chunks:
+        into.append(chunk)
+        yield chunk
 
 
 def _scale_int16(frames: bytes, gain: float) -> bytes:
+    # audioop.mul scales the whole buffer in C and clamps to the int16 range. It floors
+    # rather than truncates, so a negative product with a fraction lands one LSB lower.
     if gain == 1.0:
         return frames
-    samples = array.array("h", frames)
-    for i, s in enumerate(samples):
-        v = int(s * gain)
-        samples[i] = -32768 if v < -32768 else 32767 if v > 32767 else v
-    return samples.tobytes()
+    return audioop.mul(frames, 2, gain)
 
 
-@lru_cache(maxsize=1)
-def _find_output_device(name: str) -> tuple[int, Any]:
-    with silence_fd(2):
-        pa = pyaudio.PyAudio()
-    try:
-        for i in range(pa.get_device_count()):
-            info = pa.get_device_info_by_index(i)
-            if name in info["name"] and info["maxOutputChannels"] > 0:
-                return i, info
-    finally:
-        pa.terminate()
-    raise RuntimeError(f"No audio output device matching audio_device setting {name!r}")
-
-
-def _play_stream(chunks: Iterable[bytes], channels: int, src_rate: int, gain: float) -> None:
-    idx, info = _find_output_device(config.settings.audio_device)
-    dst_rate = int(info["defaultSampleRate"])
-    with audio_lock, silence_fd(2):
-        pa = pyaudio.PyAudio()
+class _Output:
+    """The PortAudio instance and output stream, kept open between sounds. Guarded by audio_lock."""
+
+    def __init__(self) -> None:
+        self._pa: Any = None
+        self._stream: Any = None
+        self._format: tuple[int, int, int] | None = None  # device index, channels, rate
+        self._devices: dict[str, tuple[int, int]] = {}
+
+    def device(self, name: str) -> tuple[int, int]:
+        """(index, default sample rate) of the first output device whose name contains ``name``."""
+        if name not in self._devices:
+            pa = self._portaudio()
+            for i in range(pa.get_device_count()):
+                info = pa.get_device_info_by_index(i)
+                if name in info["name"] and info["maxOutputChannels"] > 0:
+                    self._devices[name] = (i, int(info["defaultSampleRate"]))
+                    break
+            else:
+                raise RuntimeError(f"No audio output device matching audio_device setting {name!r}")
+        return self._devices[name]
+
+    def write(self, device: int, channels: int, rate: int, frames: bytes) -> None:
+        if self._format != (device, channels, rate):
+            self._close_stream()
+            with silence_fd(2):
+                self._stream = self._portaudio().open(
+                    format=pyaudio.paInt16, channels=channels, rate=rate, output_device_index=device, output=True
+                )
+            self._format = (device, channels, rate)
+        elif self._stream.is_stopped():
+            self._stream.start_stream()
+        self._stream.write(frames)
+
+    def drain(self) -> None:
+        """Block until everything written has played; the stream stays open, stopped, until the next write."""
+        if self._stream is not None and not self._stream.is_stopped():
+            self._stream.stop_stream()
+
+    def close(self) -> None:
         try:
-            stream = pa.open(format=pyaudio.paInt16, channels=channels, rate=dst_rate, output_device_index=idx, output=True)
-            try:
-                state = None
-                for chunk in chunks:
-                    scaled = _scale_int16(chunk, gain)
-                    if src_rate != dst_rate:
-                        scaled, state = audioop.ratecv(scaled, 2, channels, src_rate, dst_rate, state)
-                    stream.write(scaled)
-            finally:
-                stream.stop_stream()
-                stream.close()
+            self._close_stream()
         finally:
-            pa.terminate()
+            if self._pa is not None:
+                self._pa.terminate()
+            self._pa = None
+            self._devices.clear()
+
+    def _portaudio(self) -> Any:
+        if self._pa is None:
+            with silence_fd(2):
+                self._pa = pyaudio.PyAudio()
+        return self._pa
+
+    def _close_stream(self) -> None:
+        stream, self._stream, self._format = self._stream, None, None
+        if stream is not None:
+            stream.stop_stream()
+            stream.close()
+
+
+class _Playback:
+    """One queued sound. Its chunk iterator is consumed in place, so a preempted sound resumes where it stopped."""
+
+    def __init__(
+        self,
+        chunks: Iterable[bytes],
+        channels: int,
+        src_rate: int,
+        level: str | None,
+        render: Callable[[float, int], tuple[int, bytes]] | None = None,
+    ) -> None:
+        # render(gain, device rate) -> (channels, pcm) replaces chunks/channels/src_rate
+        # with output-ready audio once the device rate is known.
+        self.render = render
+        self.chunks = iter(chunks)
+        self.channels = channels
+        self.src_rate = src_rate
+        self.gain = _gain_for(level)
+        self.priority = 0 if level == m.AUDIO_FATAL else 1
+        self.ratecv_state: Any = None
+        self.done = threading.Event()
+        self.error: BaseException | None = None
+
+
+# Once start() has run, sounds play on one long-lived thread in priority order (FATAL
+# before INFO, then arrival order), and a FATAL arriving mid-sound preempts an INFO
+# sound between chunks; the INFO sound picks up where it left off afterwards. Callers
+# still block until their sound has played. Before start() (tests, tools) each sound
+# plays on the caller's thread. Either way only the holder of audio_lock touches _output.
+_output = _Output()
+_queue: list[tuple[int, int, _Playback]] = []  # heap of (priority, arrival, playback)
+_queue_cond = threading.Condition()
+_arrivals = itertools.count()
+_player: threading.Thread | None = None
+_stopping = False
+
+
+def start() -> None:
+    global _player, _stopping
+    if _player is not None:
+        return
+    _stopping = False
+    _player = threading.Thread(target=_play_loop, name="orc-audio", daemon=True)
+    _player.start()
+    atexit.register(stop)
+
+
+def stop() -> None:
+    global _player, _stopping
+    if _player is None:
+        return
+    with _queue_cond:
+        _stopping = True
+        _queue_cond.notify_all()
+    _player.join()
+    _player = None
+    with audio_lock:
+        _output.close()
+
+
+def _play_stream(chunks: Iterable[bytes], channels: int, src_rate: int, level: str | None) -> None:
+    _submit(_Playback(chunks, channels, src_rate, level))
+
+
+def _submit(playback: _Playback) -> None:
+    if _player is None:
+        with audio_lock:
+            _play(playback, preempt=lambda: False)
+    else:
+        with _queue_cond:
+            heapq.heappush(_queue, (playback.priority, next(_arrivals), playback))
+            _queue_cond.notify()
+        playback.done.wait()
+    if playback.error is not None:
+        raise playback.error
+
+
+def _play_loop() -> None:
+    while True:
+        with _queue_cond:
+            while not _queue and not _stopping:
+                _queue_cond.wait()
+            if _stopping:
+                for _, _, playback in _queue:
+                    playback.error = RuntimeError("audio output stopped")
+                    playback.done.set()
+                _queue.clear()
+                return
+            entry = heapq.heappop(_queue)
+        playback = entry[2]
+        with audio_lock:
+            finished = _play(playback, preempt=lambda: _preempts(playback))
+        if not finished:
+            with _queue_cond:
+                heapq.heappush(_queue, entry)
+
+
+def _preempts(playback: _Playback) -> bool:
+    with _queue_cond:
+        return bool(_queue) and _queue[0][0] < playback.priority
+
+
+def _play(playback: _Playback, preempt: Callable[[], bool]) -> bool:
+    """Play until the sound ends (True) or ``preempt()`` asks to yield (False). Caller holds audio_lock."""
+    try:
+        device, dst_rate = _output.device(config.settings.audio_device)
+        if playback.render is not None:
+            playback.channels, pcm = playback.render(playback.gain, dst_rate)
+            playback.chunks = _chunked(pcm, playback.channels)
+            playback.src_rate, playback.gain, playback.render = dst_rate, 1.0, None
+        for chunk in playback.chunks:
+            scaled = _scale_int16(chunk, playback.gain)
+            if playback.src_rate != dst_rate:
+                scaled, playback.ratecv_state = audioop.ratecv(
+                    scaled, 2, playback.channels, playback.src_rate, dst_rate, playback.ratecv_state
+                )
+            _output.write(device, playback.channels, dst_rate, scaled)
+            if preempt():
+                return False
+        _output.drain()
+    except Exception as e:
+        playback.error = e
+        _output.close()  # the device may be gone; reopen from scratch on the next sound
+    playback.done.set()
+    return True
+
+
+def _alert_pcm(path: str, gain: float, dst_rate: int) -> tuple[int, bytes]:
+    mtime = os.stat(path).st_mtime_ns
+    key = (path, gain, dst_rate)
+    cached = _alerts.get(key)
+    if cached is not None and cached[0] == mtime:
+        _alert_stats.inc("hit")
+        return cached[1], cached[2]
+    _alert_stats.inc("miss")
+    with wave.open(path, "rb") as wf:
+        channels, rate, frames = wf.getnchannels(), wf.getframerate(), wf.readframes(wf.getnframes())
+    pcm = _scale_int16(frames, gain)
+    if rate != dst_rate:
+        pcm, _ = audioop.ratecv(pcm, 2, channels, rate, dst_rate, None)
+    _alerts[key] = (mtime, channels, pcm)
+    return channels, pcm
+
+
+def _chunked(pcm: bytes, channels: int) -> Iterator[bytes]:
+    size = _CHUNK_FRAMES * 2 * channels
+    return (pcm[i : i + size] for i in range(0, len(pcm), size))
 
 
 def _gain_for(level: str | None) -> float:
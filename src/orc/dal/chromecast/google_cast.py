@@ -1,16 +1,26 @@
+import atexit
+import logging
 import socket
+import threading
 import time
-from collections.abc import Iterator
+from collections.abc import Callable, Iterator
 from contextlib import contextmanager, suppress
+from functools import wraps
 from typing import Any
 from urllib.parse import parse_qs, urlencode, urlparse, urlunparse
 
 import pychromecast
 import yt_dlp
+from pychromecast.controllers.media import MediaStatus, MediaStatusListener
+from pychromecast.controllers.receiver import CastStatus, CastStatusListener
+from pychromecast.socket_client import ConnectionStatus, ConnectionStatusListener
 
+from orc import metrics
 from orc import model as m
 from orc.decorators import silence_fd
 
+_log = logging.getLogger(__name__)
+
 _YDL_OPTS: dict[str, Any] = {
     "format": "bestaudio/best",  # Request the highest quality audio stream
     "quiet": True,
@@ -20,19 +30,74 @@ _YDL_OPTS: dict[str, Any] = {
 
 _PLAYING_STATES: tuple[str, ...] = ("PLAYING", "BUFFERING", "PAUSED")
 
+# One long-lived Chromecast per device, connected on first use and reused by every later
+# command, so a room-wide dispatch doesn't pay a DNS lookup and TLS handshake per
+# speaker. A pooled cast is checked before each use; one whose socket dropped (or that
+# never answered) is disconnected and replaced with a fresh connection.
+#
+# Each pooled cast carries a _Listener fed by pychromecast's receiver and media status
+# pushes, which keeps _states current without asking the device. Pushes only come on
+# change, so an idle speaker's entry can be hours old and still right: while its pooled
+# connection is healthy (pychromecast's heartbeat reports a dead socket as LOST, which
+# drops the entry) the last push is the current state. Only an entry whose connection
+# isn't healthy and that is older than _STALE_SEC is refreshed by a poll on the next
+# fetch_state.
+#
+# Commands return once the device confirms with a status push (or after _SETTLE_SEC /
+# _LOAD_SEC without one) rather than sleeping a fixed time; per-command latency goes to
+# metrics.histogram("chromecast_command").
+_TIMEOUT_SEC: float = 5.0
+_POLL_SEC: float = 0.5
+_SETTLE_SEC: float = 3.0
+_LOAD_SEC: float = 10.0
+_RECHECK_SEC: float = 0.1  # a command on an evicted cast gets no pushes; done() is re-checked this often
+_STALE_SEC: float = 60.0
+_lock = threading.Lock()  # guards _pool, _listeners, _connecting and _states
+_pool: dict[m.DeviceEnum, Any] = {}
+_listeners: dict[m.DeviceEnum, _Listener] = {}
+_connecting: dict[m.DeviceEnum, threading.Lock] = {}  # one connect at a time per device
+_states: dict[m.DeviceEnum, tuple[float, m.SoundState]] = {}  # device -> (monotonic time recorded, state)
+_pool_stats = metrics.counter("chromecast_pool")
+_state_stats = metrics.counter("chromecast_state")
+_command_latency = metrics.histogram("chromecast_command")
+
+
+def _timed[**P, R](f: Callable[P, R]) -> Callable[P, R]:
+    @wraps(f)
+    def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+        start = time.monotonic()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            _command_latency.observe(f.__name__, time.monotonic() - start)
+
+    return wrapper
+
+
+def cached_state(device: m.DeviceEnum) -> m.SoundState | None:
+    """The last pushed or polled state, unless it's older than _STALE_SEC on a connection that isn't healthy."""
+    with _lock:
+        entry = _states.get(device)
+        cast = _pool.get(device)
+    if entry is None:
+        return None
+    if time.monotonic() - entry[0] > _STALE_SEC and (cast is None or not _healthy(cast)):
+        return None
+    _state_stats.inc("cached")
+    return entry[1]
+
 
 def fetch_state(device: m.DeviceEnum) -> m.SoundState:
-    with _cast(device, timeout=5, tries=1) as cast:
-        time.sleep(0.5)
-        if cast.status is None:  # wait() timed out: device unreachable
-            return m.SoundState(what=device, content=None, volume=0)
-        ms = cast.media_controller.status
-        content = ms.content_id if ms and ms.player_state in _PLAYING_STATES else None
-        return m.SoundState(
-            what=device,
-            content=_strip_googlevideo_params(content) if content else None,
-            volume=int(cast.status.volume_level * 100),
-        )
+    state = cached_state(device)
+    if state is not None:
+        return state
+    _state_stats.inc("polled")
+    with _cast(device) as cast:
+        if _media_running(cast):
+            _confirm(device, cast, cast.media_controller.update_status, lambda: True, _POLL_SEC)
+        state = _sound_state(device, cast)
+    _record(device, state)
+    return state
 
 
 def fetch_youtube_stream_metadata(id: str) -> tuple[str, str]:
@@ -41,68 +106,218 @@ def fetch_youtube_stream_metadata(id: str) -> tuple[str, str]:
         return info["url"], info.get("title", "Audio Stream")
 
 
+@_timed
 def pause(device: m.DeviceEnum) -> None:
     with _cast(device) as cast:
-        cast.media_controller.update_status()
-        time.sleep(1)
-        if cast.media_controller.status.player_state in ("PLAYING", "BUFFERING"):
-            cast.media_controller.pause()
+        mc = cast.media_controller
+        _confirm(device, cast, mc.update_status, lambda: True, _SETTLE_SEC)
+        if mc.status.player_state in ("PLAYING", "BUFFERING"):
+            _confirm(device, cast, mc.pause, lambda: mc.status.player_state == "PAUSED", _SETTLE_SEC)
 
 
+@_timed
 def play(device: m.DeviceEnum, stream_url: str, title: str) -> None:
     with _cast(device) as cast:
+        mc = cast.media_controller
         # Reset so play_media loads into a fresh receiver. silence_fd(2) swallows
         # pychromecast's "no session is active" warning when nothing is playing.
         with silence_fd(2), suppress(Exception):
-            cast.media_controller.stop()
-        if cast.status.app_id:
-            cast.quit_app()
-            time.sleep(1)
-
-    # Reconnect rather than reusing `cast`/`mc` across the quit_app transition:
-    # block_until_active only reports correctly the first time it's asked on a
-    # given instance (https://github.com/home-assistant-libs/pychromecast/issues/335).
-    with _cast(device) as cast:
-        mc = cast.media_controller
-        mc.play_media(stream_url, "audio/mp3", title=title)
-        mc.block_until_active(timeout=10)
-        if mc.status.player_state == "IDLE" and mc.status.idle_reason == "ERROR":
+            mc.stop()
+        if not cast.is_idle:
+            _confirm(device, cast, cast.quit_app, lambda: cast.is_idle, _SETTLE_SEC)
+
+        def failed() -> bool:
+            return mc.status.player_state == "IDLE" and mc.status.idle_reason == "ERROR"
+
+        def loaded() -> bool:
+            return failed() or (mc.status.player_state in ("PLAYING", "BUFFERING") and mc.status.content_id == stream_url)
+
+        if not _confirm(device, cast, lambda: mc.play_media(stream_url, "audio/mp3", title=title), loaded, _LOAD_SEC):
+            _log.info("chromecast: %s did not confirm %r within %ss", device.name, title, _LOAD_SEC)
+        if failed():
             raise RuntimeError(f"{device.name}: Chromecast failed to load {title!r}")
 
 
+@_timed
 def resume(device: m.DeviceEnum) -> None:
     with _cast(device) as cast:
-        cast.media_controller.update_status()
-        time.sleep(1)
-        if cast.media_controller.status.player_state == "PAUSED":
-            cast.media_controller.play()
+        mc = cast.media_controller
+        _confirm(device, cast, mc.update_status, lambda: True, _SETTLE_SEC)
+        if mc.status.player_state == "PAUSED":
+            _confirm(device, cast, mc.play, lambda: mc.status.player_state in ("PLAYING", "BUFFERING"), _SETTLE_SEC)
 
 
+@_timed
 def stop(device: m.DeviceEnum) -> None:
     with _cast(device) as cast:
-        cast.quit_app()
-        time.sleep(1)
+        if cast.status is None or not cast.is_idle:
+            _confirm(device, cast, cast.quit_app, lambda: cast.is_idle, _SETTLE_SEC)
 
 
+@_timed
 def set_volume(device: m.DeviceEnum, lvl: int) -> None:
     with _cast(device) as cast:
-        cast.set_volume(lvl / 100)
-        time.sleep(1)
+        # the receiver answers a volume change with a status push
+        _confirm(device, cast, lambda: cast.set_volume(lvl / 100), lambda: True, _SETTLE_SEC)
 
 
 @contextmanager
-def _cast(device: m.DeviceEnum, **kwargs: Any) -> Iterator[Any]:
-    kwargs.setdefault("timeout", 5)
-    ip = socket.gethostbyname(device.value)
-    # pychromecast accepts None for uuid/model/name at runtime; its stub declares stricter tuple types
-    cast = pychromecast.get_chromecast_from_host((ip, 8009, None, None, None), **kwargs)  # type: ignore[arg-type]
+def _cast(device: m.DeviceEnum) -> Iterator[Any]:
+    cast = _checkout(device)
     try:
-        cast.wait(timeout=kwargs.get("timeout"))
         yield cast
-    finally:
+    except Exception:
+        if not _healthy(cast):
+            _discard(device, cast)
+        raise
+
+
+def _checkout(device: m.DeviceEnum) -> Any:
+    with _lock:
+        connecting = _connecting.setdefault(device, threading.Lock())
+    with connecting:
+        with _lock:
+            cast = _pool.get(device)
+        if cast is not None and _healthy(cast):
+            _pool_stats.inc("reuse")
+            return cast
+        if cast is not None:
+            _discard(device, cast)
+            _pool_stats.inc("reconnect")
+        else:
+            _pool_stats.inc("connect")
+        cast, listener = _connect(device)
+        with _lock:
+            _pool[device] = cast
+            _listeners[device] = listener
+        return cast
+
+
+def _connect(device: m.DeviceEnum) -> tuple[Any, _Listener]:
+    ip = socket.gethostbyname(device.value)
+    # pychromecast accepts None for uuid/model/name at runtime; its stub declares stricter tuple types
+    cast = pychromecast.get_chromecast_from_host((ip, 8009, None, None, None), tries=1, timeout=_TIMEOUT_SEC)  # type: ignore[arg-type]
+    listener = _Listener(device, cast)
+    cast.register_connection_listener(listener)
+    cast.register_status_listener(listener)
+    cast.media_controller.register_status_listener(listener)
+    cast.wait(timeout=_TIMEOUT_SEC)
+    return cast, listener
+
+
+def _media_running(cast: Any) -> bool:
+    # The media controller doesn't require its app to be running, so a media GET_STATUS
+    # to an idle speaker launches the Default Media Receiver; without a media app,
+    # cast.status alone is the state.
+    return cast.status is not None and not cast.is_idle and cast.media_controller.namespace in cast.status.namespaces
+
+
+def _healthy(cast: Any) -> bool:
+    # status stays None when wait() timed out: the device never answered
+    return cast.status is not None and cast.socket_client.is_alive() and cast.socket_client.is_connected
+
+
+def _discard(device: m.DeviceEnum, cast: pychromecast.Chromecast) -> None:
+    """Drop ``device``'s pooled cast, if it is still ``cast``, and disconnect it."""
+    with _lock:
+        if _pool.get(device) is not cast:
+            return
+        del _pool[device]
+        _listeners.pop(device, None)
+        _states.pop(device, None)
+    with suppress(Exception):
         cast.disconnect(timeout=2)
 
 
+def _disconnect_all() -> None:
+    with _lock:
+        casts = list(_pool.values())
+        _pool.clear()
+        _listeners.clear()
+        _states.clear()
+    for cast in casts:
+        with suppress(Exception):
+            cast.disconnect(timeout=2)
+
+
+atexit.register(_disconnect_all)
+
+
+class _Listener(ConnectionStatusListener, CastStatusListener, MediaStatusListener):
+    """Connection, receiver and media status listener for one pooled cast."""
+
+    def __init__(self, device: m.DeviceEnum, cast: Any) -> None:
+        self.device = device
+        self.cast = cast
+        self.updated = threading.Condition()
+        self.updates = 0
+
+    def new_connection_status(self, status: ConnectionStatus) -> None:
+        if status.status in ("LOST", "FAILED"):
+            _log.info("chromecast: %s connection %s; reconnecting on next use", self.device.name, status.status.lower())
+            with _lock:
+                if _pool.get(self.device) is self.cast:
+                    _states.pop(self.device, None)
+
+    def new_cast_status(self, status: CastStatus) -> None:
+        self._pushed()
+
+    def new_media_status(self, status: MediaStatus) -> None:
+        self._pushed()
+
+    def load_media_failed(self, queue_item_id: int, error_code: int) -> None:
+        _log.info("chromecast: %s failed to load media (error %s)", self.device.name, error_code)
+        self._pushed()
+
+    def wait_for(self, predicate: Callable[[], bool], timeout: float) -> bool:
+        """Wait up to ``timeout`` for ``predicate()``, re-checked after every status push."""
+        with self.updated:
+            return self.updated.wait_for(predicate, timeout)
+
+    def _pushed(self) -> None:
+        with _lock:
+            current = _pool.get(self.device) is self.cast
+        if current:  # a replaced cast can still push while it disconnects
+            _record(self.device, _sound_state(self.device, self.cast))
+        with self.updated:
+            self.updates += 1
+            self.updated.notify_all()
+
+
+def _confirm(device: m.DeviceEnum, cast: Any, action: Callable[[], object], done: Callable[[], bool], timeout: float) -> bool:
+    """Run ``action``, then wait up to ``timeout`` for a status push after which ``done()`` holds."""
+    with _lock:
+        listener = _listeners.get(device)
+    if listener is None or listener.cast is not cast:  # evicted mid-command: no pushes to wait on
+        action()
+        deadline = time.monotonic() + timeout
+        while not done():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(_RECHECK_SEC)
+        return True
+    after = listener.updates
+    action()
+    return listener.wait_for(lambda: listener.updates > after and done(), timeout)
+
+
+def _sound_state(device: m.DeviceEnum, cast: Any) -> m.SoundState:
+    if cast.status is None:
+        return m.SoundState(what=device, content=None, volume=0)
+    ms = cast.media_controller.status
+    content = ms.content_id if ms and ms.player_state in _PLAYING_STATES else None
+    return m.SoundState(
+        what=device,
+        content=_strip_googlevideo_params(content) if content else None,
+        volume=int(cast.status.volume_level * 100),
+    )
+
+
+def _record(device: m.DeviceEnum, state: m.SoundState) -> None:
+    with _lock:
+        _states[device] = (time.monotonic(), state)
+
+
 def _strip_googlevideo_params(url: str) -> str:
     parsed = urlparse(url)
     if not parsed.hostname or not parsed.hostname.endswith("googlevideo.com"):
@@ -4,6 +4,10 @@ _volumes: dict[m.DeviceEnum, int] = {}
 _content: dict[m.DeviceEnum, str] = {}
 
 
+def cached_state(device: m.DeviceEnum) -> m.SoundState | None:
+    return fetch_state(device)
+
+
 def fetch_state(device: m.DeviceEnum) -> m.SoundState:
     return m.SoundState(what=device, content=_content.get(device), volume=_volumes.get(device, 0))
 
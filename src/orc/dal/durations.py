@@ -0,0 +1,118 @@
+"""Write-behind duration statistics.
+
+Job/action run times and mqtt command round trips fold into an in-memory EWMA per
+name, so recording a sample never touches the disk on the caller's thread (for
+command echoes, that's the mqtt network thread). Once ``start()`` has run, a
+background flusher writes the names that changed to ``orc_durations`` in one
+transaction every ``_FLUSH_SEC`` and once more at exit; before that (tests, tools)
+every sample is written through immediately.
+
+Reads are served from the same in-memory view, seeded from the table the first time
+the database is used, so they include samples that haven't been flushed yet. Every
+change to the view bumps ``version()``, so callers can cache what they derive from it.
+"""
+
+import atexit
+import logging
+import threading
+
+from orc import config
+from orc.dal import sqlite
+
+_log = logging.getLogger(__name__)
+
+_ALPHA: float = 0.3
+_FLUSH_SEC: float = 30.0
+
+_lock = threading.Lock()  # guards _stats, _dirty, _loaded_from
+_flush_lock = threading.Lock()  # one flush at a time, so an older view never overwrites a newer one
+_stats: dict[str, tuple[int, float]] = {}  # name -> (samples, average seconds)
+_dirty: set[str] = set()  # names changed since the last flush
+_loaded_from: str | None = None  # jobs_db the view was seeded from
+_version = 0  # bumped on every change to _stats
+_flusher: threading.Thread | None = None
+_stopping = threading.Event()
+
+
+def update_avg(name: str, duration: float) -> None:
+    global _version
+    with _lock:
+        view = _view()
+        samples, avg = view.get(name, (0, duration))
+        view[name] = (samples + 1, _ALPHA * duration + (1 - _ALPHA) * avg)
+        _dirty.add(name)
+        _version += 1
+    if _flusher is None:
+        flush()
+
+
+def stats() -> dict[str, tuple[int, float]]:
+    return versioned_stats()[1]
+
+
+def versioned_stats() -> tuple[int, dict[str, tuple[int, float]]]:
+    with _lock:
+        view = _view()
+        return _version, dict(view)
+
+
+def version() -> int:
+    with _lock:
+        _view()
+        return _version
+
+
+def flush() -> None:
+    with _flush_lock:
+        with _lock:
+            rows = [(name, *_stats[name]) for name in sorted(_dirty)]
+            _dirty.clear()
+        if not rows:
+            return
+        try:
+            sqlite.store_durations(rows)
+        except Exception:
+            with _lock:
+                _dirty.update(name for name, _, _ in rows)  # retried on the next flush
+            raise
+
+
+def start(interval: float = _FLUSH_SEC) -> None:
+    global _flusher
+    if _flusher is not None:
+        return
+    _stopping.clear()
+    _flusher = threading.Thread(target=_flush_loop, args=(interval,), name="orc-durations", daemon=True)
+    _flusher.start()
+    atexit.register(stop)
+
+
+def stop() -> None:
+    global _flusher
+    if _flusher is None:
+        return
+    _stopping.set()
+    _flusher.join()
+    _flusher = None
+    flush()
+
+
+def _flush_loop(interval: float) -> None:
+    while not _stopping.wait(interval):
+        try:
+            flush()
+        except Exception:
+            _log.exception("durations: flush failed; retrying next interval")
+
+
+def _view() -> dict[str, tuple[int, float]]:
+    # Caller holds _lock. A different jobs_db (tests swap it per test) starts a fresh
+    # view from that database's rows; production never changes it after boot.
+    global _loaded_from, _version
+    if _loaded_from != config.settings.jobs_db:
+        _stats.clear()
+        _dirty.clear()
+        _stats.update({name: (samples, avg) for name, samples, avg in sqlite.fetch_durations()})
+        _loaded_from = config.settings.jobs_db
+        _version += 1
+    return _stats
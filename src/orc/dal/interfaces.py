@@ -1,4 +1,4 @@
-from collections.abc import Sequence
+from collections.abc import Iterable, Sequence
 from datetime import date, datetime
 from typing import NamedTuple, Protocol
 
@@ -32,14 +32,28 @@ class MqttService(Protocol):
     def start(self) -> None: ...
     def fetch_hubitat_config(self, secrets: Secrets, timeout: float = 3.0) -> dict[str, tuple[int, frozenset[Capability]]]: ...
     def fetch_light_states(self, lights: Sequence[DeviceEnum]) -> Configs: ...
+    def light_state(self, light: DeviceEnum) -> int | str | None: ...
     def publish_light(self, light: DeviceEnum, on: bool | None = None, brightness: int | None = None) -> None: ...
     def snapshot(self) -> list[DeviceState]: ...
-    def add_listener(self, fn: Listener) -> None: ...
-    def add_button_listener(self, fn: ButtonListener) -> None: ...
-    def add_external_listener(self, fn: Listener) -> None: ...
+    def device_state(self, id: int) -> DeviceState | None: ...
+    def changed_since(self, version: int) -> tuple[int, list[DeviceState]]: ...
+
+    def add_listener(
+        self,
+        fn: Listener,
+        devices: Iterable[int] | None = None,
+        attributes: Iterable[str] | None = None,
+        queue: int | None = None,
+        coalesce: bool = False,
+        full: bool = False,
+    ) -> None: ...
+
+    def add_button_listener(self, fn: ButtonListener, queue: int | None = None) -> None: ...
+    def add_external_listener(self, fn: Listener, queue: int | None = None, coalesce: bool = False) -> None: ...
 
 
 class ChromecastService(Protocol):
+    def cached_state(self, device: DeviceEnum) -> SoundState | None: ...
     def fetch_state(self, device: DeviceEnum) -> SoundState: ...
     def fetch_youtube_stream_metadata(self, id: str) -> tuple[str, str]: ...
     def pause(self, device: DeviceEnum) -> None: ...
@@ -6,26 +6,39 @@ and discovery all flow through here; only hub reboot stays on Maker API.
 The hub uuid is captured from the first message rather than configured.
 """
 
+import atexit
 import json
 import logging
+import sys
+import threading
 import time
-from collections.abc import Callable, Sequence
+import uuid
+from collections import OrderedDict
+from collections.abc import Callable, Iterable, Sequence
+from concurrent.futures import Future
 from dataclasses import dataclass
-from typing import Any
+from functools import partial
+from itertools import chain, count, product
+from typing import Any, NamedTuple
 
 import paho.mqtt.client as mqtt
 
-from orc import config
+from orc import config, metrics
 from orc import model as m
 from orc.collections import LockedDict
-from orc.dal import sqlite
+from orc.dal import durations
+from orc.dal.mqtt.store import DeviceStore
 
 _log = logging.getLogger(__name__)
 
 _MQTT_PORT = 1883
 
 
-_devices: LockedDict[int, m.DeviceState] = LockedDict()
+_devices = DeviceStore()
+# Raw payload last stored per document topic. A reconnect or hub reboot replays every
+# retained document byte for byte; those are recognised here without being parsed.
+_payloads: dict[str, bytes] = {}  # mqtt thread only
+_document_stats = metrics.counter("mqtt_documents")  # new / changed / unchanged / replayed
 _hub_id: str | None = None  # written only by the mqtt thread
 _client: mqtt.Client | None = None  # the standing client, retained for publishing commands
 
@@ -33,7 +46,8 @@ _client: mqtt.Client | None = None  # the standing client, retained for publishi
 # the broker echoing our own publish back on the hubitat/# subscription pops it. Keyed
 # by topic, so the size is bounded by distinct (device, command) pairs; an entry whose
 # echo never arrives (broker down at publish) is overwritten by the topic's next send.
-# Round trips fold into orc_durations, keyed by command topic.
+# Round trips fold into the duration stats, keyed by command topic; recording one is an
+# in-memory update, so the mqtt thread never waits on the database.
 _command_sent: LockedDict[str, float] = LockedDict()  # command topic -> monotonic send time
 
 _COMMAND_TTL_SEC = 120.0
@@ -59,73 +73,272 @@ class _Command:
         )
 
 
+# Command pacing: once start() has run, publish_light queues the command and the
+# publisher thread sends it through a token bucket (settings.mqtt_burst commands at
+# once, then settings.mqtt_rate per second), so an all-lights-off doesn't hit the
+# Zigbee mesh in one burst. A device has at most one queued command: a newer one
+# replaces it in place, since only the latest state matters. publish_light returns
+# once its command (or the one that replaced it) is sent, and raises if sending
+# failed, so dispatch still reports the failure. Should the publisher itself fail,
+# queued and later commands publish directly rather than wait forever. Before
+# start() (tests, boot discovery) commands publish directly.
+class _Queued(NamedTuple):
+    topic: str
+    payload: str | None
+    queued: float  # monotonic
+    waiters: list[Future[None]]  # the publish_light calls it answers, superseded ones included
+
+
+_outbox: OrderedDict[int, _Queued] = OrderedDict()  # device id -> its latest command
+_outbox_cond = threading.Condition()  # guards _outbox, _publishing
+_publishing = False
+_publisher: threading.Thread | None = None
+_outbox_depth = metrics.gauge("mqtt_outbox")
+_outbox_wait = metrics.histogram("mqtt_outbox_wait")  # keyed by command
+_outbox_stats = metrics.counter("mqtt_outbox")
+
 # External-control detection: a switch/level change that doesn't match the pending
 # _Command fires the external listeners (Google Home, a physical switch).
 _commanded: LockedDict[int, _Command] = LockedDict()  # device id -> expected outcome
 
+
 # Central event listeners: fired as (device, attribute, old, new) for every attribute
 # of every received document that represents something happening — battery levels,
 # motion active/inactive, contact open/close, switch state, all attributes alike.
 # State is never an event: first sightings (the retained flood at boot) and replays
 # (a document identical to the cached one — reconnect floods, hub republish after
-# reboot) update the cache but fire no listeners, so ``old`` is never None. No other
-# dedup: the hub regenerates the document only when something happens, so a changed
-# document fires every attribute, unchanged ones included (old == new); consumers
-# filter for what they care about. Callbacks run on the mqtt thread; keep them fast
-# and don't block.
-_listeners: list[m.Listener] = []
+# reboot) update the cache but fire no listeners, so ``old`` is never None. A changed
+# document is diffed against the cached one and fires only the attributes whose value
+# changed. The hub regenerates the document only when something happens, so a
+# listener that treats every report as an event (a battery report, say) registers with
+# ``full=True`` and gets all attributes of a changed document, unchanged ones
+# included (old == new). A listener
+# may subscribe to device ids and/or attribute names; it is indexed under each
+# (id, attribute) pair it asked for, None standing for any, so a document only reaches
+# the listeners that asked for it. Callbacks run on the mqtt thread; keep them fast
+# and don't block. Calls and time spent, per listener (button and external ones too),
+# go to metrics.histogram("mqtt_listener").
+#
+# A listener that may be slow (takes a lock, does I/O, dispatches) registers with
+# ``queue=N`` instead: the mqtt thread only appends the event to that listener's
+# _Mailbox, and the mailbox's own thread calls it in arrival order, so the listener
+# holds up nothing but itself. Over N queued events, new ones are dropped; with
+# ``coalesce`` a queued event for the same (device, attribute) takes the new value in
+# place (keeping its ``old``) instead of queueing another. Per listener,
+# metrics.gauge("mqtt_listener_queue") holds the depth, metrics.histogram("mqtt_listener_lag")
+# the time events wait, and metrics.counter("mqtt_listener_queue") the dropped and
+# coalesced events.
+class _Mailbox:
+    def __init__(self, fn: Callable[..., None], size: int, coalesce: bool = False) -> None:
+        self.fn, self.name = fn, _listener_name(fn)
+        self._size, self._coalesce = size, coalesce
+        self._cond = threading.Condition()
+        self._events: OrderedDict[Any, tuple[float, str, tuple[Any, ...]]] = OrderedDict()  # key -> (monotonic queued, topic, args)
+        self._seq = count()
+        threading.Thread(target=self._run, name=f"orc-mqtt-{self.name}", daemon=True).start()
+
+    def put(self, topic: str, args: tuple[Any, ...]) -> None:
+        with self._cond:
+            key = (args[0].id, args[1]) if self._coalesce else next(self._seq)
+            queued = self._events.get(key)
+            if queued is not None:
+                self._events[key] = (queued[0], topic, (args[0], args[1], queued[2][2], args[3]))
+                _mailbox_stats.inc(f"{self.name}:coalesced")
+                return
+            if len(self._events) >= self._size:
+                _mailbox_stats.inc(f"{self.name}:dropped")
+                return
+            self._events[key] = (time.monotonic(), topic, args)
+            _mailbox_depth.set(self.name, len(self._events))
+            self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._events)
+                _, (queued, topic, args) = self._events.popitem(last=False)
+                _mailbox_depth.set(self.name, len(self._events))
+            _mailbox_lag.observe(self.name, time.monotonic() - queued)
+            _call(self.fn, topic, args)
+
+
+class _Subscription(NamedTuple):
+    seq: int  # registration order, which is also call order
+    fn: m.Listener | _Mailbox
+    full: bool  # also called for unchanged attributes
+
+
+_listeners: dict[tuple[int | None, str | None], list[_Subscription]] = {}  # replaced, never mutated, on add
+_subscribed = count()
+_full_subscribed = False  # any full=True subscription; otherwise only changed attributes are walked
+_listener_times = metrics.histogram("mqtt_listener")
+_mailbox_depth = metrics.gauge("mqtt_listener_queue")
+_mailbox_lag = metrics.histogram("mqtt_listener_lag")
+_mailbox_stats = metrics.counter("mqtt_listener_queue")
 
 # Button-event listeners: fired as (device id, button number, event type) for every
 # ``devices/<id>/button/<n>`` publish. Unlike the document topics these are dedicated
 # event messages (not retained, no flood replay), so no staleness filtering applies.
-_button_listeners: list[m.ButtonListener] = []
+_button_listeners: list[m.ButtonListener | _Mailbox] = []
 
 # External-control listeners: fired as (device, attribute, old, new) for each
 # switch/level change with no recent orc command behind it. Same contract as
-# Listener: mqtt thread, keep it fast.
-_external_listeners: list[m.Listener] = []
-
-
-def add_listener(fn: m.Listener) -> None:
-    _listeners.append(fn)
-
-
-def add_button_listener(fn: m.ButtonListener) -> None:
-    _button_listeners.append(fn)
-
-
-def add_external_listener(fn: m.Listener) -> None:
-    _external_listeners.append(fn)
+# Listener: mqtt thread, keep it fast, or queue.
+_external_listeners: list[m.Listener | _Mailbox] = []
+
+
+def add_listener(
+    fn: m.Listener,
+    devices: Iterable[int] | None = None,
+    attributes: Iterable[str] | None = None,
+    queue: int | None = None,
+    coalesce: bool = False,
+    full: bool = False,
+) -> None:
+    """Call ``fn`` for the given devices' and attributes' changes; None means all of them.
+    With ``queue``, it runs off the mqtt thread behind a queue of that many events;
+    with ``full``, it is also called for the unchanged attributes of a changed document."""
+    global _listeners, _full_subscribed
+    subscription = _Subscription(next(_subscribed), fn if queue is None else _Mailbox(fn, queue, coalesce), full)
+    _full_subscribed |= full
+    index = {key: list(subscriptions) for key, subscriptions in _listeners.items()}
+    for key in product([None] if devices is None else devices, [None] if attributes is None else attributes):
+        index.setdefault(key, []).append(subscription)
+    _listeners = index
+
+
+def add_button_listener(fn: m.ButtonListener, queue: int | None = None) -> None:
+    _button_listeners.append(fn if queue is None else _Mailbox(fn, queue))
+
+
+def add_external_listener(fn: m.Listener, queue: int | None = None, coalesce: bool = False) -> None:
+    _external_listeners.append(fn if queue is None else _Mailbox(fn, queue, coalesce))
+
+
+def _listener_name(fn: Callable[..., None]) -> str:
+    target = fn.func if isinstance(fn, partial) else fn
+    return getattr(target, "__qualname__", repr(target))
+
+
+# Settle detection: _on_connect subscribes to a per-connection sentinel topic along
+# with hubitat/#, then publishes to it. The broker sends a subscription's retained
+# messages before it reads the client's next packet, and delivers a client's messages
+# in order, so the sentinel comes back right behind the last retained document. A
+# broker that drops the sentinel (ACLs) falls back to the retained count standing
+# still for _QUIET_SEC once documents have arrived; the timeout only covers a broker
+# that is down or silent. The sentinel is only sent on the first connect: a reconnect
+# has nobody waiting on its flood.
+#
+# Each boot counts how it settled in metrics.counter("mqtt_settle") and records, in
+# metrics.histogram("mqtt_settle"), "connect" (to CONNACK), "flood" (CONNACK to the
+# last retained document) and "lag" (last retained document to settled: what the
+# sentinel saves against the quiet period, which can't settle sooner than _QUIET_SEC).
+# When start() keeps discovery's connection it records that connection's time to
+# settle as "reused": the connect and flood a second client would have repeated.
+_QUIET_SEC = 0.25
+_settle_stats = metrics.counter("mqtt_settle")  # sentinel / quiet / timeout
+_settle_times = metrics.histogram("mqtt_settle")
+_settled_in: float | None = None  # seconds the last _new_client took to settle
 
 
 def _new_client(secrets: m.Secrets, on_connect: Callable[..., None], on_message: Callable[..., None], timeout: float) -> mqtt.Client:
+    """A started client, returned once its retained flood has reached ``on_message`` or ``timeout`` has passed."""
+    global _settled_in
+    sentinel = f"orc/settled/{uuid.uuid4().hex}"
+    settled = threading.Event()
+    started = connected = last = time.monotonic()
     received = 0
 
-    def counting(client: mqtt.Client, userdata: Any, msg: mqtt.MQTTMessage) -> None:
-        nonlocal received
-        received += msg.retain
+    def connecting(client: mqtt.Client, userdata: Any, *args: Any) -> None:
+        nonlocal connected, last
+        connected = last = time.monotonic()  # an empty flood settles in no time
+        on_connect(client, userdata, *args)
+
+    def settling(client: mqtt.Client, userdata: Any, msg: mqtt.MQTTMessage) -> None:
+        nonlocal received, last
+        if msg.topic == sentinel:
+            settled.set()
+            return
+        if msg.retain:
+            received, last = received + 1, time.monotonic()
         on_message(client, userdata, msg)
 
     client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
     client.username_pw_set(secrets.mqtt_user, secrets.mqtt_password)
-    client.on_connect = on_connect
-    client.on_message = counting
+    client.user_data_set(sentinel)
+    client.on_connect = connecting
+    client.on_message = settling
     client.reconnect_delay_set(min_delay=1, max_delay=60)
     client.connect_async(config.settings.mqtt_host, _MQTT_PORT, keepalive=30)
     client.loop_start()
-    if not _wait_settled(lambda: received, timeout):
-        _log.warning("mqtt: retained documents still arriving after %.0fs (%d so far)", timeout, received)
-    client.on_message = on_message
+    how, deadline, previous = "sentinel", started + timeout, -1
+    while not settled.wait(min(_QUIET_SEC, max(deadline - time.monotonic(), 0))):
+        if received and received == previous:
+            how = "quiet"
+            break
+        if time.monotonic() >= deadline:
+            client.user_data_set(None)
+            _settle_stats.inc("timeout")
+            _log.warning("mqtt: retained flood not settled after %.0fs (%d documents so far)", timeout, received)
+            return client
+        previous = received
+    client.user_data_set(None)  # settled: reconnects skip the sentinel
+    now = time.monotonic()
+    _settled_in = now - started
+    _settle_stats.inc(how)
+    _settle_times.observe("connect", connected - started)
+    _settle_times.observe("flood", last - connected)
+    _settle_times.observe("lag", now - last)
+    _log.info(
+        "mqtt: %d retained documents in %.2fs after connect, settled by %s %.3fs after the last",
+        received,
+        last - connected,
+        how,
+        now - last,
+    )
     return client
 
 
 def start() -> None:
-    global _client
-    _client = _new_client(config.secrets, _on_connect, _on_message, 3.0)
+    """Start the subscriber, keeping the connection discovery opened when there is one."""
+    global _client, _publisher, _publishing, _settled_in
+    if _client is None:
+        _client = _new_client(config.secrets, _on_connect, _on_message, 3.0)
+    elif _settled_in is not None:
+        _settle_times.observe("reused", _settled_in)
+        _log.info("mqtt: subscriber kept discovery's connection, skipping a %.2fs connect and flood", _settled_in)
+        _settled_in = None
+    if _publisher is None:
+        _publishing = True
+        _publisher = threading.Thread(target=_publish_loop, name="orc-mqtt-publish", daemon=True)
+        _publisher.start()
+        atexit.register(stop)
+
+
+def stop() -> None:
+    """Stop pacing: commands still queued are sent right away, later ones directly."""
+    global _publisher, _publishing
+    if _publisher is None:
+        return
+    with _outbox_cond:
+        _publishing = False
+        _outbox_cond.notify_all()
+    _publisher.join()
+    _publisher = None
 
 
 def snapshot() -> list[m.DeviceState]:
-    return sorted(_devices.values(), key=lambda d: d.id)
+    return list(_devices.view().ordered)
+
+
+def device_state(id: int) -> m.DeviceState | None:
+    return _devices.get(id)
+
+
+def changed_since(version: int) -> tuple[int, list[m.DeviceState]]:
+    """(current version, devices whose document changed after ``version``), by id. 0 gets every device."""
+    view = _devices.view()
+    return view.version, list(view.changed_since(version))
 
 
 def fetch_light_states(lights: Sequence[m.DeviceEnum]) -> m.Configs:
@@ -133,31 +346,37 @@ def fetch_light_states(lights: Sequence[m.DeviceEnum]) -> m.Configs:
     device event, whatever channel commanded it). Virtual devices (negative synthetic
     id), devices not selected in the MQTT Export app, and an unpopulated cache (broker
     down / just booted) report off, matching the old poll's missing-device rule."""
-    found = {d.id: d.attributes for d in snapshot()}
+    found = _devices.view().by_id
+    return m.Configs(*(m.Config(what=light, state=_light_state(found.get(light.value))) for light in lights))
 
-    def state(light: m.DeviceEnum) -> int | str:
-        attrs = found.get(light.value)
-        if attrs is None:
-            return m.OFF
-        switch = attrs.get("switch", m.OFF)
-        return int(attrs["level"]) if ("level" in attrs and switch == m.ON) else switch
 
-    return m.Configs(*(m.Config(what=light, state=state(light)) for light in lights))
+def light_state(light: m.DeviceEnum) -> int | str | None:
+    """The light's state from its cached document, as fetch_light_states reports it; None
+    when there is no document yet or an orc command to it hasn't been reflected in one."""
+    device, pending = _devices.get(light.value), _commanded.get(light.value)
+    if device is None or (pending is not None and time.monotonic() - pending.time <= _COMMAND_TTL_SEC):
+        return None
+    return _light_state(device)
 
 
-def fetch_hubitat_config(secrets: m.Secrets, timeout: float = 3.0) -> dict[str, tuple[int, frozenset[m.Capability]]]:
-    found: dict[str, tuple[int, frozenset[m.Capability]]] = {}
+def _light_state(device: m.DeviceState | None) -> int | str:
+    attrs = device.attributes if device is not None else {}
+    switch = attrs.get("switch", m.OFF)
+    return int(attrs["level"]) if ("level" in attrs and switch == m.ON) else switch
 
-    def on_message(client: mqtt.Client, userdata: Any, msg: mqtt.MQTTMessage) -> None:
-        device = _parse_device_state(msg)
-        if device is not None:
-            dimmable = "level" in device.attributes
-            found[device.name] = (device.id, frozenset([m.Capability.change_level]) if dimmable else frozenset())
 
-    client = _new_client(secrets, _on_connect, on_message, timeout)
-    client.loop_stop()
-    client.disconnect()
+def fetch_hubitat_config(secrets: m.Secrets, timeout: float = 3.0) -> dict[str, tuple[int, frozenset[m.Capability]]]:
+    """Device name -> (id, capabilities), from the retained documents. The connection
+    stays open as the standing subscriber start() takes over, so boot pays for one
+    connection and one flood."""
+    global _client
+    if _client is None:
+        _client = _new_client(secrets, _on_connect, _on_message, timeout)
+    found = {d.name: (d.id, frozenset([m.Capability.change_level]) if "level" in d.attributes else frozenset()) for d in snapshot()}
     if not found:
+        _client.loop_stop()
+        _client.disconnect()
+        _client = None
         raise RuntimeError("mqtt: device discovery found no device documents; broker unreachable or MQTT credentials missing")
     return found
 
@@ -179,9 +398,78 @@ def publish_light(light: m.DeviceEnum, on: bool | None = None, brightness: int |
     if _client is None or _hub_id is None:
         raise RuntimeError(f"mqtt client not started or hub not yet seen; cannot command {light.name}")
     topic = f"hubitat/{_hub_id}/devices/{light.value}/commands/{command}"
-    _command_sent[topic] = time.monotonic()
     _commanded[light.value] = expected
+    sent: Future[None] | None = None
+    with _outbox_cond:
+        if _publishing:
+            sent = Future()
+            queued = _Queued(topic, payload, time.monotonic(), [sent])
+            if (superseded := _outbox.get(light.value)) is not None:
+                # keeps its place in the queue and its wait so far; its caller waits on this send
+                queued = queued._replace(queued=superseded.queued, waiters=[*superseded.waiters, sent])
+                _outbox_stats.inc("superseded")
+            _outbox[light.value] = queued
+            _outbox_depth.set("queued", len(_outbox))
+            _outbox_cond.notify()
+    if sent is None:
+        _send(topic, payload)
+    else:
+        sent.result()  # raises what sending raised, so dispatch reports it
+
+
+def _send(topic: str, payload: str | None) -> None:
+    assert _client is not None  # publish_light checked before queueing
+    _command_sent[topic] = time.monotonic()
     _client.publish(topic, payload)
+    _outbox_stats.inc("published")
+
+
+def _publish_loop() -> None:
+    global _publishing
+    try:
+        _pace()
+    except Exception:
+        _log.exception("mqtt: command pacing failed; publishing commands directly")
+        with _outbox_cond:
+            _publishing = False
+            pending = list(_outbox.values())
+            _outbox.clear()
+            _outbox_depth.set("queued", 0)
+        for command in pending:
+            _deliver(command)
+
+
+def _pace() -> None:
+    tokens, refilled = float(config.settings.mqtt_burst), time.monotonic()
+    while True:
+        with _outbox_cond:
+            _outbox_cond.wait_for(lambda: _outbox or not _publishing)
+            if not _outbox:
+                return
+            now = time.monotonic()
+            tokens = min(float(config.settings.mqtt_burst), tokens + (now - refilled) * config.settings.mqtt_rate)
+            refilled = now
+            if tokens < 1 and _publishing:
+                _outbox_cond.wait((1 - tokens) / config.settings.mqtt_rate)
+                continue
+            tokens -= 1
+            _, command = _outbox.popitem(last=False)
+            _outbox_depth.set("queued", len(_outbox))
+        _deliver(command)
+        _outbox_wait.observe(command.topic.rsplit("/", 1)[1], now - command.queued)
+
+
+def _deliver(command: _Queued) -> None:
+    """Send a queued command and hand the outcome to the publish_light calls waiting on it."""
+    try:
+        _send(command.topic, command.payload)
+    except Exception as exc:
+        _outbox_stats.inc("failed")
+        for waiter in command.waiters:
+            waiter.set_exception(exc)
+    else:
+        for waiter in command.waiters:
+            waiter.set_result(None)
 
 
 def _on_connect(client: mqtt.Client, userdata: Any, flags: Any, rc: Any, *args: Any) -> None:
@@ -190,19 +478,28 @@ def _on_connect(client: mqtt.Client, userdata: Any, flags: Any, rc: Any, *args:
         _log.warning("mqtt: connect refused: %s", rc)
         return
     # Subscribe after CONNACK: paho drops (does not queue) subscriptions made earlier.
-    client.subscribe("hubitat/#", qos=0)
+    # userdata is the settle sentinel until the first flood settles, then None.
+    client.subscribe([("hubitat/#", 0), *([(userdata, 0)] if userdata else [])])
+    if userdata:
+        client.publish(userdata)  # see _new_client
 
 
 def _parse_device_state(msg: mqtt.MQTTMessage) -> m.DeviceState | None:
+    """Attribute names are interned (every device repeats the same few); when the cached
+    document has the same attributes, its map is reused, so an unchanged map is shared
+    rather than copied and diffs against it by identity."""
     parts = msg.topic.split("/")
     if len(parts) != 4 or parts[2] != "devices":
         return None
     try:
         doc = json.loads(msg.payload)
+        id = int(doc["id"])
+        attributes = {sys.intern(a["name"]): a["value"] for a in doc["attributes"]}
+        cached = _devices.get(id)
         return m.DeviceState(
-            id=int(doc["id"]),
+            id=id,
             name=doc["name"],
-            attributes={a["name"]: a["value"] for a in doc["attributes"]},
+            attributes=cached.attributes if cached is not None and cached.attributes == attributes else attributes,
             last_activity=doc.get("lastActivity"),
         )
     except ValueError, KeyError, TypeError:
@@ -210,18 +507,6 @@ def _parse_device_state(msg: mqtt.MQTTMessage) -> m.DeviceState | None:
         return None
 
 
-def _wait_settled(count: Callable[[], int], timeout: float) -> bool:
-    deadline = time.monotonic() + timeout
-    previous = -1
-    while time.monotonic() < deadline:
-        time.sleep(0.25)
-        current = count()
-        if current and current == previous:
-            return True
-        previous = current
-    return False
-
-
 def _on_message(client: mqtt.Client, userdata: Any, msg: mqtt.MQTTMessage) -> None:
     global _hub_id
     parts = msg.topic.split("/")
@@ -238,12 +523,20 @@ def _on_message(client: mqtt.Client, userdata: Any, msg: mqtt.MQTTMessage) -> No
 
 
 def _receive_document(msg: mqtt.MQTTMessage) -> None:
+    if _payloads.get(msg.topic) == msg.payload:
+        _document_stats.inc("replayed")
+        return
     device = _parse_device_state(msg)
     if device is None:
         return
-    old, _devices[device.id] = _devices.get(device.id), device
+    old = _devices.put(device)
+    _payloads[msg.topic] = msg.payload
     if old is None or old == device:
+        _document_stats.inc("new" if old is None else "unchanged")
         return
+    _document_stats.inc("changed")
+    old_attributes = old.attributes
+    changed = {} if device.attributes is old_attributes else {a: v for a, v in device.attributes.items() if old_attributes.get(a) != v}
     now, expected = time.monotonic(), _commanded.get(device.id)
     for a in ("switch", "level"):
         before, after = (_Command(now, device.id, **{a: d.attributes.get(a)}) for d in (old, device))
@@ -251,14 +544,18 @@ def _receive_document(msg: mqtt.MQTTMessage) -> None:
             _fire(_external_listeners, msg.topic, device, a, old.attributes.get(a), device.attributes.get(a))
     if expected == _Command(now, device.id, device.attributes.get("level"), device.attributes.get("switch")):
         _commanded.pop(device.id)
-    for attribute, new_value in device.attributes.items():
-        _fire(_listeners, msg.topic, device, attribute, old.attributes.get(attribute), new_value)
+    index = _listeners
+    for attribute, new_value in (device.attributes if _full_subscribed else changed).items():
+        keys = ((None, None), (device.id, None), (None, attribute), (device.id, attribute))
+        for subscription in sorted(chain.from_iterable(index.get(key, ()) for key in keys)):
+            if subscription.full or attribute in changed:
+                _fire([subscription.fn], msg.topic, device, attribute, old_attributes.get(attribute), new_value)
 
 
 def _receive_command_echo(msg: mqtt.MQTTMessage) -> None:
     sent = _command_sent.pop(msg.topic)
     if sent is not None:
-        sqlite.update_avg(msg.topic, time.monotonic() - sent)
+        durations.update_avg(msg.topic, time.monotonic() - sent)
 
 
 def _receive_button_event(msg: mqtt.MQTTMessage) -> None:
@@ -271,11 +568,21 @@ def _receive_button_event(msg: mqtt.MQTTMessage) -> None:
     _fire(_button_listeners, msg.topic, *event)
 
 
-def _fire(listeners: Sequence[Callable[..., None]], topic: str, *args: Any) -> None:
-    """Call each listener, isolating failures so one bad consumer can't starve the
-    rest or kill the mqtt thread."""
+def _fire(listeners: Sequence[Callable[..., None] | _Mailbox], topic: str, *args: Any) -> None:
+    """Call, or queue for, each listener."""
     for listener in list(listeners):
-        try:
-            listener(*args)
-        except Exception:
-            _log.exception("mqtt: listener failed for %s", topic)
+        if isinstance(listener, _Mailbox):
+            listener.put(topic, args)
+        else:
+            _call(listener, topic, args)
+
+
+def _call(fn: Callable[..., None], topic: str, args: tuple[Any, ...]) -> None:
+    """Isolates failures, so one bad consumer can't starve the rest or kill the mqtt thread."""
+    started = time.perf_counter()
+    try:
+        fn(*args)
+    except Exception:
+        _log.exception("mqtt: listener failed for %s", topic)
+    finally:
+        _listener_times.observe(_listener_name(fn), time.perf_counter() - started)
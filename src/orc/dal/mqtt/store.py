@@ -0,0 +1,77 @@
+"""Indexed, versioned cache of Hubitat device documents.
+
+The mqtt thread is the only writer, once per received document; readers are
+request threads, dispatch workers, and listeners. Each change publishes a new
+immutable ``DeviceView`` (copy-on-write), so a reader takes ``view()`` once and
+looks devices up by id, name, or attribute without a lock and without copying the
+cache. Every change bumps the version, and each device remembers the version it last
+changed at, so pollers ask for ``changed_since(version)`` instead of the whole cache.
+"""
+
+import threading
+from collections.abc import Mapping
+from types import MappingProxyType
+from typing import NamedTuple
+
+from orc import model as m
+
+
+class DeviceView(NamedTuple):
+    version: int
+    by_id: Mapping[int, m.DeviceState]
+    by_name: Mapping[str, m.DeviceState]
+    by_attribute: Mapping[str, frozenset[int]]  # attribute name -> ids of devices reporting it
+    changed: Mapping[int, int]  # id -> version the device last changed at
+    ordered: tuple[m.DeviceState, ...]  # by id
+
+    def with_attribute(self, attribute: str) -> tuple[m.DeviceState, ...]:
+        return tuple(self.by_id[id] for id in sorted(self.by_attribute.get(attribute, ())))
+
+    def changed_since(self, version: int) -> tuple[m.DeviceState, ...]:
+        return tuple(d for d in self.ordered if self.changed[d.id] > version)
+
+
+class DeviceStore:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()  # serializes writers; readers never take it
+        self._view = DeviceView(0, MappingProxyType({}), MappingProxyType({}), MappingProxyType({}), MappingProxyType({}), ())
+
+    def view(self) -> DeviceView:
+        return self._view
+
+    def get(self, id: int) -> m.DeviceState | None:
+        return self._view.by_id.get(id)
+
+    def put(self, device: m.DeviceState) -> m.DeviceState | None:
+        """Store the document; returns the one it replaced. A replay (equal document) publishes nothing."""
+        with self._lock:
+            view = self._view
+            old = view.by_id.get(device.id)
+            if old == device:
+                return old
+            version = view.version + 1
+            by_id = {**view.by_id, device.id: device}
+            by_name = dict(view.by_name)
+            if old is not None and by_name.get(old.name) is old:
+                del by_name[old.name]
+            by_name[device.name] = device
+            by_attribute = view.by_attribute
+            before = old.attributes.keys() if old is not None else frozenset[str]()
+            dropped, added = before - device.attributes.keys(), device.attributes.keys() - before
+            if dropped or added:  # the index only changes when a device's attribute set does
+                index = dict(by_attribute)
+                for attribute in dropped:
+                    index[attribute] -= {device.id}
+                for attribute in added:
+                    index[attribute] = index.get(attribute, frozenset()) | {device.id}
+                by_attribute = MappingProxyType(index)
+            ordered = tuple(by_id[id] for id in sorted(by_id)) if old is None else tuple(by_id[d.id] for d in view.ordered)
+            self._view = DeviceView(
+                version,
+                MappingProxyType(by_id),
+                MappingProxyType(by_name),
+                by_attribute,
+                MappingProxyType({**view.changed, device.id: version}),
+                ordered,
+            )
+            return old
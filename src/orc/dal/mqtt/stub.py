@@ -1,4 +1,4 @@
-from collections.abc import Sequence
+from collections.abc import Iterable, Sequence
 from typing import Any
 
 from orc import model as m
@@ -21,6 +21,10 @@ def fetch_light_states(lights: Sequence[m.DeviceEnum]) -> m.Configs:
     return m.Configs(*(m.Config(what=light, state=_states.get(light, m.OFF)) for light in lights))
 
 
+def light_state(light: m.DeviceEnum) -> int | str | None:
+    return _states.get(light)
+
+
 def publish_light(light: m.DeviceEnum, on: bool | None = None, brightness: int | None = None) -> None:
     if brightness is not None and m.Capability.change_level in light.capabilities:
         _states[light] = brightness or m.OFF
@@ -38,15 +42,30 @@ def snapshot() -> list[m.DeviceState]:
     return []
 
 
-def add_listener(fn: m.Listener) -> None:
+def device_state(id: int) -> m.DeviceState | None:
+    return None
+
+
+def changed_since(version: int) -> tuple[int, list[m.DeviceState]]:
+    return 0, []
+
+
+def add_listener(
+    fn: m.Listener,
+    devices: Iterable[int] | None = None,
+    attributes: Iterable[str] | None = None,
+    queue: int | None = None,
+    coalesce: bool = False,
+    full: bool = False,
+) -> None:
     _listeners.append(fn)
 
 
-def add_button_listener(fn: m.ButtonListener) -> None:
+def add_button_listener(fn: m.ButtonListener, queue: int | None = None) -> None:
     _button_listeners.append(fn)
 
 
-def add_external_listener(fn: m.Listener) -> None:
+def add_external_listener(fn: m.Listener, queue: int | None = None, coalesce: bool = False) -> None:
     _external_listeners.append(fn)
 
 
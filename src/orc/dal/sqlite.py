@@ -1,4 +1,6 @@
 import sqlite3
+import threading
+import time
 from collections.abc import Iterable, Iterator
 from contextlib import contextmanager
 from datetime import date, datetime
@@ -8,7 +10,15 @@ from sqlalchemy.engine.url import make_url
 
 from orc import config
 
-_ALPHA: float = 0.3
+# One long-lived connection per thread (sqlite3 connections are thread-bound), so the
+# per-connection statement cache survives across calls instead of being rebuilt by every
+# connect(). WAL lets the web thread read while the mqtt thread or a scheduler worker
+# writes; a writer that still collides waits out _BUSY_TIMEOUT_SEC rather than raising
+# "database is locked". synchronous=NORMAL is WAL's safe setting: a power cut can lose
+# the last commits but never corrupts the file.
+_BUSY_TIMEOUT_SEC: float = 5.0
+_CACHED_STATEMENTS: int = 256
+_local = threading.local()
 
 
 def delete_presence(names: Iterable[str], before: datetime, force: bool) -> None:
@@ -38,6 +48,26 @@ def fetch_theme_override() -> tuple[str, date, date] | None:
     return (row[0], date.fromisoformat(row[1]), date.fromisoformat(row[2]))
 
 
+def fetch_ephemeris(year: int, lat: float | None, long: float | None, tz: str) -> bytes | None:
+    with connection() as conn:
+        row = conn.execute(
+            "SELECT data FROM orc_ephemeris WHERE year = ? AND lat = ? AND long = ? AND tz = ?",
+            (year, lat, long, tz),
+        ).fetchone()
+    return row[0] if row else None
+
+
+def fetch_streams() -> list[Any]:
+    with connection() as conn:
+        return conn.execute("SELECT id, url, title, expires, used FROM orc_streams").fetchall()
+
+
+def fetch_tts_phrase(key: str) -> tuple[int, bytes] | None:
+    with connection() as conn:
+        row = conn.execute("SELECT rate, pcm FROM orc_tts_phrases WHERE key = ?", (key,)).fetchone()
+    return (row[0], row[1]) if row else None
+
+
 def init_db() -> None:
     with connection() as conn:
         conn.execute(
@@ -46,6 +76,42 @@ def init_db() -> None:
         )
         conn.execute("CREATE TABLE IF NOT EXISTS orc_presence (name TEXT PRIMARY KEY, last_seen TEXT NOT NULL)")
         conn.execute("CREATE TABLE IF NOT EXISTS orc_durations (name TEXT PRIMARY KEY, samples INTEGER NOT NULL, avg REAL NOT NULL)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS orc_ephemeris "
+            "(year INTEGER NOT NULL, lat REAL NOT NULL, long REAL NOT NULL, tz TEXT NOT NULL, data BLOB NOT NULL, "
+            "PRIMARY KEY (year, lat, long, tz))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS orc_streams "
+            "(id TEXT PRIMARY KEY, url TEXT NOT NULL, title TEXT NOT NULL, expires REAL NOT NULL, used REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS orc_tts_phrases "
+            "(key TEXT PRIMARY KEY, rate INTEGER NOT NULL, pcm BLOB NOT NULL, stored_at REAL NOT NULL)"
+        )
+
+
+def insert_ephemeris(year: int, lat: float | None, long: float | None, tz: str, data: bytes) -> None:
+    with connection() as conn:
+        conn.execute(
+            "INSERT INTO orc_ephemeris (year, lat, long, tz, data) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(year, lat, long, tz) DO UPDATE SET data=excluded.data",
+            (year, lat, long, tz, data),
+        )
+
+
+def insert_tts_phrase(key: str, rate: int, pcm: bytes, keep: int) -> None:
+    # Keeps only the `keep` most recently stored phrases.
+    with connection() as conn:
+        conn.execute(
+            "INSERT INTO orc_tts_phrases (key, rate, pcm, stored_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET rate=excluded.rate, pcm=excluded.pcm, stored_at=excluded.stored_at",
+            (key, rate, pcm, time.time()),
+        )
+        conn.execute(
+            "DELETE FROM orc_tts_phrases WHERE key NOT IN (SELECT key FROM orc_tts_phrases ORDER BY stored_at DESC, rowid DESC LIMIT ?)",
+            (keep,),
+        )
 
 
 def insert_presence(names: Iterable[str], when: datetime) -> None:
@@ -70,13 +136,27 @@ def delete_all_presence(before: datetime) -> None:
         conn.execute("DELETE FROM orc_presence WHERE last_seen < ?", (before.isoformat(),))
 
 
-def update_avg(name: str, duration: float) -> None:
-    sql = """
-    INSERT INTO orc_durations (name, samples, avg) VALUES (?, 1, ?)
-    ON CONFLICT(name) DO UPDATE SET samples = samples + 1, avg = ? * ? + (1 - ?) * avg WHERE name = ?;
-    """
+def store_stream(id: str, url: str, title: str, expires: float, used: float) -> None:
     with connection() as conn:
-        conn.execute(sql, (name, duration, duration, _ALPHA, _ALPHA, name))
+        conn.execute(
+            "INSERT INTO orc_streams (id, url, title, expires, used) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET url=excluded.url, title=excluded.title, expires=excluded.expires, used=excluded.used",
+            (id, url, title, expires, used),
+        )
+
+
+def delete_streams(ids: Iterable[str]) -> None:
+    with connection() as conn:
+        conn.executemany("DELETE FROM orc_streams WHERE id = ?", [(id,) for id in ids])
+
+
+def store_durations(rows: Iterable[tuple[str, int, float]]) -> None:
+    with connection() as conn:
+        conn.executemany(
+            "INSERT INTO orc_durations (name, samples, avg) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET samples=excluded.samples, avg=excluded.avg",
+            rows,
+        )
 
 
 def fetch_durations() -> list[Any]:
@@ -87,11 +167,44 @@ def fetch_durations() -> list[Any]:
 @contextmanager
 def connection() -> Iterator[sqlite3.Connection]:
     # Public DB connection context manager; plugins use it to own their own tables.
-    db_path = make_url(config.settings.jobs_db).database
-    assert db_path is not None  # a configured sqlite URL always includes a path
-    conn = sqlite3.connect(db_path)
+    # The outermost `with` block is one transaction on the thread's pooled connection:
+    # committed on exit, rolled back on error. A nested block shares that connection, so
+    # it runs in a savepoint instead: its error undoes only its own work, and nothing it
+    # wrote is committed until the outermost block exits cleanly. The connection stays
+    # open for the thread's lifetime.
+    conn = _thread_connection()
+    depth: int = getattr(_local, "depth", 0)
+    _local.depth = depth + 1
     try:
-        with conn:
+        if not depth:
+            with conn:
+                yield conn
+            return
+        if not conn.in_transaction:
+            conn.execute("BEGIN")  # else releasing the savepoint would commit on its own
+        savepoint = f"orc_nested_{depth}"
+        conn.execute(f"SAVEPOINT {savepoint}")
+        try:
             yield conn
+        except BaseException:
+            conn.execute(f"ROLLBACK TO {savepoint}")
+            raise
+        finally:
+            conn.execute(f"RELEASE {savepoint}")
     finally:
-        conn.close()
+        _local.depth = depth
+
+
+def _thread_connection() -> sqlite3.Connection:
+    db_path = make_url(config.settings.jobs_db).database
+    assert db_path is not None  # a configured sqlite URL always includes a path
+    pooled: tuple[str, sqlite3.Connection] | None = getattr(_local, "connection", None)
+    if pooled is not None and pooled[0] == db_path:
+        return pooled[1]
+    if pooled is not None:
+        pooled[1].close()  # jobs_db changed under us (tests); don't keep the old file open
+    conn = sqlite3.connect(db_path, timeout=_BUSY_TIMEOUT_SEC, cached_statements=_CACHED_STATEMENTS)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    _local.connection = (db_path, conn)
+    return conn
@@ -15,6 +15,7 @@ class Declarations:
     controllable_devices: list[str] = field(default_factory=lambda: ["Light", "Chromecast", "AC"])
     device_icons: dict[str, str] = field(default_factory=dict)
     dispatch_handlers: dict[str, Callable[..., None]] = field(default_factory=dict)
+    unchanged_checks: dict[str, Callable[..., bool]] = field(default_factory=dict)
     state_providers: dict[str, Callable[[], Any]] = field(default_factory=dict)
     setup_hooks: list[Callable[[Any], None]] = field(default_factory=list)
     scripts: dict[str, Path] = field(default_factory=dict)
@@ -22,8 +23,10 @@ class Declarations:
     blueprints: list[tuple[str, str, Blueprint]] = field(default_factory=list)
     _current_plugin: str = ""
 
-    def declare_dispatch(self, name: str, fn: Callable[..., None]) -> None:
+    def declare_dispatch(self, name: str, fn: Callable[..., None], unchanged: Callable[..., bool] | None = None) -> None:
         self.dispatch_handlers[name] = fn
+        if unchanged is not None:
+            self.unchanged_checks[name] = unchanged
 
     def declare(
         self,
@@ -31,6 +34,7 @@ class Declarations:
         controllable: Iterable[str] = (),
         icons: dict[str, str] | None = None,
         dispatch: dict[str, Callable[..., None]] | None = None,
+        unchanged: dict[str, Callable[..., bool]] | None = None,
         state_providers: dict[str, Callable[[], Any]] | None = None,
         setup: Iterable[Callable[[Any], None]] = (),
         scripts: Iterable[Path | str] = (),
@@ -39,6 +43,7 @@ class Declarations:
     ) -> None:
         self.device_icons.update(icons or {})
         self.dispatch_handlers.update(dispatch or {})
+        self.unchanged_checks.update(unchanged or {})
         self.state_providers.update(state_providers or {})
         self.scripts.update({Path(s).name: Path(s) for s in scripts})
         self.button_labels.update(button_labels or {})
@@ -59,6 +64,7 @@ class Declarations:
                 icon=self.device_icons.get(name, "light-bulb"),
                 controllable=name in self.controllable_devices,
                 dispatch=self.dispatch_handlers.get(name),
+                unchanged=self.unchanged_checks.get(name),
             )
             for name, cls in enums.items()
         }
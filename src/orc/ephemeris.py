@@ -0,0 +1,138 @@
+"""Sunrise/sunset for the configured lat/long.
+
+``get_schedule`` asks for the same two days over and over (the nightly rebuild,
+replays, theme changes, ``back_on_schedule``), and each ask used to be a skyfield
+search. Instead a whole year's transitions are searched once into a compact table —
+two POSIX timestamps per local day, sunrise then sunset, NaN where the sun doesn't
+cross — stored as a blob in the state DB and read by day-of-year index. A day whose
+year has no table yet is searched live.
+
+skyfield and the de421 kernel are loaded on the first search, not at import, so a
+process that only reads tables (or never schedules at all) never pays for them.
+"""
+
+import array
+import math
+import threading
+from datetime import UTC, date, datetime, timedelta
+from importlib import resources  # nosemgrep: python37-compatibility-importlib2
+from typing import Any
+
+from orc import config
+from orc.dal import sqlite
+
+# almanac.dark_twilight_day levels: 3 is civil twilight, 4 is day
+_SUNRISE = (3, 4)
+_SUNSET = (4, 3)
+
+type _Key = tuple[int, float | None, float | None, str]  # year, lat, long, tz: the table's local days depend on all four
+
+_lock = threading.Lock()
+_skyfield_lock = threading.Lock()
+_skyfield_objects: tuple[Any, Any] | None = None  # (timescale, twilight function), built on first search
+_tables: dict[_Key, array.array[float]] = {}
+_building: set[_Key] = set()
+
+
+def sun_times(day: date) -> tuple[datetime | None, datetime | None]:
+    """(sunrise, sunset) in UTC for the local calendar day; None where there is none."""
+    table = _table(day.year)
+    if table is None:
+        return _search(_local_midnight(day), _local_midnight(day + timedelta(days=1))).get(day, (None, None))
+    i = 2 * (day.timetuple().tm_yday - 1)
+    return _from_timestamp(table[i]), _from_timestamp(table[i + 1])
+
+
+def ensure_table(year: int) -> None:
+    """Build and store ``year``'s table on a background thread unless it already exists."""
+    key = _key(year)
+    with _lock:
+        if key in _tables or key in _building:
+            return
+        _building.add(key)
+    threading.Thread(target=_build_missing, args=(year,), name="orc-ephemeris", daemon=True).start()
+
+
+def _build_missing(year: int) -> None:
+    try:
+        if _table(year) is None:
+            _build(year)
+    finally:
+        with _lock:
+            _building.discard(_key(year))
+
+
+def _build(year: int) -> array.array[float]:
+    first = date(year, 1, 1)
+    days = (date(year + 1, 1, 1) - first).days
+    table = array.array("d", [math.nan] * (2 * days))
+    for day, times in _search(_local_midnight(first), _local_midnight(date(year + 1, 1, 1))).items():
+        i = 2 * (day - first).days
+        for offset, when in enumerate(times):
+            if when is not None:
+                table[i + offset] = when.timestamp()
+    key = _key(year)
+    sqlite.insert_ephemeris(*key, table.tobytes())
+    with _lock:
+        _tables[key] = table
+    return table
+
+
+def _table(year: int) -> array.array[float] | None:
+    key = _key(year)
+    with _lock:
+        table = _tables.get(key)
+    if table is None and (blob := sqlite.fetch_ephemeris(*key)) is not None:
+        table = array.array("d")
+        table.frombytes(blob)
+        with _lock:
+            _tables[key] = table
+    return table
+
+
+def _search(start: datetime, end: datetime) -> dict[date, tuple[datetime | None, datetime | None]]:
+    """Sunrise/sunset transitions in [start, end), keyed by the local day they fall on."""
+    from skyfield import almanac
+
+    timescale, twilight_fn = _skyfield()
+    t0, t1 = timescale.from_datetime(start), timescale.from_datetime(end)
+    prev = int(twilight_fn(t0).item())
+    times, twilight = almanac.find_discrete(t0, t1, twilight_fn)
+    found: dict[date, tuple[datetime | None, datetime | None]] = {}
+    for t, curr in zip(times, twilight):
+        curr = int(curr)
+        when = t.utc_datetime()
+        day = when.astimezone(config.settings.tz).date()
+        sunrise, sunset = found.get(day, (None, None))
+        if (prev, curr) == _SUNRISE:
+            found[day] = (when, sunset)
+        elif (prev, curr) == _SUNSET:
+            found[day] = (sunrise, when)
+        prev = curr
+    return found
+
+
+def _skyfield() -> tuple[Any, Any]:
+    global _skyfield_objects
+    if _skyfield_objects is None:
+        with _skyfield_lock:
+            if _skyfield_objects is None:
+                from skyfield import almanac
+                from skyfield.api import load, load_file, wgs84
+
+                kernel = load_file(str(resources.files("orc_data") / "de421.bsp"))
+                twilight_fn = almanac.dark_twilight_day(kernel, wgs84.latlon(config.settings.lat, config.settings.long))
+                _skyfield_objects = (load.timescale(), twilight_fn)
+    return _skyfield_objects
+
+
+def _key(year: int) -> _Key:
+    return (year, config.settings.lat, config.settings.long, str(config.settings.tz))
+
+
+def _local_midnight(day: date) -> datetime:
+    return datetime(day.year, day.month, day.day, tzinfo=config.settings.tz)
+
+
+def _from_timestamp(value: float) -> datetime | None:
+    return None if math.isnan(value) else datetime.fromtimestamp(value, UTC)
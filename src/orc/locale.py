@@ -1,5 +1,6 @@
 class Log:
     BOOT: str = "Boot"
+    VOICE_LOADED: str = "TTS voice loaded in {seconds:.1f}s"
 
     SNAPSHOT_TAKEN: str = "Snapshot for `{name}` until {end:%I:%M}: {items}"
     SNAPSHOT_ALL_OFF: str = "all off"
@@ -14,6 +15,8 @@ class Log:
     RULE_SKIPPED: str = "skipped: {detail}"
     RULE_SUPPRESSED: str = "Suppressed by snapshot: {kinds}"
     DISPATCH_FAILED: str = "Dispatch failed for `{device}`: {exc}"
+    DISPATCH_PLAN: str = "Plan: {steps}"
+    DISPATCH_UNCHANGED: str = "Skipped {count} already set: {steps}"
     VIRTUAL_DEVICE_SKIPPED: str = "Skipped `{device}`: virtual device, nothing to dispatch"
 
     PRESENCE_PING_FAILED: str = "Presence ping failed for `{name}`: {exc}"
@@ -0,0 +1,104 @@
+"""Process-local instrumentation.
+
+Named counters, gauges and latency histograms, created on first use and kept for the life of
+the process. Cheap and thread-safe enough to bump from the mqtt thread; the views read
+them back.
+"""
+
+import bisect
+import threading
+from typing import Any
+
+
+class Counter:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counts: dict[str, int] = {}
+
+    def inc(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + n
+
+    def get(self, key: str) -> int:
+        with self._lock:
+            return self._counts.get(key, 0)
+
+    def snapshot(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+
+class Gauge:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._values: dict[str, int] = {}
+
+    def set(self, key: str, value: int) -> None:
+        with self._lock:
+            self._values[key] = value
+
+    def get(self, key: str) -> int:
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def snapshot(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._values)
+
+
+class Histogram:
+    # Upper bounds in seconds; observations above the last land in an overflow bucket.
+    BOUNDS: tuple[float, ...] = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._series: dict[str, tuple[list[int], float, float]] = {}  # key -> (bucket counts, sum, max)
+
+    def observe(self, key: str, value: float) -> None:
+        with self._lock:
+            buckets, total, peak = self._series.get(key) or ([0] * (len(self.BOUNDS) + 1), 0.0, 0.0)
+            buckets[bisect.bisect_left(self.BOUNDS, value)] += 1
+            self._series[key] = (buckets, total + value, max(peak, value))
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        with self._lock:
+            return {
+                key: {
+                    "count": sum(buckets),
+                    "sum": round(total, 3),
+                    "max": round(peak, 3),
+                    "buckets": {f"le_{bound:g}": n for bound, n in zip(self.BOUNDS, buckets)} | {"inf": buckets[-1]},
+                }
+                for key, (buckets, total, peak) in self._series.items()
+            }
+
+
+_counters: dict[str, Counter] = {}
+_gauges: dict[str, Gauge] = {}
+_histograms: dict[str, Histogram] = {}
+_lock = threading.Lock()
+
+
+def counter(name: str) -> Counter:
+    with _lock:
+        return _counters.setdefault(name, Counter())
+
+
+def gauge(name: str) -> Gauge:
+    with _lock:
+        return _gauges.setdefault(name, Gauge())
+
+
+def histogram(name: str) -> Histogram:
+    with _lock:
+        return _histograms.setdefault(name, Histogram())
+
+
+def snapshot() -> dict[str, dict[str, Any]]:
+    with _lock:
+        counters, gauges, histograms = dict(_counters), dict(_gauges), dict(_histograms)
+    return {
+        "counters": {name: c.snapshot() for name, c in sorted(counters.items())},
+        "gauges": {name: g.snapshot() for name, g in sorted(gauges.items())},
+        "histograms": {name: h.snapshot() for name, h in sorted(histograms.items())},
+    }
@@ -65,6 +65,8 @@ class Settings(NamedTuple):
     hubitat_url: str = "http://hubitat.example"
     http_timeout: int = 5
     port: int = 8000
+    mqtt_rate: float = 8.0
+    mqtt_burst: int = 4
 
     @classmethod
     def build(cls, **values: Any) -> Settings:
@@ -74,9 +76,16 @@ class Settings(NamedTuple):
             ("long", float),
             ("http_timeout", int),
             ("port", int),
+            ("mqtt_rate", float),
+            ("mqtt_burst", int),
         ):
             if key in values:
                 values[key] = coerce(values[key])
+        # The mqtt publisher divides by the rate and spends whole tokens from the burst.
+        if "mqtt_rate" in values and not values["mqtt_rate"] > 0:
+            raise ValueError(_ERR_PARAMS.format("mqtt_rate", values["mqtt_rate"]))
+        if "mqtt_burst" in values and values["mqtt_burst"] < 1:
+            raise ValueError(_ERR_PARAMS.format("mqtt_burst", values["mqtt_burst"]))
         return cls(**values)
 
 
@@ -168,7 +177,7 @@ class WeatherCondition(str, Enum):
     CLOUDY = "CLOUDY"
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class DeviceState:
     """Last-received device document from the hub's MQTT export."""
 
@@ -378,6 +387,7 @@ class DeviceType:
     icon: str
     controllable: bool
     dispatch: Callable[..., None] | None
+    unchanged: Callable[..., bool] | None = None  # (device, rule) -> the device already is in rule's state
 
     def handles(self, name: str) -> bool:
         return name in self.cls.__members__
@@ -11,7 +11,9 @@ from gunicorn.app.base import BaseApplication
 import orc as config
 from orc import _build, api
 from orc import model as m
+from orc import streams, workers
 from orc.api import JOBSTORE_DEFAULT, JOBSTORE_MEMORY, ContextThreadPoolExecutor
+from orc.dal import audio, durations
 from orc.locale import Log
 from orc.view import OrcFlask, VersionManager, bp
 
@@ -46,10 +48,16 @@ def web() -> None:
 def _start_services(ctx: m.AppContext) -> None:
     api.wire_buttons(ctx)
     api.wire_external_log()
+    durations.start()
+    audio.start()
+    streams.start()
+    workers.start()
     config.config.providers.mqtt.start()
     ctx.scheduler.resume()
     api.log(m.LogSource.SYSTEM, Log.BOOT)
     print(f"{api.local_now().isoformat()}: ORC Started", file=sys.stderr, flush=True)
+    # After the boot print: importing piper briefly silences fd 2 process-wide.
+    audio.warm_up(lambda seconds: api.log(m.LogSource.SYSTEM, Log.VOICE_LOADED.format(seconds=seconds)))
 
 
 def _build_app() -> OrcFlask:
@@ -0,0 +1,201 @@
+"""Resolved YouTube stream URLs, shared across dispatches and restarts.
+
+Resolving an id through yt-dlp takes seconds (network plus player JS extraction), and
+scheduled routines play the same few ids day after day. A resolution is kept until the
+``expire=`` timestamp googlevideo embeds in the URL (_DEFAULT_TTL_SEC when there is
+none) and mirrored in the state DB, so a restart starts warm. A URL is never handed out
+with less than _MIN_REMAINING_SEC to live, since the Chromecast keeps fetching from it
+while it plays; a hit inside _REFRESH_AHEAD_SEC of expiry is re-resolved in the
+background. Once ``start()`` has run, a sweeper re-resolves entries used within
+_KEEP_WARM_SEC before they expire and drops expired ones nobody is using.
+
+``prefetch()`` resolves ids ahead of the scheduled routines that play them; a fire
+that then hits the cache counts as served under metrics.counter("stream_prefetch").
+"""
+
+import atexit
+import logging
+import threading
+import time
+from collections.abc import Iterable
+from typing import NamedTuple
+from urllib.parse import parse_qs, urlparse
+
+from orc import config, metrics
+from orc.dal import sqlite
+
+_log = logging.getLogger(__name__)
+
+_DEFAULT_TTL_SEC: float = 3600.0
+_MIN_REMAINING_SEC: float = 1800.0
+_REFRESH_AHEAD_SEC: float = 3600.0
+_KEEP_WARM_SEC: float = 86400.0
+_SWEEP_SEC: float = 300.0
+
+
+class _Stream(NamedTuple):
+    url: str
+    title: str
+    expires: float  # epoch seconds
+    used: float  # epoch seconds of the last resolve() that returned it
+
+
+_lock = threading.Lock()  # guards _streams, _refreshing, _resolving, _prefetched, _loaded_from
+_streams: dict[str, _Stream] = {}
+_refreshing: set[str] = set()  # ids with a background refresh in flight
+_resolving: dict[str, threading.Lock] = {}  # one yt-dlp resolution at a time per id
+_prefetched: set[str] = set()  # ids prefetched since their last resolve()
+_loaded_from: str | None = None  # jobs_db the cache was seeded from
+_stats = metrics.counter("stream_cache")
+_prefetch_stats = metrics.counter("stream_prefetch")
+_sweeper: threading.Thread | None = None
+_stopping = threading.Event()
+
+
+def resolve(id: str) -> tuple[str, str]:
+    """(stream url, title) for a YouTube id or URL, resolved through the chromecast provider when not cached."""
+    now = time.time()
+    refresh = False
+    with _lock:
+        entry = _view().get(id)
+        if entry is not None and entry.expires - now > _MIN_REMAINING_SEC:
+            _streams[id] = entry._replace(used=now)
+            refresh = entry.expires - now < _REFRESH_AHEAD_SEC and id not in _refreshing
+            if refresh:
+                _refreshing.add(id)
+        else:
+            entry = None
+        prefetched = id in _prefetched
+        _prefetched.discard(id)
+    if entry is None:
+        _stats.inc("miss")
+        if prefetched:
+            _prefetch_stats.inc("missed")
+        entry = _resolve(id, now)
+    else:
+        _stats.inc("hit")
+        if prefetched:
+            _prefetch_stats.inc("served")
+    if refresh:
+        threading.Thread(target=_refresh, args=(id,), name="orc-streams", daemon=True).start()
+    return entry.url, entry.title
+
+
+def cached(id: str) -> str | None:
+    """The unexpired stream url ``id`` last resolved to, without resolving or counting a use."""
+    with _lock:
+        entry = _view().get(id)
+    return entry.url if entry is not None and entry.expires > time.time() else None
+
+
+def prefetch(ids: Iterable[str], lead: float = 0.0) -> None:
+    """Make sure each id will still resolve from the cache ``lead`` seconds from now. Failures are logged."""
+    for id in ids:
+        try:
+            now = time.time()
+            with _lock:
+                entry = _view().get(id)
+            if entry is None or entry.expires - now <= _MIN_REMAINING_SEC + lead:
+                _resolve(id, now, force=True)
+                _prefetch_stats.inc("resolved")
+            with _lock:
+                _prefetched.add(id)
+        except Exception:
+            _prefetch_stats.inc("failed")
+            _log.exception("streams: prefetching %s failed; it resolves when played", id)
+
+
+def start(interval: float = _SWEEP_SEC) -> None:
+    global _sweeper
+    if _sweeper is not None:
+        return
+    _stopping.clear()
+    _sweeper = threading.Thread(target=_sweep_loop, args=(interval,), name="orc-streams", daemon=True)
+    _sweeper.start()
+    atexit.register(stop)
+
+
+def stop() -> None:
+    global _sweeper
+    if _sweeper is None:
+        return
+    _stopping.set()
+    _sweeper.join()
+    _sweeper = None
+
+
+def sweep() -> None:
+    """Re-resolve recently used entries that are about to expire; drop expired ones nobody used."""
+    now = time.time()
+    with _lock:
+        view = _view()
+        warm = [id for id, e in view.items() if now - e.used < _KEEP_WARM_SEC and e.expires - now < _REFRESH_AHEAD_SEC]
+        cold = [id for id, e in view.items() if now - e.used >= _KEEP_WARM_SEC and e.expires <= now]
+        for id in cold:
+            del view[id]
+    if cold:
+        sqlite.delete_streams(cold)
+    for id in warm:
+        with _lock:
+            if id in _refreshing:
+                continue
+            _refreshing.add(id)
+        _refresh(id)
+
+
+def _resolve(id: str, used: float, force: bool = False) -> _Stream:
+    with _lock:
+        resolving = _resolving.setdefault(id, threading.Lock())
+    with resolving:
+        if not force:
+            with _lock:
+                entry = _view().get(id)
+            if entry is not None and entry.expires - time.time() > _MIN_REMAINING_SEC:
+                return entry  # resolved by another thread while this one waited
+        url, title = config.providers.chromecast.fetch_youtube_stream_metadata(id)
+        entry = _Stream(url, title, _expiry(url), used)
+        with _lock:
+            _view()[id] = entry
+        sqlite.store_stream(id, *entry)
+        return entry
+
+
+def _refresh(id: str) -> None:
+    try:
+        with _lock:
+            entry = _view().get(id)
+        _resolve(id, entry.used if entry is not None else time.time(), force=True)
+        _stats.inc("refreshed")
+    except Exception:
+        _stats.inc("refresh_failed")
+        _log.exception("streams: refreshing %s failed; the cached URL is served until it expires", id)
+    finally:
+        with _lock:
+            _refreshing.discard(id)
+
+
+def _sweep_loop(interval: float) -> None:
+    while not _stopping.wait(interval):
+        try:
+            sweep()
+        except Exception:
+            _log.exception("streams: sweep failed; retrying next interval")
+
+
+def _expiry(url: str) -> float:
+    expire = parse_qs(urlparse(url).query).get("expire")
+    try:
+        return float(expire[0]) if expire else time.time() + _DEFAULT_TTL_SEC
+    except ValueError:
+        return time.time() + _DEFAULT_TTL_SEC
+
+
+def _view() -> dict[str, _Stream]:
+    # Caller holds _lock. Seeded from the state DB the first time, and again whenever
+    # jobs_db changes (tests swap it per test).
+    global _loaded_from
+    if _loaded_from != config.settings.jobs_db:
+        _streams.clear()
+        _streams.update({id: _Stream(url, title, expires, used) for id, url, title, expires, used in sqlite.fetch_streams()})
+        _loaded_from = config.settings.jobs_db
+    return _streams
@@ -1,7 +1,7 @@
 import random
 import re
 from collections.abc import Callable
-from dataclasses import replace
+from dataclasses import asdict, replace
 from datetime import date, timedelta
 from functools import wraps
 from itertools import chain, groupby
@@ -360,6 +360,18 @@ def durations() -> tuple[dict[str, Any], int]:
     return {name: {"avg": round(avg, 3), "samples": samples} for name, (samples, avg) in api.duration_stats().items()}, 200
 
 
+@bp.route("/api/metrics")
+def metrics() -> tuple[dict[str, Any], int]:
+    return api.metrics_snapshot(), 200
+
+
+@bp.route("/api/devices")
+def devices() -> tuple[dict[str, Any], int]:
+    # Poll with ?since=<the version last returned> to get only the documents changed since.
+    version, changed = api.device_changes(request.args.get("since", 0, type=int))
+    return {"version": version, "devices": [asdict(d) for d in changed]}, 200
+
+
 def _to_level(state: object) -> int:
     if isinstance(state, int):
         return state
@@ -0,0 +1,120 @@
+"""Shared, bounded pool for device dispatch.
+
+``run()`` takes (lane, callable) pairs — the lane is the device-type name — and
+returns their results in order once all of them have finished. Once ``start()`` has
+run, every caller shares one pool of _WORKERS threads, and each lane may hold at most
+``lane_limit`` of them at a time, so a burst of slow Chromecast commands can't keep a
+light from switching. Work over a lane's limit waits in that lane's FIFO. Before
+``start()`` (tests, tools), and for nested calls from a pool thread, which could
+otherwise wait on a slot they are holding themselves, the callables run inline on the
+calling thread.
+
+Per lane, metrics.gauge("dispatch_queued") and metrics.gauge("dispatch_running") hold
+the current depth and metrics.histogram("dispatch_wait") / ("dispatch_run") the time
+spent queued and running.
+"""
+
+import atexit
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Sequence
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any
+
+from orc import metrics
+
+_WORKERS: int = 8
+_LANE_LIMIT: int = 4
+
+type _Work = tuple[Future[Any], Callable[[], Any], float]  # (future, callable, perf_counter when queued)
+
+_lock = threading.Lock()  # guards _pool, _lane_limit, _queues, _running
+_idle = threading.Condition(_lock)  # notified whenever a lane finishes a callable
+_pool: ThreadPoolExecutor | None = None
+_lane_limit = _LANE_LIMIT
+_queues: dict[str, deque[_Work]] = {}
+_running: dict[str, int] = {}
+_local = threading.local()  # .worker is set on pool threads
+_queued_gauge = metrics.gauge("dispatch_queued")
+_running_gauge = metrics.gauge("dispatch_running")
+_wait_times = metrics.histogram("dispatch_wait")
+_run_times = metrics.histogram("dispatch_run")
+
+
+def run[R](tasks: Sequence[tuple[str, Callable[[], R]]]) -> list[R]:
+    """Results of the callables, in order. Every callable runs; the first failure is then raised."""
+    with _lock:
+        futures = None if _pool is None or getattr(_local, "worker", False) else [_submit(lane, fn) for lane, fn in tasks]
+    if futures is None:
+        futures = [_inline(fn) for _, fn in tasks]
+    wait(futures)
+    return [f.result() for f in futures]
+
+
+def start(workers: int = _WORKERS, lane_limit: int = _LANE_LIMIT) -> None:
+    global _pool, _lane_limit
+    with _lock:
+        if _pool is not None:
+            return
+        _lane_limit = lane_limit
+        _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="orc-dispatch")
+    atexit.register(stop)
+
+
+def stop() -> None:
+    """Let queued work finish, then shut the pool down; later run() calls go inline."""
+    global _pool
+    with _lock:
+        if _pool is None:
+            return
+        _idle.wait_for(lambda: not any(_running.values()))
+        pool, _pool = _pool, None
+    pool.shutdown(wait=True)
+
+
+def _submit[R](lane: str, fn: Callable[[], R]) -> Future[R]:
+    # Caller holds _lock.
+    future: Future[R] = Future()
+    _queues.setdefault(lane, deque()).append((future, fn, time.perf_counter()))
+    _drain(lane)
+    return future
+
+
+def _drain(lane: str) -> None:
+    # Caller holds _lock. Hands the lane's queued work to the pool while it is under its limit.
+    queue = _queues[lane]
+    running = _running.get(lane, 0)
+    while queue and running < _lane_limit and _pool is not None:
+        running += 1
+        _pool.submit(_work, lane, *queue.popleft())
+    _running[lane] = running
+    _queued_gauge.set(lane, len(queue))
+    _running_gauge.set(lane, running)
+
+
+def _work(lane: str, future: Future[Any], fn: Callable[[], Any], queued: float) -> None:
+    _local.worker = True
+    started = time.perf_counter()
+    _wait_times.observe(lane, started - queued)
+    try:
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(fn())
+            except BaseException as exc:
+                future.set_exception(exc)
+    finally:
+        _run_times.observe(lane, time.perf_counter() - started)
+        with _lock:
+            _running[lane] -= 1
+            _drain(lane)
+            _idle.notify_all()
+
+
+def _inline[R](fn: Callable[[], R]) -> Future[R]:
+    future: Future[R] = Future()
+    try:
+        future.set_result(fn())
+    except BaseException as exc:  # as on the pool: every callable runs, run() raises the first failure
+        future.set_exception(exc)
+    return future
@@ -1,6 +1,7 @@
+import threading
 from dataclasses import replace
 from datetime import date, datetime, time, timedelta
-from unittest.mock import ANY, call, patch
+from unittest.mock import ANY, MagicMock, call, patch
 
 import pytest
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -8,9 +9,11 @@ from apscheduler.triggers.date import DateTrigger
 from freezegun import freeze_time
 
 import orc
-from orc import api, config
+from orc import api, config, ephemeris, metrics
 from orc import model as m
-from orc.dal import net
+from orc import streams, workers
+from orc.dal import net, sqlite
+from orc.dal.chromecast import stub as chromecast_stub
 from orc.dal.mqtt import stub as mqtt_stub
 
 FUTURE = datetime(2100, 1, 1, tzinfo=config.settings.tz)
@@ -148,45 +151,6 @@ class TestIntercepts:
         ]
 
 
-def test_unwrapper_function_single_rule():
-    calls = []
-    rule = m.Config(orc.Light.a, m.ON)
-
-    @api.unwrap_rule_container
-    def target(e):
-        calls.append(e)
-
-    target(m.Config(orc.Light.a, m.ON))
-
-    assert calls == [rule]
-
-
-def test_unwrapper_function_routine(snapshot_config):
-    calls = []
-
-    @api.unwrap_rule_container
-    def target(e):
-        calls.append(e)
-
-    target(snapshot_config)
-
-    assert calls == list(snapshot_config.items)
-
-
-def test_unwrapper_class_single_rule():
-    calls = []
-    rule = m.Config(orc.Light.a, m.ON)
-
-    class Foo:
-        @api.unwrap_rule_container
-        def target(self, e):
-            calls.append(e)
-
-    Foo().target(m.Config(orc.Light.a, m.ON))
-
-    assert calls == [rule]
-
-
 @freeze_time(datetime(2026, 1, 5, 12, tzinfo=config.settings.tz))
 class TestActiveOverride:
     OVERRIDE = m.ThemeOverride("vacation", date(2026, 1, 1), date(2026, 1, 10))
@@ -261,6 +225,157 @@ class TestGetSchedule:
         assert self._names(api.get_schedule()) == ["sat-r", "sun-r"]
 
 
+class TestEphemeris:
+    @pytest.fixture(autouse=True)
+    def _tables(self, monkeypatch):
+        monkeypatch.setattr(ephemeris, "_tables", {})
+
+    @staticmethod
+    def _live(day):
+        return ephemeris._search(ephemeris._local_midnight(day), ephemeris._local_midnight(day + timedelta(days=1))).get(day)
+
+    def test_missing_table_searches_live(self):
+        with patch.object(ephemeris, "_search", wraps=ephemeris._search) as search:
+            sunrise, sunset = ephemeris.sun_times(date(2026, 6, 21))
+        search.assert_called_once()
+        assert sunrise < sunset
+
+    @pytest.mark.parametrize("day", [date(2026, 1, 1), date(2026, 3, 8), date(2026, 6, 21), date(2026, 11, 1), date(2026, 12, 31)])
+    def test_table_matches_live_search(self, day):
+        ephemeris._build(2026)
+        with patch.object(ephemeris, "_search") as search:
+            looked_up = ephemeris.sun_times(day)
+        search.assert_not_called()
+        for got, want in zip(looked_up, self._live(day)):
+            assert abs(got - want) < timedelta(seconds=1)
+
+    def test_table_persists_in_state_db(self, monkeypatch):
+        ephemeris._build(2026)
+        monkeypatch.setattr(ephemeris, "_tables", {})  # as in a fresh process
+        with patch.object(ephemeris, "_search") as search:
+            ephemeris.sun_times(date(2026, 6, 21))
+        search.assert_not_called()
+
+    def test_ensure_table_skips_existing(self):
+        ephemeris._build(2026)
+        with patch.object(ephemeris.threading, "Thread") as thread:
+            ephemeris.ensure_table(2026)
+        thread.assert_not_called()
+
+
+class _StreamProvider:
+    NOW = 1_800_000_000.0
+
+    @pytest.fixture(autouse=True)
+    def provider(self, monkeypatch):
+        monkeypatch.setattr(streams, "_stats", streams.metrics.Counter())
+        monkeypatch.setattr(streams, "_refreshing", set())
+        self.lifetime = 6 * 3600
+        self.fetch = MagicMock(
+            side_effect=lambda id: (f"https://r1.googlevideo.com/videoplayback?id={id}&expire={self.NOW + self.lifetime:.0f}", id)
+        )
+        with (
+            freeze_time(datetime.fromtimestamp(self.NOW, tz=config.settings.tz)),
+            patch.object(config.providers.chromecast, "fetch_youtube_stream_metadata", self.fetch),
+            patch.object(streams.threading, "Thread") as self.thread,
+        ):
+            yield
+
+
+class TestStreamCache(_StreamProvider):
+    def test_repeat_resolve_served_from_cache(self):
+        assert streams.resolve("abc") == streams.resolve("abc")
+        self.fetch.assert_called_once_with("abc")
+        assert streams._stats.snapshot() == {"miss": 1, "hit": 1}
+
+    def test_dispatches_share_resolution(self):
+        rule = m.Config(orc.Chromecast.x, "abc")
+        api._dispatch_chromecast(None, orc.Chromecast.x, rule, {})
+        api._dispatch_chromecast(None, orc.Chromecast.x, rule, {})
+        self.fetch.assert_called_once_with("abc")
+
+    def test_near_expiry_served_and_refreshed_in_background(self):
+        self.lifetime = 45 * 60
+        url, _ = streams.resolve("abc")
+        assert streams.resolve("abc")[0] == url
+        self.fetch.assert_called_once()
+        self.thread.assert_called_once_with(target=streams._refresh, args=("abc",), name="orc-streams", daemon=True)
+
+    def test_short_lived_url_resolved_again(self):
+        self.lifetime = 10 * 60
+        streams.resolve("abc")
+        streams.resolve("abc")
+        assert self.fetch.call_count == 2
+
+    def test_persists_across_restart(self, monkeypatch):
+        streams.resolve("abc")
+        monkeypatch.setattr(streams, "_loaded_from", None)  # as in a fresh process
+        monkeypatch.setattr(streams, "_streams", {})
+        streams.resolve("abc")
+        self.fetch.assert_called_once()
+
+    def test_sweep_refreshes_warm_and_drops_cold(self, monkeypatch):
+        self.lifetime = 45 * 60
+        streams.resolve("warm")
+        streams.resolve("cold")
+        streams._streams["cold"] = streams._streams["cold"]._replace(used=self.NOW - 2 * 86400, expires=self.NOW - 1)
+        self.lifetime = 6 * 3600
+        streams._refreshing.clear()  # the refresh resolve() queued never ran: Thread is patched
+        streams.sweep()
+        assert set(streams._streams) == {"warm"}
+        assert streams._streams["warm"].expires == self.NOW + 6 * 3600
+        assert [r[0] for r in streams.sqlite.fetch_streams()] == ["warm"]
+
+
+class TestStreamPrefetch(_StreamProvider):
+    @staticmethod
+    def _job(minutes, *rules):
+        run_date = api.local_now() + timedelta(minutes=minutes)
+        return MagicMock(trigger=MagicMock(run_date=run_date), args=[m.IotJob(m.Routine("r", time(8, 0), rules))])
+
+    @pytest.mark.parametrize(
+        "rule, expected",
+        [
+            (m.Config(orc.Chromecast.x, "abc"), "abc"),
+            (m.Config(orc.Chromecast.x, "https://radio.example/stream"), None),
+            (m.Config(orc.Chromecast.x, m.STOP), None),
+            (m.Config(orc.Chromecast.x, 30), None),
+            (m.Config(orc.Light.a, m.ON), None),
+        ],
+    )
+    def test_stream_id(self, rule, expected):
+        assert api._stream_id(rule) == expected
+
+    def test_job_prefetches_routines_due_soon(self):
+        jobs = [
+            self._job(5, m.Config(orc.Chromecast.x, "soon"), m.Config(orc.Light.a, m.ON)),
+            self._job(120, m.Config(orc.Chromecast.x, "later")),
+        ]
+        with patch.object(api, "jobs_by_type", return_value=jobs), patch.object(api.threading, "Thread") as thread:
+            api._prefetch_streams_job(ctx=MagicMock())
+        thread.assert_called_once_with(target=streams.prefetch, args=(["soon"], 600.0), name="orc-prefetch", daemon=True)
+
+    def test_fire_served_from_prefetch(self, monkeypatch):
+        monkeypatch.setattr(streams, "_prefetch_stats", streams.metrics.Counter())
+        streams.prefetch(["abc"], lead=600)
+        streams.resolve("abc")
+        self.fetch.assert_called_once()
+        assert streams._prefetch_stats.snapshot() == {"resolved": 1, "served": 1}
+
+    def test_prefetch_renews_entry_expiring_before_the_fire(self, monkeypatch):
+        monkeypatch.setattr(streams, "_prefetch_stats", streams.metrics.Counter())
+        self.lifetime = 35 * 60
+        streams.resolve("abc")
+        streams.prefetch(["abc"], lead=600)
+        assert self.fetch.call_count == 2
+
+    def test_prefetch_failure_logged(self, monkeypatch):
+        monkeypatch.setattr(streams, "_prefetch_stats", streams.metrics.Counter())
+        self.fetch.side_effect = RuntimeError("yt-dlp")
+        streams.prefetch(["abc"])
+        assert streams._prefetch_stats.snapshot() == {"failed": 1}
+
+
 @freeze_time(datetime(2026, 1, 5, 12, tzinfo=config.settings.tz))
 class TestPresence:
     ctx = object()  # run_iot_job never reads it; requires_ctx only rejects None
@@ -386,6 +501,226 @@ class TestPresence:
         assert api.present_names() == {"Bob"}
 
 
+class TestDurationCache:
+    def test_repeat_reads_are_served_from_cache(self):
+        first = api.fetch_durations()
+        hits = api.duration_cache_stats()["hits"]
+        assert api.fetch_durations() is first
+        assert api.duration_cache_stats()["hits"] == hits + 1
+
+    def test_recorded_duration_invalidates(self):
+        api.fetch_durations()
+        reloads = api.duration_cache_stats()["reloads"]
+        with api.record_duration("TV Lights"):
+            pass
+        assert dict(api.fetch_durations())["TV Lights"] == 1
+        assert api.duration_stats()["TV Lights"][0] == 1
+        assert api.duration_cache_stats()["reloads"] == reloads + 1
+
+
+class TestDispatchPool:
+    @pytest.fixture
+    def pool(self):
+        workers.start(workers=4, lane_limit=2)
+        yield
+        workers.stop()
+
+    def test_runs_inline_before_start(self):
+        assert workers.run([("Light", threading.current_thread), ("Chromecast", lambda: 2)]) == [threading.current_thread(), 2]
+
+    def test_lane_limit_leaves_room_for_other_lanes(self, pool):
+        release, started = threading.Event(), threading.Semaphore(0)
+        lock = threading.Lock()
+        running, peak = 0, 0
+
+        def cast():
+            nonlocal running, peak
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            started.release()
+            release.wait(5)
+            with lock:
+                running -= 1
+
+        casts = threading.Thread(target=workers.run, args=([("Chromecast", cast)] * 5,))
+        casts.start()
+        assert started.acquire(timeout=5) and started.acquire(timeout=5)
+        assert workers.run([("Light", lambda: "on")]) == ["on"]  # not stuck behind the casts
+        assert metrics.gauge("dispatch_queued").get("Chromecast") == 3
+        release.set()
+        casts.join(5)
+        assert peak == 2
+        assert metrics.gauge("dispatch_running").get("Chromecast") == 0
+        assert metrics.histogram("dispatch_run").snapshot()["Chromecast"]["count"] >= 5
+
+    def test_every_callable_runs_before_failure_raised(self, pool):
+        ran = []
+
+        def fail():
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError):
+            workers.run([("Light", fail), ("Light", lambda: ran.append(1))])
+        assert ran == [1]
+
+    @pytest.mark.parametrize("started", [False, True])
+    def test_base_exception_raised_after_every_callable_runs(self, request, started):
+        if started:
+            request.getfixturevalue("pool")
+        ran = []
+
+        def interrupt():
+            raise KeyboardInterrupt
+
+        with pytest.raises(KeyboardInterrupt):
+            workers.run([("Light", interrupt), ("Light", lambda: ran.append(1))])
+        assert ran == [1]
+
+    def test_nested_run_goes_inline(self):
+        workers.start(workers=1, lane_limit=1)
+        try:
+            assert workers.run([("Light", lambda: workers.run([("Light", lambda: 7)]))]) == [[7]]
+        finally:
+            workers.stop()
+
+    def test_dispatch_runs_on_pool(self, pool):
+        threads = {}
+        with patch("orc.dal.mqtt.stub.publish_light", side_effect=lambda w, **kw: threads.update({w: threading.current_thread().name})):
+            api.dispatch(m.Config({orc.Light.a, orc.Light.b}, m.ON), force=True)
+        assert threads.keys() == {orc.Light.a, orc.Light.b}
+        assert all(name.startswith("orc-dispatch") for name in threads.values())
+
+    def test_routine_items_dispatch_concurrently(self, pool):
+        release, published = threading.Event(), threading.Event()
+        routine = m.Configs(m.Config(orc.Chromecast.x, "abc"), m.Config(orc.Light.a, m.ON))
+        with (
+            patch("orc.dal.chromecast.stub.play", side_effect=lambda *a: release.wait(5)),
+            patch("orc.dal.mqtt.stub.publish_light", side_effect=lambda *a, **kw: published.set()),
+        ):
+            dispatching = threading.Thread(target=api.dispatch, args=(routine,), kwargs={"force": True})
+            dispatching.start()
+            assert published.wait(5)  # the light doesn't wait for the cast to finish loading
+            release.set()
+            dispatching.join(5)
+
+    def test_device_steps_keep_their_order(self, pool):
+        steps = []
+        chromecast_stub._content[orc.Chromecast.x] = "https://example.com/stream"
+        routine = m.squish_configs(m.Configs(m.Config(orc.Chromecast.x, m.STOP), m.Config(orc.Chromecast.x, 30)))
+        with (
+            patch("orc.dal.chromecast.stub.stop", side_effect=lambda w: (threading.Event().wait(0.05), steps.append("stop"))),
+            patch("orc.dal.chromecast.stub.set_volume", side_effect=lambda w, lvl: steps.append(lvl)),
+        ):
+            api.dispatch(routine, force=True)
+        assert steps == ["stop", 30]
+
+
+class TestDispatchPlan:
+    @pytest.mark.parametrize(
+        "light,current,state,unchanged",
+        [
+            ("a", None, m.ON, False),
+            ("a", m.OFF, m.OFF, True),
+            ("a", 40, m.ON, True),
+            ("a", 40, 41, True),
+            ("a", 40, 60, False),
+            ("a", m.OFF, 0, True),
+            ("b", m.ON, 100, True),
+            ("b", m.ON, m.OFF, False),
+        ],
+    )
+    def test_light_unchanged(self, light, current, state, unchanged):
+        if current is not None:
+            mqtt_stub._states[orc.Light[light]] = current
+        assert api._light_unchanged(orc.Light[light], m.Config(orc.Light[light], state)) is unchanged
+
+    def test_only_leading_no_ops_dropped(self):
+        mqtt_stub._states.update({orc.Light.a: 30, orc.Light.b: m.OFF})
+        rules = m.squish_configs(m.Configs(m.Config(orc.Light.a, 30), m.Config(orc.Light.a, m.ON), m.Config(orc.Light.b, m.ON)))
+        plan, unchanged = api.plan_dispatch(rules, force=True, diff=True)
+        assert plan == {orc.Light.b: [m.Config(orc.Light.b, m.ON)]}
+        assert unchanged == [(orc.Light.a, m.Config(orc.Light.a, 30)), (orc.Light.a, m.Config(orc.Light.a, m.ON))]
+
+    def test_step_after_a_change_kept(self):
+        mqtt_stub._states[orc.Light.a] = m.OFF
+        rules = m.squish_configs(m.Configs(m.Config(orc.Light.a, 30), m.Config(orc.Light.a, m.OFF)))
+        plan, unchanged = api.plan_dispatch(rules, force=True, diff=True)
+        assert plan == {orc.Light.a: [m.Config(orc.Light.a, 30), m.Config(orc.Light.a, m.OFF)]}
+        assert unchanged == []
+
+    @pytest.mark.parametrize(
+        "content,volume,state,unchanged",
+        [
+            (None, 30, m.STOP, True),
+            ("https://example.com/a", 30, m.STOP, False),
+            (None, 30, 30, True),
+            (None, 30, 40, False),
+            ("https://example.com/a", 30, "https://example.com/a", True),
+            ("https://example.com/a", 30, "abc", False),
+            ("https://example.com/a", 30, m.PAUSE, False),
+        ],
+    )
+    def test_chromecast_unchanged(self, content, volume, state, unchanged):
+        if content is not None:
+            chromecast_stub._content[orc.Chromecast.x] = content
+        chromecast_stub._volumes[orc.Chromecast.x] = volume
+        assert api._chromecast_unchanged(orc.Chromecast.x, m.Config(orc.Chromecast.x, state)) is unchanged
+
+    @pytest.mark.parametrize(
+        "playing,unchanged",
+        [
+            ("https://rr1.googlevideo.com/videoplayback?id=o-1", True),
+            ("https://rr1.googlevideo.com/videoplayback?id=o-2", False),
+        ],
+    )
+    def test_chromecast_youtube_id_compared_with_its_cached_stream(self, playing, unchanged):
+        url = "https://rr1.googlevideo.com/videoplayback?id=o-1&expire=4102444800&sig=x"
+        sqlite.store_stream("abc", url, "Title", 4102444800.0, 0.0)
+        chromecast_stub._content[orc.Chromecast.x] = playing  # as the status cache strips it
+        assert api._chromecast_unchanged(orc.Chromecast.x, m.Config(orc.Chromecast.x, "abc")) is unchanged
+
+    def test_chromecast_youtube_id_without_cached_stream_is_sent(self):
+        chromecast_stub._content[orc.Chromecast.x] = "https://rr1.googlevideo.com/videoplayback?id=o-1"
+        assert not api._chromecast_unchanged(orc.Chromecast.x, m.Config(orc.Chromecast.x, "abc"))
+
+    def test_chromecast_without_fresh_status_is_sent(self):
+        with patch("orc.dal.chromecast.stub.cached_state", return_value=None):
+            assert not api._chromecast_unchanged(orc.Chromecast.x, m.Config(orc.Chromecast.x, m.STOP))
+
+    def test_every_step_kept_without_diff(self):
+        mqtt_stub._states[orc.Light.a] = m.ON
+        plan, unchanged = api.plan_dispatch(m.Config(orc.Light.a, m.ON), force=True)
+        assert plan == {orc.Light.a: [m.Config(orc.Light.a, m.ON)]} and unchanged == []
+
+    @patch("orc.dal.mqtt.stub.publish_light")
+    def test_manual_dispatch_sent_even_if_cached_state_matches(self, publish_light):
+        mqtt_stub._states[orc.Light.a] = m.ON  # the hub's cache can disagree with the light
+        api.dispatch(m.Config(orc.Light.a, m.ON), force=True)
+        assert publish_light.call_args_list == [call(orc.Light.a, on=True)]
+
+    @freeze_time(datetime(2026, 1, 5, 12, tzinfo=config.settings.tz))
+    @patch("orc.dal.mqtt.stub.publish_light")
+    def test_replay_day_sends_only_differences(self, publish_light):
+        mqtt_stub._states.update({orc.Light.a: m.ON, orc.Light.b: m.OFF})
+        items = (m.Config(orc.Light.a, m.ON, trigger=m.Trigger.SYSTEM), m.Config(orc.Light.b, m.ON, trigger=m.Trigger.SYSTEM))
+        past = datetime(2026, 1, 5, 8, tzinfo=config.settings.tz)
+        entry = api.log(m.LogSource.MANUAL, "Theme override cleared")
+        with patch.object(api, "get_schedule", return_value=[(past, m.Routine("morning", time(8, 0), items))]):
+            api.replay_day(api.local_now(), entry)
+        assert publish_light.call_args_list == [call(orc.Light.b, on=True)]
+        assert api.log_entries()[0] is entry  # under the caller's entry, not one of its own
+        assert entry.children[-1].action == "Skipped 1 already set: `a` on"
+
+    @patch("orc.dal.mqtt.stub.publish_light")
+    def test_plan_and_skips_logged_on_entry(self, publish_light):
+        mqtt_stub._states[orc.Light.a] = m.ON
+        entry = api.log(m.LogSource.MANUAL, "`Evening`")
+        api.dispatch(m.Configs(m.Config(orc.Light.a, m.ON), m.Config(orc.Light.b, m.ON)), force=True, entry=entry, diff=True)
+        assert publish_light.call_args_list == [call(orc.Light.b, on=True)]
+        assert [c.action for c in entry.children] == ["Plan: `b` on", "Skipped 1 already set: `a` on"]
+
+
 def test_context_executor_copies_closure_job():
     """_do_submit_job must not raise for closure callables (Job uses __slots__, not __dict__)."""
     ctx = object()
@@ -417,7 +752,7 @@ class TestWireButtons:
         captured = {}
         with (
             patch.object(config, "remotes", buttons),
-            patch.object(mqtt_stub, "add_button_listener", side_effect=lambda fn: captured.setdefault("fn", fn)),
+            patch.object(mqtt_stub, "add_button_listener", side_effect=lambda fn, **_: captured.setdefault("fn", fn)),
         ):
             api.wire_buttons(ctx)
         return ctx, captured["fn"]
@@ -1,6 +1,22 @@
-from datetime import date
-from unittest.mock import patch
+import array
+import contextlib
+import hashlib
+import os
+import sys
+import threading
+import time
+import wave
+from datetime import date, datetime
+from enum import Enum
+from pathlib import Path
+from unittest.mock import MagicMock, patch
 
+import pytest
+
+from orc import config
+from orc import model as m
+from orc.dal import audio, durations, sqlite
+from orc.dal.chromecast import google_cast
 from orc.dal.chromecast.google_cast import _strip_googlevideo_params
 from orc.dal.holiday import polygon
 from orc.dal.hubitat import http as hubitat
@@ -27,6 +43,190 @@ class TestStripGoogleVideoParams:
         assert _strip_googlevideo_params("not a url") == "not a url"
 
 
+class Cast(Enum):
+    den = "den.local"
+    kitchen = "kitchen.local"
+
+
+def _fake_cast():
+    """A Chromecast mock that answers commands with status pushes, as the device does."""
+    cast = MagicMock(is_idle=True)
+    cast.status.volume_level = 0.3
+    cast.status.namespaces = ["urn:x-cast:com.google.cast.media"]
+    mc = cast.media_controller
+    mc.namespace = "urn:x-cast:com.google.cast.media"
+    mc.status.player_state = "PLAYING"
+    mc.status.content_id = "http://stream"
+
+    def listen(listener):
+        def media(**changes):
+            for name, value in changes.items():
+                setattr(mc.status, name, value)
+            listener.new_media_status(mc.status)
+
+        def receiver(**changes):
+            for name, value in changes.items():
+                setattr(cast, name, value) if name == "is_idle" else setattr(cast.status, name, value)
+            listener.new_cast_status(cast.status)
+
+        mc.update_status.side_effect = media
+        mc.pause.side_effect = lambda: media(player_state="PAUSED")
+        mc.play.side_effect = lambda: media(player_state="PLAYING")
+        mc.play_media.side_effect = lambda url, content_type, title: media(player_state="PLAYING", content_id=url)
+        cast.set_volume.side_effect = lambda level: receiver(volume_level=level)
+        cast.quit_app.side_effect = lambda: receiver(is_idle=True)
+
+    cast.register_status_listener.side_effect = listen
+    return cast
+
+
+class TestCastPool:
+    @pytest.fixture(autouse=True)
+    def casts(self, monkeypatch):
+        for name in ("_pool", "_listeners", "_states"):
+            monkeypatch.setattr(google_cast, name, {})
+        monkeypatch.setattr(google_cast, "_pool_stats", google_cast.metrics.Counter())
+        monkeypatch.setattr(google_cast, "_state_stats", google_cast.metrics.Counter())
+        monkeypatch.setattr(google_cast, "_command_latency", google_cast.metrics.Histogram())
+        self.connected = []
+
+        def connect(host, **kwargs):
+            self.connected.append(_fake_cast())
+            return self.connected[-1]
+
+        with (
+            patch.object(google_cast.socket, "gethostbyname", return_value="10.0.0.2"),
+            patch.object(google_cast.pychromecast, "get_chromecast_from_host", side_effect=connect),
+            patch.object(google_cast.time, "sleep"),
+        ):
+            yield
+
+    def test_commands_reuse_connection(self):
+        google_cast.set_volume(Cast.den, 40)
+        google_cast.pause(Cast.den)
+        google_cast.set_volume(Cast.kitchen, 40)
+        assert len(self.connected) == 2
+        assert google_cast._pool_stats.snapshot() == {"connect": 2, "reuse": 1}
+        self.connected[0].disconnect.assert_not_called()
+
+    def test_dropped_connection_replaced(self):
+        google_cast.set_volume(Cast.den, 40)
+        self.connected[0].socket_client.is_connected = False
+        google_cast.set_volume(Cast.den, 50)
+        assert len(self.connected) == 2
+        self.connected[0].disconnect.assert_called_once()
+        assert google_cast._pool[Cast.den] is self.connected[1]
+
+    def test_unreachable_device_retried_once_stale(self, monkeypatch):
+        def connect(host, **kwargs):
+            cast = MagicMock(status=None)
+            self.connected.append(cast)
+            return cast
+
+        with patch.object(google_cast.pychromecast, "get_chromecast_from_host", side_effect=connect):
+            assert google_cast.fetch_state(Cast.den).volume == 0
+            google_cast.fetch_state(Cast.den)
+            assert len(self.connected) == 1
+            monkeypatch.setattr(google_cast, "_STALE_SEC", -1.0)
+            google_cast.fetch_state(Cast.den)
+        assert len(self.connected) == 2
+
+    def test_state_follows_pushes(self):
+        assert google_cast.fetch_state(Cast.den) == m.SoundState(what=Cast.den, content="http://stream", volume=30)
+        cast = self.connected[0]
+        cast.status.volume_level = 0.5
+        cast.register_status_listener.call_args.args[0].new_cast_status(cast.status)
+        assert google_cast.cached_state(Cast.den).volume == 50
+        assert google_cast.fetch_state(Cast.den).volume == 50
+        cast.media_controller.update_status.assert_not_called()  # idle: the status from connect is the state
+        assert google_cast._state_stats.snapshot() == {"polled": 1, "cached": 2}
+
+    def test_quiet_speaker_served_from_cache_while_connected(self, monkeypatch):
+        google_cast.fetch_state(Cast.den)
+        monkeypatch.setattr(google_cast, "_STALE_SEC", -1.0)
+        assert google_cast.fetch_state(Cast.den).volume == 30
+        assert len(self.connected) == 1
+        assert google_cast._state_stats.snapshot() == {"polled": 1, "cached": 1}
+
+    def test_stale_state_polled_once_connection_unhealthy(self, monkeypatch):
+        google_cast.fetch_state(Cast.den)
+        monkeypatch.setattr(google_cast, "_STALE_SEC", -1.0)
+        self.connected[0].socket_client.is_connected = False
+        assert google_cast.cached_state(Cast.den) is None
+        google_cast.fetch_state(Cast.den)
+        assert len(self.connected) == 2 and google_cast._state_stats.get("polled") == 2
+
+    def test_idle_or_non_media_speaker_not_sent_media_status_requests(self):
+        google_cast.fetch_state(Cast.den)  # idle: no app to ask
+        cast = self.connected[0]
+        cast.is_idle, cast.status.namespaces = False, ["urn:x-cast:com.google.cast.cac"]
+        google_cast._states.clear()
+        assert google_cast.fetch_state(Cast.den).volume == 30  # an app without the media namespace
+        cast.media_controller.update_status.assert_not_called()
+
+    def test_media_app_polled_when_not_cached(self):
+        google_cast.fetch_state(Cast.den)
+        self.connected[0].is_idle = False
+        google_cast._states.clear()
+        google_cast.fetch_state(Cast.den)
+        assert self.connected[0].media_controller.update_status.call_count == 1
+
+    def test_lost_connection_drops_state(self):
+        google_cast.fetch_state(Cast.den)
+        self.connected[0].register_connection_listener.call_args.args[0].new_connection_status(MagicMock(status="LOST"))
+        assert google_cast.cached_state(Cast.den) is None
+
+    def test_play_confirmed_on_pooled_connection(self):
+        google_cast.set_volume(Cast.den, 40)
+        cast = self.connected[0]
+        cast.is_idle = False
+        google_cast.play(Cast.den, "http://other", "Other")
+        assert len(self.connected) == 1
+        cast.quit_app.assert_called_once()
+        cast.media_controller.play_media.assert_called_once_with("http://other", "audio/mp3", title="Other")
+        assert google_cast.cached_state(Cast.den).content == "http://other"
+
+    def test_play_load_error_raises(self):
+        google_cast.set_volume(Cast.den, 40)
+        mc = self.connected[0].media_controller
+        listener = self.connected[0].register_status_listener.call_args.args[0]
+
+        def fail(url, content_type, title):
+            mc.status.player_state, mc.status.idle_reason = "IDLE", "ERROR"
+            listener.new_media_status(mc.status)
+
+        mc.play_media.side_effect = fail
+        with pytest.raises(RuntimeError, match="failed to load"):
+            google_cast.play(Cast.den, "http://bad", "Bad")
+
+    def test_commands_confirm_and_record_latency(self):
+        google_cast.set_volume(Cast.den, 40)
+        google_cast.pause(Cast.den)
+        google_cast.resume(Cast.den)
+        google_cast.stop(Cast.den)
+        cast = self.connected[0]
+        assert cast.status.volume_level == 0.4 and cast.media_controller.status.player_state == "PLAYING"
+        cast.quit_app.assert_not_called()  # already idle
+        latency = google_cast._command_latency.snapshot()
+        assert {name: entry["count"] for name, entry in latency.items()} == {"set_volume": 1, "pause": 1, "resume": 1, "stop": 1}
+        assert all(entry["max"] < google_cast._SETTLE_SEC for entry in latency.values())
+
+    def test_unconfirmed_command_times_out(self, monkeypatch):
+        monkeypatch.setattr(google_cast, "_SETTLE_SEC", 0.05)
+        google_cast.set_volume(Cast.den, 40)
+        self.connected[0].set_volume.side_effect = None  # the device never answers
+        google_cast.set_volume(Cast.den, 50)
+        assert google_cast._command_latency.snapshot()["set_volume"]["max"] >= 0.05
+
+    def test_evicted_cast_polls_instead_of_sleeping_out_the_timeout(self):
+        action, checks = MagicMock(), iter([False, False, True])
+        started = time.monotonic()
+        assert google_cast._confirm(Cast.den, MagicMock(), action, lambda: next(checks), 10.0)
+        assert time.monotonic() - started < 5
+        action.assert_called_once()
+        assert not google_cast._confirm(Cast.den, MagicMock(), action, lambda: False, 0.05)
+
+
 class TestReboot:
     @patch("requests.post")
     def test_reboot_hits_hub_endpoint(self, post):
@@ -59,3 +259,315 @@ class TestMarketHoliday:
 
     def test_ordinary_day_is_work_day(self):
         assert self._market_holiday(date(2026, 11, 30)) is False
+
+
+class TestConnection:
+    def test_reused_within_a_thread(self):
+        with sqlite.connection() as first, sqlite.connection() as second:
+            assert first is second
+
+    def test_nested_block_commits_with_the_outer_one(self):
+        with pytest.raises(RuntimeError):
+            with sqlite.connection():
+                sqlite.insert_presence(["Alice"], datetime(2026, 1, 1))
+                raise RuntimeError("boom")
+        assert sqlite.fetch_presence() == {}
+
+    def test_nested_error_undoes_only_the_nested_block(self):
+        with sqlite.connection() as conn:
+            conn.execute("INSERT INTO orc_presence (name, last_seen) VALUES ('Alice', '2026-01-01T00:00:00')")
+            with pytest.raises(RuntimeError):
+                with sqlite.connection() as nested:
+                    nested.execute("INSERT INTO orc_presence (name, last_seen) VALUES ('Bob', '2026-01-01T00:00:00')")
+                    raise RuntimeError("boom")
+        assert list(sqlite.fetch_presence()) == ["Alice"]
+
+    def test_one_connection_per_thread(self):
+        with sqlite.connection() as main:
+            seen = []
+            thread = threading.Thread(target=lambda: seen.append(sqlite._thread_connection()))
+            thread.start()
+            thread.join()
+        assert seen and seen[0] is not main
+
+    def test_wal_mode(self):
+        with sqlite.connection() as conn:
+            assert conn.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+
+    def test_reopened_when_db_changes(self, tmp_path, monkeypatch):
+        with sqlite.connection() as before:
+            pass
+        monkeypatch.setattr(config, "settings", config.settings._replace(jobs_db=f"sqlite:///{tmp_path / 'other.sqlite'}"))
+        with sqlite.connection() as after:
+            assert after is not before
+            assert after.execute("PRAGMA database_list").fetchone()[2].endswith("other.sqlite")
+
+    def test_error_rolls_back_and_keeps_connection_usable(self):
+        with pytest.raises(RuntimeError):
+            with sqlite.connection() as conn:
+                conn.execute("INSERT INTO orc_presence (name, last_seen) VALUES ('Alice', '2026-01-01T00:00:00')")
+                raise RuntimeError("boom")
+        assert sqlite.fetch_presence() == {}
+
+
+class TestDurations:
+    def test_first_sample_is_the_average(self):
+        durations.update_avg("TV Lights", 2.0)
+        assert durations.stats() == {"TV Lights": (1, 2.0)}
+
+    def test_ewma_folds_later_samples(self):
+        durations.update_avg("TV Lights", 2.0)
+        durations.update_avg("TV Lights", 4.0)
+        assert durations.stats()["TV Lights"] == (2, pytest.approx(0.3 * 4.0 + 0.7 * 2.0))
+
+    def test_written_through_before_start(self):
+        durations.update_avg("TV Lights", 2.0)
+        assert sqlite.fetch_durations() == [("TV Lights", 1, 2.0)]
+
+    def test_write_behind_coalesces_until_flush(self, monkeypatch):
+        monkeypatch.setattr(durations, "_flusher", object())  # started: no write-through
+        with patch.object(sqlite, "store_durations", wraps=sqlite.store_durations) as store:
+            durations.update_avg("TV Lights", 2.0)
+            durations.update_avg("TV Lights", 4.0)
+            durations.update_avg("Reset", 1.0)
+            assert sqlite.fetch_durations() == []
+            assert durations.stats()["TV Lights"][0] == 2  # readers see unflushed samples
+            durations.flush()
+        store.assert_called_once()
+        assert [(name, samples) for name, samples, _ in sqlite.fetch_durations()] == [("Reset", 1), ("TV Lights", 2)]
+
+    def test_failed_flush_keeps_samples_dirty(self, monkeypatch):
+        monkeypatch.setattr(durations, "_flusher", object())
+        durations.update_avg("TV Lights", 2.0)
+        with patch.object(sqlite, "store_durations", side_effect=RuntimeError("disk")), pytest.raises(RuntimeError):
+            durations.flush()
+        durations.flush()
+        assert sqlite.fetch_durations() == [("TV Lights", 1, 2.0)]
+
+    def test_view_seeded_from_table(self, monkeypatch):
+        sqlite.store_durations([("Reset", 5, 0.5)])
+        monkeypatch.setattr(durations, "_loaded_from", None)  # as in a fresh process
+        assert durations.stats() == {"Reset": (5, 0.5)}
+
+
+class TestVoice:
+    @pytest.fixture(autouse=True)
+    def piper(self, monkeypatch):
+        monkeypatch.setattr(audio, "_voice", None)
+        self.piper = MagicMock()
+        with patch.dict(sys.modules, {"piper": self.piper, "onnxruntime": MagicMock()}):
+            yield
+
+    def test_not_loaded_until_used(self):
+        self.piper.PiperVoice.load.assert_not_called()
+
+    def test_loaded_once(self):
+        assert audio._load_voice() is audio._load_voice()
+        self.piper.PiperVoice.load.assert_called_once()
+
+    def test_stderr_silenced_only_for_the_import(self, monkeypatch):
+        silenced = []
+
+        @contextlib.contextmanager
+        def silence_fd(fd):
+            silenced.append(fd)
+            yield
+            silenced.remove(fd)
+
+        monkeypatch.setattr(audio, "silence_fd", silence_fd)
+        self.piper.PiperVoice.load.side_effect = lambda *_, **__: silenced.copy()
+        assert audio._load_voice() == []
+
+    def test_warm_up_reports_load_time(self):
+        reported = []
+        audio.warm_up(reported.append).join()
+        assert audio._voice is self.piper.PiperVoice.load.return_value
+        assert len(reported) == 1 and reported[0] >= 0
+
+    def test_warm_up_hashes_the_model(self, monkeypatch):
+        monkeypatch.setattr(audio, "_digest", None)
+        audio.warm_up().join()
+        expected = hashlib.sha256(b"".join(hashlib.sha256(p.read_bytes()).digest() for p in (audio._MODEL_PATH, audio._CONFIG_PATH)))
+        assert audio._digest == expected.hexdigest()
+
+    def test_failed_warm_up_is_retried_on_use(self):
+        self.piper.PiperVoice.load.side_effect = [RuntimeError("onnx"), MagicMock()]
+        reported = []
+        audio.warm_up(reported.append).join()
+        assert reported == [] and audio._voice is None
+        assert audio._load_voice() is not None
+
+
+class TestPhraseCache:
+    @pytest.fixture(autouse=True)
+    def voice(self, monkeypatch):
+        monkeypatch.setattr(audio, "_phrases", audio.OrderedDict())
+        monkeypatch.setattr(audio, "_phrase_stats", audio.metrics.Counter())
+        monkeypatch.setattr(audio, "_model_digest", lambda: "model")
+        self.voice = MagicMock()
+        self.voice.config.sample_rate = 22050
+        self.voice.synthesize.side_effect = lambda text: [MagicMock(audio_int16_bytes=f"{text}:{i};".encode()) for i in range(3)]
+        monkeypatch.setattr(audio, "_voice", self.voice)
+        self.played = []
+        with patch.object(audio, "_play_stream", side_effect=lambda chunks, *_: self.played.append(b"".join(chunks))):
+            yield
+
+    def test_repeat_phrase_skips_synthesis(self):
+        audio.play_text("hello")
+        audio.play_text("hello")
+        assert self.voice.synthesize.call_count == 1
+        assert self.played == [b"hello:0;hello:1;hello:2;"] * 2
+        assert audio._phrase_stats.snapshot() == {"miss": 1, "hit": 1}
+
+    def test_phrase_survives_in_db(self, monkeypatch):
+        audio.play_text("hello")
+        monkeypatch.setattr(audio, "_phrases", audio.OrderedDict())
+        audio.play_text("hello")
+        assert self.voice.synthesize.call_count == 1
+        assert audio._phrase_stats.get("db_hit") == 1
+
+    def test_least_recently_used_evicted(self, monkeypatch):
+        monkeypatch.setattr(audio, "_PHRASE_MEMORY_ENTRIES", 2)
+        for text in ("a", "b", "a", "c"):
+            audio.play_text(text)
+        assert set(audio._phrases) == {audio._phrase_key("a"), audio._phrase_key("c")}
+
+    def test_db_keeps_newest(self, monkeypatch):
+        monkeypatch.setattr(audio, "_PHRASE_DB_ENTRIES", 1)
+        audio.play_text("a")
+        audio.play_text("b")
+        assert sqlite.fetch_tts_phrase(audio._phrase_key("a")) is None
+        assert sqlite.fetch_tts_phrase(audio._phrase_key("b")) == (22050, b"b:0;b:1;b:2;")
+
+    def test_failed_playback_not_cached(self):
+        audio._play_stream.side_effect = OSError("device gone")
+        with pytest.raises(OSError):
+            audio.play_text("hello")
+        assert audio._cached_phrase(audio._phrase_key("hello")) is None
+
+
+def _reference_scale(frames, gain):
+    # The per-sample loop _scale_int16 replaced: truncate, then clamp.
+    samples = array.array("h", frames)
+    for i, s in enumerate(samples):
+        samples[i] = max(-32768, min(32767, int(s * gain)))
+    return samples.tobytes()
+
+
+class TestScaleInt16:
+    ALERT = Path(audio.__file__).parents[1] / "static" / "alert.wav"
+
+    @pytest.fixture(scope="class")
+    def alert_pcm(self):
+        with wave.open(str(self.ALERT), "rb") as wf:
+            return wf.readframes(wf.getnframes())
+
+    @pytest.fixture(scope="class")
+    def tts_pcm(self):
+        # Two seconds of full-range 22.05 kHz mono, the shape of Piper output.
+        return array.array("h", ((i * 7919) % 65536 - 32768 for i in range(2 * 22050))).tobytes()
+
+    def test_unity_gain_is_passthrough(self, tts_pcm):
+        assert audio._scale_int16(tts_pcm, 1.0) is tts_pcm
+
+    @pytest.mark.parametrize("gain", [0.0, 0.35, 0.8, 1.5, 4.0])
+    def test_matches_reference_within_one_lsb(self, tts_pcm, gain):
+        scaled = array.array("h", audio._scale_int16(tts_pcm, gain))
+        expected = array.array("h", _reference_scale(tts_pcm, gain))
+        assert max(abs(a - b) for a, b in zip(scaled, expected)) <= 1
+
+    def test_clips_like_reference(self):
+        frames = array.array("h", [-32768, -20000, -1, 0, 1, 20000, 32767]).tobytes()
+        assert list(array.array("h", audio._scale_int16(frames, 2.0))) == [-32768, -32768, -2, 0, 2, 32767, 32767]
+
+    @pytest.mark.parametrize("source", ["alert_pcm", "tts_pcm"])
+    def test_matches_reference_on_real_audio(self, request, source):
+        frames = request.getfixturevalue(source)
+        scaled = array.array("h", audio._scale_int16(frames, 0.6))
+        expected = array.array("h", _reference_scale(frames, 0.6))
+        assert len(scaled) == len(expected)
+        assert max(abs(a - b) for a, b in zip(scaled, expected)) <= 1
+
+
+class TestOutput:
+    def test_stream_reopened_only_on_format_change(self):
+        with patch.object(audio.pyaudio, "PyAudio") as pa:
+            output = audio._Output()
+            output.write(0, 1, 48000, b"a")
+            output.drain()
+            output.write(0, 1, 48000, b"b")
+            output.write(0, 2, 48000, b"c")
+        pa.assert_called_once()
+        assert pa.return_value.open.call_count == 2
+
+
+class TestPlayback:
+    @pytest.fixture(autouse=True)
+    def output(self, monkeypatch):
+        self.output = MagicMock()
+        self.output.device.return_value = (0, 22050)
+        self.written = []
+        self.output.write.side_effect = lambda device, channels, rate, frames: self.written.append(frames)
+        monkeypatch.setattr(audio, "_output", self.output)
+        monkeypatch.setattr(audio, "_gain_for", lambda level: 1.0)
+        yield
+        audio.stop()
+
+    def test_plays_on_caller_thread_before_start(self):
+        audio._play_stream([b"a0", b"a1"], 1, 22050, None)
+        assert self.written == [b"a0", b"a1"]
+        self.output.drain.assert_called_once()
+
+    def test_fatal_preempts_info_between_chunks(self):
+        audio.start()
+        started, release = threading.Event(), threading.Event()
+
+        def info():
+            yield b"i0"
+            started.set()  # i0 is written; the player is now waiting for i1
+            release.wait(5)
+            yield b"i1"
+            yield b"i2"
+
+        info_thread = threading.Thread(target=audio._play_stream, args=(info(), 1, 22050, m.AUDIO_INFO))
+        info_thread.start()
+        assert started.wait(5)
+        fatal_thread = threading.Thread(target=audio._play_stream, args=([b"f0", b"f1"], 1, 22050, m.AUDIO_FATAL))
+        fatal_thread.start()
+        deadline = time.monotonic() + 5
+        while not audio._queue and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        info_thread.join(5)
+        fatal_thread.join(5)
+        assert self.written == [b"i0", b"i1", b"f0", b"f1", b"i2"]
+
+    def test_alert_resampled_once_per_file_version(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(audio, "_alerts", {})
+        monkeypatch.setattr(audio, "_alert_stats", audio.metrics.Counter())
+        path = tmp_path / "alert.wav"
+        path.write_bytes(TestScaleInt16.ALERT.read_bytes())
+        audio.play_alert(str(path))
+        first, self.written[:] = b"".join(self.written), []
+        audio.play_alert(str(path))
+        assert b"".join(self.written) == first
+        assert audio._alert_stats.snapshot() == {"miss": 1, "hit": 1}
+        mtime = path.stat().st_mtime_ns
+        os.utime(path, ns=(mtime + 1_000_000_000, mtime + 1_000_000_000))
+        audio.play_alert(str(path))
+        assert audio._alert_stats.get("miss") == 2
+
+    def test_alert_converted_to_device_rate(self, monkeypatch):
+        monkeypatch.setattr(audio, "_alerts", {})
+        audio.play_alert(str(TestScaleInt16.ALERT))
+        with wave.open(str(TestScaleInt16.ALERT), "rb") as wf:
+            channels, seconds = wf.getnchannels(), wf.getnframes() / wf.getframerate()
+        assert {c.args[1:3] for c in self.output.write.call_args_list} == {(channels, 22050)}
+        assert abs(len(b"".join(self.written)) / (2 * channels * 22050) - seconds) < 0.01
+
+    def test_error_reaches_caller_and_resets_output(self):
+        audio.start()
+        self.output.write.side_effect = OSError("device gone")
+        with pytest.raises(OSError):
+            audio._play_stream([b"a0"], 1, 22050, None)
+        self.output.close.assert_called()
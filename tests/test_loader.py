@@ -79,6 +79,12 @@ def test_settings_typed_and_defaulted():
     assert str(settings.tz) == "America/New_York"
 
 
+@pytest.mark.parametrize("key,value", [("mqtt_rate", "0"), ("mqtt_rate", "-1"), ("mqtt_rate", "nan"), ("mqtt_burst", "0")])
+def test_settings_reject_pacing_that_stalls(key, value):
+    with pytest.raises(ValueError, match=key):
+        m.Settings.build(**{key: value})
+
+
 def test_validate_missing_settings():
     with pytest.raises(
         ConfigError,
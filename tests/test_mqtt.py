@@ -1,13 +1,18 @@
 import json
+import threading
+import time
 from datetime import UTC, datetime
 from types import SimpleNamespace
+from unittest.mock import MagicMock
 
 import pytest
 
 import orc
+from orc import config, metrics
 from orc import model as m
 from orc.collections import LockedDict
 from orc.dal.mqtt import hubitat as mqtt
+from orc.dal.mqtt.store import DeviceStore
 
 
 def _msg(topic, payload, retain=True):
@@ -30,10 +35,15 @@ HUB = "05bd449a-6f6d-45a6-b2e6-7ecb91105f7e"
 
 @pytest.fixture(autouse=True)
 def clean_state(monkeypatch):
-    monkeypatch.setattr(mqtt, "_devices", LockedDict())
+    monkeypatch.setattr(mqtt, "_devices", DeviceStore())
+    monkeypatch.setattr(mqtt, "_payloads", {})
+    monkeypatch.setattr(mqtt, "_full_subscribed", False)
     monkeypatch.setattr(mqtt, "_hub_id", None)
-    monkeypatch.setattr(mqtt, "_listeners", [])
+    monkeypatch.setattr(mqtt, "_client", None)
+    monkeypatch.setattr(mqtt, "_listeners", {})
     monkeypatch.setattr(mqtt, "_button_listeners", [])
+    monkeypatch.setattr(mqtt, "_external_listeners", [])
+    monkeypatch.setattr(mqtt, "_commanded", LockedDict())
 
 
 def _receive(docs):
@@ -79,6 +89,55 @@ class TestOnMessage:
         assert [d.id for d in mqtt.snapshot()] == [1, 54]
 
 
+class TestDeviceStore:
+    def _device(self, id, name, **attributes):
+        return m.DeviceState(id=id, name=name, attributes=attributes, last_activity=None)
+
+    def test_lookups_by_id_name_and_attribute(self):
+        store = DeviceStore()
+        door, lamp = self._device(56, "balcony door", contact="open", battery="98"), self._device(1, "lamp", switch="on")
+        store.put(door)
+        store.put(lamp)
+        view = store.view()
+        assert (store.get(56), view.by_name["lamp"]) == (door, lamp)
+        assert view.with_attribute("battery") == (door,) and view.with_attribute("level") == ()
+        assert view.ordered == (lamp, door)
+
+    def test_views_are_copy_on_write(self):
+        store = DeviceStore()
+        store.put(self._device(1, "lamp", switch="off"))
+        before = store.view()
+        store.put(self._device(1, "lamp", switch="on", level="40"))
+        assert before.by_id[1].attributes == {"switch": "off"} and before.with_attribute("level") == ()
+        assert store.view().with_attribute("level") == (store.get(1),)
+
+    def test_version_moves_only_on_change(self):
+        store = DeviceStore()
+        store.put(self._device(1, "lamp", switch="off"))
+        store.put(self._device(2, "desk", switch="off"))
+        version = store.view().version
+        store.put(self._device(1, "lamp", switch="off"))  # replay
+        assert store.view().version == version
+        store.put(self._device(2, "desk", switch="on"))
+        assert store.view().version == version + 1
+        assert [d.id for d in store.view().changed_since(version)] == [2]
+        assert [d.id for d in store.view().changed_since(0)] == [1, 2]
+
+    def test_renamed_device_reindexed(self):
+        store = DeviceStore()
+        store.put(self._device(1, "lamp"))
+        store.put(self._device(1, "floor lamp"))
+        assert set(store.view().by_name) == {"floor lamp"}
+
+    def test_changed_since_through_documents(self):
+        _receive([_doc(id=1), _doc(id=2)])
+        version, changed = mqtt.changed_since(0)
+        _receive([_doc(id=2, attributes={"switch": "on", "level": "20"})])
+        assert [d.id for d in changed] == [1, 2]
+        assert [(d.id, d.attributes["switch"]) for d in mqtt.changed_since(version)[1]] == [(2, "on")]
+        assert mqtt.device_state(1).id == 1 and mqtt.device_state(3) is None
+
+
 class TestFetchLightStates:
     def _state_of(self, configs, light):
         return next(c for c in configs.items if c.what is light).state
@@ -105,13 +164,37 @@ class TestFetchLightStates:
         assert tuple(c.what for c in configs.items) == (orc.Light.a, orc.Light.c)
 
 
+class TestLightState:
+    def test_unknown_without_document(self):
+        assert mqtt.light_state(orc.Light.a) is None
+
+    def test_reports_like_fetch_light_states(self):
+        _receive([_doc(id=1, attributes={"switch": "on", "level": "50"}), _doc(id=2, attributes={"switch": "off"})])
+        assert (mqtt.light_state(orc.Light.a), mqtt.light_state(orc.Light.b)) == (50, "off")
+
+    def test_unknown_until_command_reflected(self, monkeypatch):
+        monkeypatch.setattr(mqtt, "_client", SimpleNamespace(publish=lambda topic, payload=None: None))
+        _receive([_doc(id=1, attributes={"switch": "off", "level": "50"})])
+        mqtt.publish_light(orc.Light.a, on=True)
+        assert mqtt.light_state(orc.Light.a) is None
+        _receive([_doc(id=1, attributes={"switch": "on", "level": "50"})])
+        assert mqtt.light_state(orc.Light.a) == 50
+
+
 class TestListeners:
-    def test_fires_per_attribute_including_unchanged(self):
+    def test_fires_changed_attributes_only(self):
         events = []
         mqtt.add_listener(lambda d, a, old, new: events.append((d.id, a, old, new)))
         _receive([_doc(id=56, name="balcony door", attributes={"contact": "closed", "battery": "100"})])
         assert events == []  # first sighting (retained flood): state only, no events
         _receive([_doc(id=56, name="balcony door", attributes={"contact": "open", "battery": "100"})])
+        assert events == [(56, "contact", "closed", "open")]
+
+    def test_full_listener_gets_unchanged_attributes_too(self):
+        events = []
+        mqtt.add_listener(lambda d, a, old, new: events.append((d.id, a, old, new)), full=True)
+        _receive([_doc(id=56, name="balcony door", attributes={"contact": "closed", "battery": "100"})])
+        _receive([_doc(id=56, name="balcony door", attributes={"contact": "open", "battery": "100"})])
         assert (56, "contact", "closed", "open") in events
         assert (56, "battery", "100", "100") in events  # republished unchanged, still delivered
 
@@ -132,12 +215,115 @@ class TestListeners:
         assert events == []
         assert mqtt.snapshot()[0].attributes == {"contact": "open"}
 
-    def test_document_differing_only_in_last_activity_fires(self):
-        events = []
+    def test_document_differing_only_in_last_activity_fires_full_listeners(self):
+        events, full = [], []
         mqtt.add_listener(lambda d, a, old, new: events.append((a, old, new)))
+        mqtt.add_listener(lambda d, a, old, new: full.append((a, old, new)), full=True)
         _receive([_doc(id=56, name="balcony door", attributes={"contact": "open"}, last_activity="2026-07-29T00:00:00+0000")])
         _receive([_doc(id=56, name="balcony door", attributes={"contact": "open"}, last_activity="2026-07-29T00:00:05+0000")])
-        assert events == [("contact", "open", "open")]
+        assert events == []
+        assert full == [("contact", "open", "open")]
+
+    def test_unchanged_attribute_map_is_shared_with_the_cache(self):
+        _receive([_doc(id=56, attributes={"contact": "open"}, last_activity="2026-07-29T00:00:00+0000")])
+        before = mqtt.device_state(56)
+        _receive([_doc(id=56, attributes={"contact": "open"}, last_activity="2026-07-29T00:00:05+0000")])
+        assert mqtt.device_state(56).last_activity == "2026-07-29T00:00:05+0000"
+        assert mqtt.device_state(56).attributes is before.attributes
+
+    def test_byte_identical_replay_is_not_parsed(self, monkeypatch):
+        doc = _doc(id=56, attributes={"contact": "open"})
+        _receive([doc])
+        replayed = metrics.counter("mqtt_documents").get("replayed")
+        monkeypatch.setattr(mqtt, "_parse_device_state", lambda *args: pytest.fail("replay parsed"))
+        _receive([doc])
+        assert metrics.counter("mqtt_documents").get("replayed") == replayed + 1
+
+    def test_subscriptions_filter_by_device_and_attribute(self):
+        events = []
+        mqtt.add_listener(lambda d, a, old, new: events.append(("door", d.id, a)), devices=[56])
+        mqtt.add_listener(lambda d, a, old, new: events.append(("battery", d.id, a)), attributes=["battery"])
+        mqtt.add_listener(lambda d, a, old, new: events.append(("door battery", d.id, a)), devices=[56], attributes=["battery"])
+        for contact, switch, battery in (("closed", "off", "100"), ("open", "on", "99")):
+            _receive([_doc(id=56, attributes={"contact": contact, "battery": battery})])
+            _receive([_doc(id=17, attributes={"switch": switch, "battery": battery})])
+        assert events == [
+            ("door", 56, "contact"),
+            ("door", 56, "battery"),
+            ("battery", 56, "battery"),
+            ("door battery", 56, "battery"),
+            ("battery", 17, "battery"),
+        ]
+
+    def test_listener_calls_and_time_recorded(self):
+        def on_contact(d, a, old, new):
+            pass
+
+        before = metrics.histogram("mqtt_listener").snapshot().get(on_contact.__qualname__, {}).get("count", 0)
+        mqtt.add_listener(on_contact, attributes=["contact"])
+        _receive([_doc(id=56, attributes={"contact": "closed", "battery": "100"})])
+        _receive([_doc(id=56, attributes={"contact": "open", "battery": "100"})])
+        assert metrics.histogram("mqtt_listener").snapshot()[on_contact.__qualname__]["count"] == before + 1
+
+
+class TestListenerQueues:
+    @pytest.fixture(autouse=True)
+    def gate(self):
+        self.gate = threading.Event()  # queued listeners block on it until released
+        self.started = threading.Semaphore(0)
+        self.delivered = threading.Semaphore(0)
+        self.events = []
+        yield
+        self.gate.set()
+
+    def slow(self, d, a, old, new):
+        self.started.release()
+        self.gate.wait(5)
+        self.events.append((threading.current_thread().name, a, old, new))
+        self.delivered.release()
+
+    def test_queued_listener_runs_off_thread_in_order(self):
+        inline = []
+        mqtt.add_listener(self.slow, attributes=["contact"], queue=8)
+        mqtt.add_listener(lambda d, a, old, new: inline.append(new), attributes=["contact"])
+        for contact in ("closed", "open", "closed", "open"):
+            _receive([_doc(id=56, attributes={"contact": contact})])
+        assert inline == ["open", "closed", "open"]  # the mqtt thread never waited on the slow listener
+        self.gate.set()
+        assert all(self.delivered.acquire(timeout=5) for _ in range(3))
+        assert [(a, old, new) for _, a, old, new in self.events] == [
+            ("contact", "closed", "open"),
+            ("contact", "open", "closed"),
+            ("contact", "closed", "open"),
+        ]
+        assert all(name != threading.current_thread().name for name, *_ in self.events)
+        assert metrics.histogram("mqtt_listener_lag").snapshot()[self.slow.__qualname__]["count"] >= 3
+
+    def test_full_queue_drops_new_events(self):
+        dropped = metrics.counter("mqtt_listener_queue").get(f"{self.slow.__qualname__}:dropped")
+        mqtt.add_external_listener(self.slow, queue=1)
+        _receive([_doc(id=17, attributes={"switch": "off"})])
+        _receive([_doc(id=17, attributes={"switch": "on"})])
+        assert self.started.acquire(timeout=5)  # the worker holds it, waiting on the gate
+        _receive([_doc(id=17, attributes={"switch": "off"})])  # queued
+        _receive([_doc(id=17, attributes={"switch": "on"})])  # over the limit
+        self.gate.set()
+        assert all(self.delivered.acquire(timeout=5) for _ in range(2))
+        assert [new for *_, new in self.events] == ["on", "off"]
+        assert metrics.counter("mqtt_listener_queue").get(f"{self.slow.__qualname__}:dropped") == dropped + 1
+
+    def test_coalesce_keeps_queued_old_and_takes_latest_new(self):
+        coalesced = metrics.counter("mqtt_listener_queue").get(f"{self.slow.__qualname__}:coalesced")
+        mqtt.add_listener(self.slow, attributes=["level"], queue=8, coalesce=True)
+        _receive([_doc(id=17, attributes={"level": "20"})])
+        _receive([_doc(id=17, attributes={"level": "40"})])
+        assert self.started.acquire(timeout=5)
+        _receive([_doc(id=17, attributes={"level": "60"})])  # queued
+        _receive([_doc(id=17, attributes={"level": "80"})])  # folded into it
+        self.gate.set()
+        assert all(self.delivered.acquire(timeout=5) for _ in range(2))
+        assert [(old, new) for *_, old, new in self.events] == [("20", "40"), ("40", "80")]
+        assert metrics.counter("mqtt_listener_queue").get(f"{self.slow.__qualname__}:coalesced") == coalesced + 1
 
 
 def _button_msg(event_type, device_id=10, button=1):
@@ -218,26 +404,122 @@ class TestPublishLight:
             mqtt.publish_light(orc.Light.a, on=True)
 
 
+class TestPublishPacing:
+    @pytest.fixture(autouse=True)
+    def publisher(self, monkeypatch):
+        self.published = []
+        self.sent = threading.Semaphore(0)
+
+        def publish(topic, payload=None):
+            self.published.append((time.monotonic(), topic.rsplit("/", 3)[1] + "/" + topic.rsplit("/", 1)[1], payload))
+            self.sent.release()
+
+        client = SimpleNamespace(publish=publish)
+        monkeypatch.setattr(mqtt, "_client", None)
+        monkeypatch.setattr(mqtt, "_new_client", lambda *args: client)
+        monkeypatch.setattr(mqtt, "_hub_id", HUB)
+        self.pace(monkeypatch, rate=0.01, burst=1)
+        yield
+        mqtt.stop()
+
+    @staticmethod
+    def pace(monkeypatch, rate, burst):
+        monkeypatch.setattr(config, "settings", config.settings._replace(mqtt_rate=rate, mqtt_burst=burst))
+        mqtt.start()
+
+    @staticmethod
+    def queue(light, **kwargs):
+        """publish_light on a thread of its own, returned once the command is queued (publish_light waits for the send)."""
+        waiting = sum(len(queued.waiters) for queued in mqtt._outbox.values())
+        thread = threading.Thread(target=mqtt.publish_light, args=(light,), kwargs=kwargs)
+        thread.start()
+        deadline = time.monotonic() + 5
+        while sum(len(queued.waiters) for queued in mqtt._outbox.values()) == waiting:
+            assert time.monotonic() < deadline
+            time.sleep(0.001)
+        return thread
+
+    def test_queued_command_superseded_in_place(self):
+        superseded = metrics.counter("mqtt_outbox").get("superseded")
+        mqtt.publish_light(orc.Light.c, on=True)  # the burst; the bucket is empty for the next 100s
+        callers = [self.queue(orc.Light.a, on=True), self.queue(orc.Light.b, on=True), self.queue(orc.Light.a, brightness=30)]
+        mqtt.stop()  # sends what's queued without waiting for tokens
+        for caller in callers:
+            caller.join(5)
+            assert not caller.is_alive()  # the superseded caller is answered by the send that replaced it
+        assert [(device, payload) for _, device, payload in self.published] == [("3/on", None), ("1/setLevel", "30"), ("2/on", None)]
+        assert metrics.counter("mqtt_outbox").get("superseded") == superseded + 1
+
+    def test_failed_send_raises_in_caller(self, monkeypatch):
+        mqtt.stop()
+        self.pace(monkeypatch, rate=20, burst=1)
+        monkeypatch.setattr(mqtt._client, "publish", MagicMock(side_effect=OSError("broker gone")))
+        failed = metrics.counter("mqtt_outbox").get("failed")
+        with pytest.raises(OSError, match="broker gone"):
+            mqtt.publish_light(orc.Light.a, on=True)
+        assert metrics.counter("mqtt_outbox").get("failed") == failed + 1
+
+    def test_publisher_failure_falls_back_to_direct(self, monkeypatch):
+        mqtt.stop()
+        monkeypatch.setattr(mqtt, "_pace", MagicMock(side_effect=RuntimeError("bug")))
+        mqtt.start()
+        mqtt._publisher.join(5)
+        mqtt.publish_light(orc.Light.a, on=True)
+        assert [device for _, device, _ in self.published] == ["1/on"]
+
+    def test_paced_after_burst(self, monkeypatch):
+        mqtt.stop()
+        self.pace(monkeypatch, rate=20, burst=1)
+        for light in (orc.Light.a, orc.Light.b, orc.Light.c):
+            mqtt.publish_light(light, on=False)
+        assert all(self.sent.acquire(timeout=5) for _ in range(3))
+        first, _, last = (sent for sent, _, _ in self.published)
+        assert last - first >= 0.09  # two refills at 20/s
+        assert metrics.histogram("mqtt_outbox_wait").snapshot()["off"]["count"] >= 3
+
+    def test_direct_before_start(self):
+        mqtt.stop()
+        mqtt.publish_light(orc.Light.a, on=True)
+        assert [device for _, device, _ in self.published] == ["1/on"]
+
+
 class TestFetchHubitatConfig:
     class FakeClient:
         """Replays retained documents through the on_message callback at loop_start,
-        like the broker's retained flood."""
+        like the broker's retained flood, then echoes what was published to a
+        subscribed topic, as the broker does behind the flood."""
 
         def __init__(self, *a, **k):
             self.docs = []
+            self.subscribed = set()
+            self.published = []
+            self.echo = True
 
         def username_pw_set(self, user, password):
             pass
 
+        def user_data_set(self, userdata):
+            self.userdata = userdata
+
         def reconnect_delay_set(self, min_delay, max_delay):
             pass
 
         def connect_async(self, host, port, keepalive):
             pass
 
+        def subscribe(self, topics):
+            self.subscribed.update(topic for topic, _ in topics)
+
+        def publish(self, topic, payload=None):
+            self.published.append(topic)
+
         def loop_start(self):
+            self.on_connect(self, self.userdata, {}, 0)
             for doc in self.docs:
-                self.on_message(self, None, _msg(f"hubitat/{HUB}/devices/{doc['id']}", doc))
+                self.on_message(self, self.userdata, _msg(f"hubitat/{HUB}/devices/{doc['id']}", doc))
+            for topic in self.published if self.echo else ():
+                if topic in self.subscribed:
+                    self.on_message(self, self.userdata, _msg(topic, b"", retain=False))
 
         def loop_stop(self):
             pass
@@ -245,10 +527,10 @@ class TestFetchHubitatConfig:
         def disconnect(self):
             pass
 
-    def _fetch(self, monkeypatch, docs, timeout=1.0, secrets=None):
-        fake = self.FakeClient()
-        fake.docs = docs
-        monkeypatch.setattr(mqtt.mqtt, "Client", lambda *a, **k: fake)
+    def _fetch(self, monkeypatch, docs, timeout=1.0, secrets=None, echo=True):
+        self.fake = self.FakeClient()
+        self.fake.docs, self.fake.echo = docs, echo
+        monkeypatch.setattr(mqtt.mqtt, "Client", lambda *a, **k: self.fake)
         return mqtt.fetch_hubitat_config(secrets or m.Secrets(mqtt_user="u", mqtt_password="p"), timeout=timeout)
 
     def test_maps_name_to_id_and_infers_dimmable_from_level(self, monkeypatch):
@@ -262,9 +544,48 @@ class TestFetchHubitatConfig:
             "office floor lamp": (1, frozenset()),
         }
 
+    def test_settles_on_sentinel_without_waiting_out_the_timeout(self, monkeypatch):
+        started = time.monotonic()
+        self._fetch(monkeypatch, [_doc(id=17)], timeout=30)
+        assert time.monotonic() - started < 5
+        times = metrics.histogram("mqtt_settle").snapshot()
+        assert times["flood"]["count"] >= 1 and times["lag"]["count"] >= 1
+        assert metrics.counter("mqtt_settle").get("sentinel") >= 1
+
+    def test_reconnect_skips_the_sentinel(self, monkeypatch):
+        self._fetch(monkeypatch, [_doc(id=17)])
+        self.fake.published.clear()
+        self.fake.on_connect(self.fake, self.fake.userdata, {}, 0)
+        assert self.fake.published == []
+
+    def test_unanswered_sentinel_falls_back_to_quiet_period(self, monkeypatch, caplog):
+        quiet = metrics.counter("mqtt_settle").get("quiet")
+        started = time.monotonic()
+        found = self._fetch(monkeypatch, [_doc(id=17)], timeout=30, echo=False)
+        assert time.monotonic() - started < 5
+        assert found == {"entrance bulb 1": (17, frozenset([m.Capability.change_level]))}
+        assert metrics.counter("mqtt_settle").get("quiet") == quiet + 1
+        assert "not settled" not in caplog.text
+
+    def test_silent_broker_waits_out_the_timeout(self, monkeypatch, caplog):
+        with pytest.raises(RuntimeError, match="no device documents"):
+            self._fetch(monkeypatch, [], timeout=0.3, echo=False)
+        assert "not settled" in caplog.text
+
+    def test_start_keeps_the_discovery_connection(self, monkeypatch):
+        self._fetch(monkeypatch, [_doc(id=17)])
+        monkeypatch.setattr(mqtt, "_new_client", lambda *args: pytest.fail("second connection"))
+        reused = metrics.histogram("mqtt_settle").snapshot().get("reused", {}).get("count", 0)
+        mqtt.start()
+        mqtt.stop()
+        assert mqtt._client is self.fake
+        assert [d.id for d in mqtt.snapshot()] == [17]
+        assert metrics.histogram("mqtt_settle").snapshot()["reused"]["count"] == reused + 1
+
     def test_missing_credentials_fails_boot(self, monkeypatch):
         with pytest.raises(RuntimeError, match="no device documents"):
             self._fetch(monkeypatch, [], timeout=0.1, secrets=m.Secrets())
+        assert mqtt._client is None
 
     def test_empty_flood_fails_boot(self, monkeypatch):
         with pytest.raises(RuntimeError, match="no device documents"):
@@ -5,7 +5,7 @@ import pytest
 from flask import Flask
 
 import orc
-from orc import api, config
+from orc import api, config, metrics
 from orc import model as m
 from orc.view import VersionManager, bp
 
@@ -269,6 +269,34 @@ def test_durations_returns_config(client):
     assert response.get_json() == {"TV Lights": {"avg": 3.0, "samples": 4}, "Reset": {"avg": 0.5, "samples": 2}}
 
 
+def test_duration_cache_counters_on_metrics(client):
+    client.get("/api/durations")
+    before = client.get("/api/metrics").get_json()["counters"]["duration_cache"]
+    client.get("/api/durations")
+    after = client.get("/api/metrics").get_json()["counters"]["duration_cache"]
+    assert after == {**before, "hits": before.get("hits", 0) + 1}
+
+
+# --- /api/metrics ---
+
+
+def test_metrics_reports_counters_and_histograms(client):
+    metrics.counter("test_counter").inc("hit")
+    metrics.histogram("test_latency").observe("play", 0.3)
+    body = client.get("/api/metrics").get_json()
+    assert body["counters"]["test_counter"]["hit"] >= 1
+    latency = body["histograms"]["test_latency"]["play"]
+    assert latency["buckets"]["le_0.5"] >= 1 and latency["count"] == sum(latency["buckets"].values())
+
+
+def test_devices_reports_changes_since_version(client):
+    door = m.DeviceState(id=56, name="balcony door", attributes={"contact": "open"}, last_activity=None)
+    with patch.object(api, "device_changes", return_value=(7, [door])) as changes:
+        body = client.get("/api/devices?since=5").get_json()
+    changes.assert_called_once_with(5)
+    assert body == {"version": 7, "devices": [{"id": 56, "name": "balcony door", "attributes": {"contact": "open"}, "last_activity": None}]}
+
+
 # --- /api/schedule/<id>/pause: toggles pause/resume ---
 
 